@@ -0,0 +1,604 @@
+from contextlib import ExitStack
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import subprocess
+from tempfile import TemporaryDirectory
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import click
+import numpy as np
+
+from kipoi_veff2 import merge
+from kipoi_veff2 import model_cache
+from kipoi_veff2 import output
+from kipoi_veff2 import profiling
+from kipoi_veff2 import tuning
+from kipoi_veff2 import variant_centered
+
+BENCHMARK_VERSION = 1
+# Stub models mimicking the input and output tensors of kipoi models. The
+# model group of a stub model determines its configuration, see
+# variant_centered.VARIANT_CENTERED_MODEL_GROUP_CONFIGS.
+STUB_MODELS = {
+    "DeepSEA/stub": {
+        "sequence_length": 1000,
+        "target_shape": [919],
+        "dataloader_args": {
+            "alphabet_axis": 0,
+            "dummy_axis": 1,
+            "dtype": "np.float32",
+        },
+    },
+    "Basset/stub": {
+        "sequence_length": 600,
+        "target_shape": [164],
+        "dataloader_args": {"alphabet_axis": 0, "dummy_axis": 2},
+    },
+    "Basenji/stub": {
+        "sequence_length": 131072,
+        "target_shape": [960, 4229],
+        "dataloader_args": {"alphabet_axis": 1},
+    },
+}
+DEFAULT_MODELS = ["DeepSEA/stub", "Basset/stub"]
+STAGES = [
+    "vcf_parse",
+    "extraction",
+    "encoding",
+    "prediction",
+    "scoring",
+    "writing",
+    "merge",
+    "end_to_end",
+]
+# Number of hidden units of the stub models
+HIDDEN_UNITS = 32
+# Bases of the synthetic genome between the variants and the ends of the
+# contigs, so that the windows of all stub models fit into the contigs
+CONTIG_MARGIN = 70000
+
+
+class StubModel:
+    """This class is a local stand-in for a kipoi model. It infers with a
+    small two layer network on the one hot encoded sequences and repeats
+    its output along the leading dimensions of the target shape, so that
+    its predictions have the shape and the dtype of the predictions of the
+    mimicked model."""
+
+    def __init__(self, sequence_length: int, target_shape: List[int]):
+        random_state = np.random.RandomState(0)
+        self.target_shape = tuple(target_shape)
+        self.weights = random_state.normal(
+            size=(sequence_length * 4, HIDDEN_UNITS)
+        ).astype(np.float32) / np.sqrt(sequence_length)
+        self.output_weights = random_state.normal(
+            size=(HIDDEN_UNITS, self.target_shape[-1])
+        ).astype(np.float32)
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        hidden = np.maximum(
+            np.asarray(batch, dtype=np.float32).reshape(len(batch), -1)
+            @ self.weights,
+            0,
+        )
+        predictions = 1 / (1 + np.exp(-(hidden @ self.output_weights)))
+        return np.ascontiguousarray(
+            np.broadcast_to(
+                predictions.reshape(
+                    (len(batch),)
+                    + (1,) * (len(self.target_shape) - 1)
+                    + self.target_shape[-1:]
+                ),
+                (len(batch),) + self.target_shape,
+            )
+        )
+
+
+def register_stub_models() -> None:
+    """This function registers the stub models under their names, so that
+    they are scored like kipoi models"""
+    for model, stub_model in STUB_MODELS.items():
+        model_cache.register_model(
+            model,
+            StubModel(
+                stub_model["sequence_length"], stub_model["target_shape"]
+            ),
+            model_cache.ModelDescription(
+                column_labels=None,
+                target_shape=stub_model["target_shape"],
+                default_dataloader=model_cache.DataloaderDescription(
+                    defined_as="kipoiseq.dataloaders.SeqIntervalDl",
+                    default_args=dict(
+                        stub_model["dataloader_args"],
+                        auto_resize_len=stub_model["sequence_length"],
+                    ),
+                ),
+                version="stub",
+            ),
+        )
+
+
+def get_model_config(
+    model: str, batch_size: Optional[int] = None
+) -> variant_centered.ModelConfig:
+    """This function returns the model configuration of a stub model with
+    the configuration of its model group"""
+    model_group_config_dict = dict(
+        variant_centered.VARIANT_CENTERED_MODEL_GROUP_CONFIGS.get(
+            model.split("/")[0], {}
+        )
+    )
+    if (
+        batch_size is not None
+        and model_group_config_dict.get("batch_size", batch_size) != 1
+    ):
+        model_group_config_dict["batch_size"] = batch_size
+    return variant_centered.get_model_config(model, **model_group_config_dict)
+
+
+def write_synthetic_inputs(
+    input_dir: Union[str, Path],
+    number_of_variants: int,
+    indel_fraction: float = 0.1,
+    number_of_contigs: int = 2,
+    seed: int = 0,
+) -> Tuple[str, str]:
+    """This function writes a random genome to genome.fa and
+    number_of_variants random variants to variants.vcf in input_dir. The
+    variants are sorted and split evenly between the contigs. A fraction
+    of indel_fraction of them are insertions or deletions of 1 to 5 bases,
+    half of each. The paths of the fasta file and the vcf file are
+    returned."""
+    random_state = np.random.RandomState(seed)
+    variants_per_contig = -(-number_of_variants // number_of_contigs)
+    contig_length = 2 * CONTIG_MARGIN + 20 * variants_per_contig
+    fasta_file = str(Path(input_dir, "genome.fa"))
+    vcf_file = str(Path(input_dir, "variants.vcf"))
+    contigs = {}
+    with open(fasta_file, "w") as fasta:
+        for contig_index in range(number_of_contigs):
+            chrom = f"chr{contig_index + 1}"
+            sequence = "".join(
+                random_state.choice(list("ACGT"), contig_length)
+            )
+            contigs[chrom] = sequence
+            fasta.write(f">{chrom}\n")
+            for start in range(0, contig_length, 60):
+                fasta.write(sequence[start : start + 60] + "\n")
+    with open(vcf_file, "w") as vcf:
+        vcf.write("##fileformat=VCFv4.2\n")
+        for chrom, sequence in contigs.items():
+            vcf.write(f"##contig=<ID={chrom},length={len(sequence)}>\n")
+        vcf.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        variant_index = 0
+        for chrom, sequence in contigs.items():
+            number_of_contig_variants = min(
+                variants_per_contig, number_of_variants - variant_index
+            )
+            positions = np.sort(
+                random_state.choice(
+                    np.arange(CONTIG_MARGIN, contig_length - CONTIG_MARGIN),
+                    number_of_contig_variants,
+                    replace=False,
+                )
+            )
+            variant_types = random_state.choice(
+                ["snv", "insertion", "deletion"],
+                number_of_contig_variants,
+                p=[1 - indel_fraction, indel_fraction / 2, indel_fraction / 2],
+            )
+            for pos, variant_type in zip(positions, variant_types):
+                ref = sequence[pos - 1]
+                length = random_state.randint(1, 6)
+                if variant_type == "snv":
+                    alt = random_state.choice(
+                        [base for base in "ACGT" if base != ref]
+                    )
+                elif variant_type == "insertion":
+                    alt = ref + "".join(
+                        random_state.choice(list("ACGT"), length)
+                    )
+                else:
+                    ref = sequence[pos - 1 : pos + length]
+                    alt = ref[0]
+                vcf.write(
+                    f"{chrom}\t{pos}\tvar{variant_index}\t{ref}\t{alt}"
+                    "\t.\t.\t.\n"
+                )
+                variant_index += 1
+    return fasta_file, vcf_file
+
+
+def get_models(settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """This function gathers everything needed to score variants with the
+    stub models of the benchmark, see variant_centered.get_models"""
+    return variant_centered.get_models(
+        [
+            get_model_config(model, settings["batch_size"])
+            for model in settings["models"]
+        ],
+        [],
+    )
+
+
+def get_output_files(settings: Dict[str, Any], output_dir: str) -> List[str]:
+    """This function returns the output file of every model"""
+    return [
+        str(Path(output_dir, f"{model.replace('/', '_')}.tsv"))
+        for model in settings["models"]
+    ]
+
+
+def run_batch_stage(
+    settings: Dict[str, Any], stage: str, output_dir: str
+) -> profiling.StageProfile:
+    """This function streams the synthetic variants batch by batch
+    through the stages of variant centered scoring up to the timed stage
+    and returns the profile of this stage. The stages are reading the vcf
+    file, extracting sequences, one hot encoding them, inferring, scoring
+    and writing the scores to one output file per model. From inference
+    on, every batch is scored with variant_centered.score_batch."""
+    models = get_models(settings)
+    last_stage = STAGES.index(stage)
+    sequence_length = max(model["sequence_length"] for model in models)
+    variant_extractor, genome_index = variant_centered.get_variant_extractor(
+        settings["fasta_file"]
+    )
+    profiler = profiling.enable()
+    batches = profiling.iterate(
+        "vcf_parse",
+        variant_centered.batcher(
+            variant_centered.read_variants(settings["vcf_file"]),
+            max(model["config"].get_variants_per_batch() for model in models),
+        ),
+    )
+    with ExitStack() as stack:
+        stack.callback(profiling.disable)
+        outputs = []
+        if stage == "writing":
+            for model, output_file in zip(
+                models, get_output_files(settings, output_dir)
+            ):
+                outputs.append(
+                    output.get_output(
+                        "tsv", output_file, model["column_labels"]
+                    )
+                )
+                stack.enter_context(outputs[-1])
+        for batch in batches:
+            if last_stage > STAGES.index("encoding"):
+                # Inference and scoring run through score_batch like in
+                # kipoi_veff2_predict. score_batch starts the next batch.
+                refs, alts = variant_centered.extract_sequences(
+                    variant_extractor, genome_index, batch, sequence_length
+                )
+                batch_scores = variant_centered.score_batch(
+                    models, refs, alts, batch
+                )
+                if stage == "writing":
+                    variant_centered.write_rows(outputs, batch, batch_scores)
+                continue
+            profiling.next_batch()
+            if last_stage < STAGES.index("extraction"):
+                continue
+            refs, alts = variant_centered.extract_sequences(
+                variant_extractor, genome_index, batch, sequence_length
+            )
+            if stage == "extraction":
+                continue
+            snv_bases = [
+                variant.alt if variant_centered.is_snv(variant) else None
+                for variant in batch
+            ]
+            for model in models:
+                chunk_size = model["config"].get_variants_per_batch()
+                for start in range(0, len(batch), chunk_size):
+                    end = start + chunk_size
+                    variant_centered.encode_ref_alt_batch(
+                        model["transform"],
+                        variant_centered.crop_sequences(
+                            refs[start:end], model["sequence_length"]
+                        ),
+                        np.arange(len(refs[start:end])),
+                        variant_centered.crop_sequences(
+                            alts[start:end], model["sequence_length"]
+                        ),
+                        snv_bases[start:end],
+                    )
+    return profiler.stages.get(stage, profiling.StageProfile())
+
+
+def run_stage(
+    settings: Dict[str, Any], stage: str, output_dir: str
+) -> Dict[str, Any]:
+    """This function runs a single stage of the benchmark and returns the
+    wall and cpu time spent in it along with the peak memory of the
+    process. The merge stage merges the output files of an end to end
+    run in output_dir."""
+    if stage in ["merge", "end_to_end"]:
+        output_files = get_output_files(settings, output_dir)
+        profiler = profiling.Profiler()
+        with profiler.stage(stage):
+            if stage == "merge":
+                merge.merge_tsvs(
+                    output_files, str(Path(output_dir, "merged.tsv"))
+                )
+            else:
+                run_end_to_end(settings, output_files)
+        stage_profile = profiler.stages[stage]
+    else:
+        stage_profile = run_batch_stage(settings, stage, output_dir)
+    return {
+        "seconds": stage_profile.seconds,
+        "cpu_seconds": stage_profile.cpu_seconds,
+        "calls": stage_profile.calls,
+        "peak_memory": tuning.get_peak_memory(),
+    }
+
+
+def run_end_to_end(settings: Dict[str, Any], output_files: List[str]) -> None:
+    """This function scores the synthetic variants with all models into
+    one output file per model like kipoi_veff2_predict --output-per-model"""
+    variant_centered.score_variants_multi_model(
+        [
+            get_model_config(model, settings["batch_size"])
+            for model in settings["models"]
+        ],
+        settings["vcf_file"],
+        settings["fasta_file"],
+        output_files,
+        workers=settings["workers"],
+    )
+
+
+def run_stage_in_child(settings: Dict[str, Any], stage: str) -> Dict[str, Any]:
+    """This function runs a stage in a forked process, so that the peak
+    memory of every stage is measured separately. The output files merged
+    by the merge stage are scored in another process beforehand, so that
+    the peak memory of the merge stage is the one of merging."""
+    with TemporaryDirectory() as output_dir:
+        if stage == "merge":
+            with multiprocessing.get_context("fork").Pool(1) as pool:
+                pool.apply(run_stage, (settings, "end_to_end", output_dir))
+        with multiprocessing.get_context("fork").Pool(1) as pool:
+            return pool.apply(run_stage, (settings, stage, output_dir))
+
+
+def get_commit() -> Optional[str]:
+    """This function returns the git commit of kipoi_veff2 if it is run
+    from a git checkout"""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def run_benchmark(
+    number_of_variants: int = 10000,
+    indel_fraction: float = 0.1,
+    models: List[str] = DEFAULT_MODELS,
+    stages: List[str] = STAGES,
+    batch_size: Optional[int] = None,
+    workers: int = 1,
+    seed: int = 0,
+    progress: Callable[[str], None] = lambda message: None,
+) -> Dict[str, Any]:
+    """This function measures the throughput of kipoi_veff2 with stub
+    models on synthetic inputs. Every stage is run in its own process and
+    reports its wall and cpu time, the variants scored per second and the
+    peak memory of the process. A batch size overrides the batch size of
+    all models except Basenji.
+
+    Raises:
+        ValueError: If a model or a stage is unknown
+    """
+    unknown = [model for model in models if model not in STUB_MODELS] + [
+        stage for stage in stages if stage not in STAGES
+    ]
+    if unknown:
+        raise ValueError(
+            f"Unknown model(s) or stage(s) {', '.join(unknown)}. Available \
+                models are {', '.join(STUB_MODELS)} and stages are \
+                {', '.join(STAGES)}"
+        )
+    register_stub_models()
+    with TemporaryDirectory() as input_dir:
+        fasta_file, vcf_file = write_synthetic_inputs(
+            input_dir, number_of_variants, indel_fraction, seed=seed
+        )
+        settings = {
+            "variants": number_of_variants,
+            "indel_fraction": indel_fraction,
+            "models": list(models),
+            "batch_size": batch_size,
+            "workers": workers,
+            "seed": seed,
+            "fasta_file": fasta_file,
+            "vcf_file": vcf_file,
+        }
+        results = {}
+        for stage in stages:
+            progress(f"Running {stage}")
+            result = run_stage_in_child(settings, stage)
+            result["variants_per_second"] = (
+                number_of_variants / result["seconds"]
+                if result["seconds"] > 0
+                else None
+            )
+            results[stage] = result
+    for input_file in ["fasta_file", "vcf_file"]:
+        del settings[input_file]
+    return {
+        "version": BENCHMARK_VERSION,
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "baseline_memory": tuning.get_peak_memory(),
+        "stages": results,
+    }
+
+
+def get_ratio(numerator: float, denominator: float) -> Optional[float]:
+    """This function returns numerator / denominator, or None if the
+    denominator is not positive, for instance for a stage too fast to be
+    timed"""
+    return numerator / denominator if denominator > 0 else None
+
+
+def compare_benchmarks(
+    baseline: Dict[str, Any], benchmark: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """This function compares the stages two benchmarks have in common.
+    A speedup greater than 1 means that benchmark is faster than
+    baseline."""
+    return [
+        {
+            "stage": stage,
+            "baseline_seconds": baseline["stages"][stage]["seconds"],
+            "seconds": result["seconds"],
+            "speedup": get_ratio(
+                baseline["stages"][stage]["seconds"], result["seconds"]
+            ),
+            "memory_ratio": get_ratio(
+                result["peak_memory"],
+                baseline["stages"][stage]["peak_memory"],
+            ),
+        }
+        for stage, result in benchmark["stages"].items()
+        if stage in baseline["stages"]
+    ]
+
+
+@click.group()
+def benchmark() -> None:
+    """Measure the throughput of kipoi_veff2 offline with stub models on
+    synthetic inputs"""
+
+
+@benchmark.command()
+@click.argument("output_json", required=True, type=click.Path())
+@click.option(
+    "--variants",
+    "number_of_variants",
+    default=10000,
+    type=click.IntRange(min=1),
+    help="Number of synthetic variants.",
+)
+@click.option(
+    "--indel-fraction",
+    "indel_fraction",
+    default=0.1,
+    type=click.FloatRange(min=0, max=1),
+    help="Fraction of the variants which are insertions or deletions.",
+)
+@click.option(
+    "-m",
+    "--model",
+    "models",
+    multiple=True,
+    type=click.Choice(list(STUB_MODELS)),
+    help="Score with this stub model. Can be given multiple times.\
+        DeepSEA/stub and Basset/stub by default.",
+)
+@click.option(
+    "--stage",
+    "stages",
+    multiple=True,
+    type=click.Choice(STAGES),
+    help="Only run this stage. Can be given multiple times. All stages by\
+        default.",
+)
+@click.option(
+    "--batch-size",
+    "batch_size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Batch size of all models except Basenji.",
+)
+@click.option(
+    "--workers",
+    "workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of worker processes of the end to end stage.",
+)
+@click.option(
+    "--seed", "seed", default=0, type=int, help="Seed of the inputs."
+)
+def run(
+    output_json: str,
+    number_of_variants: int,
+    indel_fraction: float,
+    models: Tuple[str, ...],
+    stages: Tuple[str, ...],
+    batch_size: Optional[int],
+    workers: int,
+    seed: int,
+) -> None:
+    """Run the benchmark and write the results to a json file"""
+    results = run_benchmark(
+        number_of_variants,
+        indel_fraction,
+        list(models) or DEFAULT_MODELS,
+        list(stages) or STAGES,
+        batch_size,
+        workers,
+        seed,
+        progress=lambda message: click.echo(message, err=True),
+    )
+    with open(output_json, "w") as results_json:
+        json.dump(results, results_json, indent=1)
+    click.echo(f"{'stage':<12}{'seconds':>10}{'variants/s':>14}{'MiB':>10}")
+    for stage, result in results["stages"].items():
+        click.echo(
+            f"{stage:<12}{result['seconds']:>10.3f}"
+            f"{result['variants_per_second'] or 0:>14.1f}"
+            f"{result['peak_memory'] / 2**20:>10.1f}"
+        )
+
+
+@benchmark.command()
+@click.argument("baseline_json", required=True, type=click.Path(exists=True))
+@click.argument("benchmark_json", required=True, type=click.Path(exists=True))
+def compare(baseline_json: str, benchmark_json: str) -> None:
+    """Compare the results of a benchmark with the results of a baseline
+    benchmark, for instance of an earlier commit"""
+    with open(baseline_json, "r") as baseline_handle, open(
+        benchmark_json, "r"
+    ) as benchmark_handle:
+        comparison = compare_benchmarks(
+            json.load(baseline_handle), json.load(benchmark_handle)
+        )
+    click.echo(f"{'stage':<12}{'baseline s':>12}{'s':>10}{'speedup':>10}")
+    for stage in comparison:
+        speedup = (
+            "n/a" if stage["speedup"] is None else f"{stage['speedup']:.2f}"
+        )
+        click.echo(
+            f"{stage['stage']:<12}{stage['baseline_seconds']:>12.3f}"
+            f"{stage['seconds']:>10.3f}{speedup:>10}"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
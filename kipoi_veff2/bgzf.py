@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import struct
+from typing import List, Union
+import warnings
+import zlib
+
+BGZF_SUFFIXES = (".gz", ".bgz")
+# Like htslib, blocks hold at most 0xff00 bytes of uncompressed data so
+# that a compressed block never exceeds the BGZF limit of 64 KiB
+BGZF_BLOCK_SIZE = 0xFF00
+BGZF_COMPRESSION_LEVEL = 6
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_TRAILER = struct.Struct("<II")
+# The empty block which marks the end of a BGZF file
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+
+def is_bgzf_file(output_file: Union[str, Path]) -> bool:
+    """This function returns True if the output file should be written
+    BGZF compressed which is the case for a .gz or .bgz suffix"""
+    return str(output_file).endswith(BGZF_SUFFIXES)
+
+
+def compress_block(data: bytes) -> bytes:
+    """This function compresses up to BGZF_BLOCK_SIZE bytes into a BGZF
+    block, which is a gzip member whose header records its size"""
+    compressor = zlib.compressobj(
+        BGZF_COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS
+    )
+    compressed = compressor.compress(data) + compressor.flush()
+    block_size = BGZF_HEADER.size + len(compressed) + BGZF_TRAILER.size
+    return (
+        BGZF_HEADER.pack(
+            31, 139, 8, 4, 0, 0, 255, 6, ord("B"), ord("C"), 2, block_size - 1
+        )
+        + compressed
+        + BGZF_TRAILER.pack(zlib.crc32(data), len(data))
+    )
+
+
+class BgzfWriter:
+    """This class writes text to a BGZF compressed file which can be read
+    with gzip, zcat or pandas and indexed with tabix. Text is buffered and
+    compressed in blocks of BGZF_BLOCK_SIZE bytes. If threads is greater
+    than 1, the blocks of a write are compressed in as many threads, since
+    zlib releases the GIL. flush writes the buffered text as a shorter
+    block, so the file always ends at a block boundary after a flush and
+    can be truncated there and appended to. This is what checkpoints
+    rely on."""
+
+    def __init__(
+        self,
+        output_file: Union[str, Path],
+        append: bool = False,
+        threads: int = 1,
+    ) -> None:
+        self.handle = open(output_file, "ab" if append else "wb")
+        self.buffer = bytearray()
+        self.executor = ThreadPoolExecutor(threads) if threads > 1 else None
+
+    def compress_blocks(self, blocks: List[bytes]) -> None:
+        if self.executor is None:
+            compressed_blocks = map(compress_block, blocks)
+        else:
+            compressed_blocks = self.executor.map(compress_block, blocks)
+        self.handle.write(b"".join(compressed_blocks))
+
+    def write(self, text: str) -> None:
+        self.buffer += text.encode()
+        if len(self.buffer) < BGZF_BLOCK_SIZE:
+            return
+        full_size = len(self.buffer) - len(self.buffer) % BGZF_BLOCK_SIZE
+        self.compress_blocks(
+            [
+                bytes(self.buffer[start : start + BGZF_BLOCK_SIZE])
+                for start in range(0, full_size, BGZF_BLOCK_SIZE)
+            ]
+        )
+        del self.buffer[:full_size]
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.compress_blocks([bytes(self.buffer)])
+            self.buffer.clear()
+        self.handle.flush()
+
+    def fileno(self) -> int:
+        return self.handle.fileno()
+
+    def close(self) -> None:
+        self.flush()
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self) -> "BgzfWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def build_tabix_index(output_file: Union[str, Path]) -> None:
+    """This function builds a tabix index of a BGZF compressed output file
+    on its #CHROM and POS columns, which requires pysam. If pysam is not
+    installed or the file can not be indexed, a warning is issued
+    instead."""
+    try:
+        import pysam
+    except ImportError:
+        warnings.warn(
+            f"Indexing {output_file} requires pysam. Please install it \
+                with pip install pysam or index the file with tabix -s 1 \
+                -b 2 -e 2."
+        )
+        return
+    try:
+        pysam.tabix_index(
+            str(output_file),
+            seq_col=0,
+            start_col=1,
+            end_col=1,
+            meta_char="#",
+            force=True,
+        )
+    except (OSError, ValueError) as err:
+        warnings.warn(f"Could not index {output_file}: {err}")
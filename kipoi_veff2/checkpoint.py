@@ -0,0 +1,147 @@
+import itertools
+import json
+import os
+from pathlib import Path
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+import warnings
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+CHECKPOINT_VERSION = 1
+
+
+def get_checkpoint_file(output_file: Union[str, Path]) -> str:
+    """This function returns the path of the checkpoint of a run which is
+    stored next to its (first) output file"""
+    return str(output_file) + CHECKPOINT_SUFFIX
+
+
+class Checkpoint:
+    """This class periodically records the progress of a run in a json
+    file next to its output. A checkpoint holds the number of variants
+    read from the vcf file whose scored effects are fully written, the
+    last of these variants and the size of every output file at that
+    point. It is written atomically, so an interrupted run always leaves
+    a complete checkpoint behind. The settings of the run are stored
+    as well to make sure that a run is resumed with the same settings."""
+
+    def __init__(
+        self,
+        checkpoint_file: Union[str, Path],
+        settings: Dict[str, Any],
+        interval: float,
+    ) -> None:
+        self.checkpoint_file = str(checkpoint_file)
+        self.settings = settings
+        self.interval = interval
+        self.last_update = time.monotonic()
+
+    def update(
+        self,
+        output_handles: List[Any],
+        variants_done: int,
+        last_variant: Tuple,
+    ) -> None:
+        """Records the progress if the last checkpoint is older than the
+        interval. Must only be called once every output row of the first
+        variants_done variants is written."""
+        now = time.monotonic()
+        if now - self.last_update < self.interval:
+            return
+        output_sizes = []
+        for output_handle in output_handles:
+            output_handle.flush()
+            os.fsync(output_handle.fileno())
+            output_sizes.append(os.fstat(output_handle.fileno()).st_size)
+        temp_checkpoint_file = self.checkpoint_file + ".tmp"
+        with open(temp_checkpoint_file, "w") as checkpoint_json:
+            json.dump(
+                {
+                    "version": CHECKPOINT_VERSION,
+                    "settings": self.settings,
+                    "variants_done": variants_done,
+                    "last_variant": list(last_variant),
+                    "output_sizes": output_sizes,
+                },
+                checkpoint_json,
+            )
+        os.replace(temp_checkpoint_file, self.checkpoint_file)
+        self.last_update = now
+
+    def remove(self) -> None:
+        """Removes the checkpoint once the run is complete"""
+        if Path(self.checkpoint_file).exists():
+            os.remove(self.checkpoint_file)
+
+
+def load_checkpoint(
+    checkpoint_file: Union[str, Path],
+    settings: Dict[str, Any],
+    output_files: List[Union[str, Path]],
+) -> Optional[Tuple[int, Tuple]]:
+    """This function validates the checkpoint of an interrupted run and
+    truncates every output file to its size at the checkpoint, which
+    removes rows that were written after the checkpoint including a torn
+    last row. The number of variants whose scored effects are fully
+    written and the last of these variants are returned. If there is no
+    checkpoint, a warning is issued and None is returned.
+
+    Raises:
+        ValueError: If the checkpoint was written with different settings
+        or an output file is shorter than recorded in the checkpoint
+    """
+    if not Path(checkpoint_file).exists():
+        warnings.warn(
+            f"No checkpoint found at {checkpoint_file}. Starting from \
+                the beginning of the vcf file."
+        )
+        return None
+    with open(checkpoint_file, "r") as checkpoint_json:
+        checkpoint = json.load(checkpoint_json)
+    # Settings are compared after a round trip through json so that
+    # tuples and lists compare equal
+    if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get(
+        "settings"
+    ) != json.loads(json.dumps(settings)):
+        raise ValueError(
+            f"The checkpoint {checkpoint_file} was written with different \
+                settings. Please run again without --resume."
+        )
+    for output_file, output_size in zip(
+        output_files, checkpoint["output_sizes"]
+    ):
+        if (
+            not Path(output_file).exists()
+            or os.stat(output_file).st_size < output_size
+        ):
+            raise ValueError(
+                f"The output file {output_file} is shorter than recorded \
+                    in the checkpoint {checkpoint_file}. Please run again \
+                    without --resume."
+            )
+        os.truncate(output_file, output_size)
+    return checkpoint["variants_done"], tuple(checkpoint["last_variant"])
+
+
+def skip_done(
+    items: Iterator, done: int, last_done: Tuple, get_key: Callable
+) -> Iterator:
+    """This function skips the first done items which were scored before
+    a checkpoint and returns the remaining items.
+
+    Raises:
+        ValueError: If the last skipped item is not the last item recorded
+        in the checkpoint, which happens if the vcf file has changed
+    """
+    skipped = 0
+    last_item = None
+    for skipped, last_item in enumerate(itertools.islice(items, done), 1):
+        pass
+    if skipped != done or (
+        done and tuple(get_key(last_item)) != tuple(last_done)
+    ):
+        raise ValueError(
+            "The vcf file does not match the checkpoint. Please run again \
+                without --resume."
+        )
+    yield from items
@@ -1,56 +1,65 @@
 import click
 import importlib
-from typing import Any, Callable, Dict, List, Optional
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from kipoi_veff2 import interval_based
-from kipoi_veff2 import variant_centered
-from kipoi_veff2 import scores
+from kipoi_veff2 import options
+from kipoi_veff2 import profiling
 
 ScoringFunction = Callable[[Any, Any], List]
 
 
 def validate_model(
-    ctx: click.Context, param: click.Parameter, model: str
-) -> str:
-    """This is a callback for validation of requested model w.r.t
-        variant_centered.MODEL_GROUPS and interval_based.MODEL_GROUPS
+    ctx: click.Context, param: click.Parameter, model: tuple
+) -> tuple:
+    """This is a callback for validation of requested models w.r.t
+        options.VARIANT_CENTERED_MODEL_GROUPS and
+        options.INTERVAL_BASED_MODEL_GROUPS
 
     Raises:
         click.BadParameter: [An exception that formats
         out a standardized error message for a bad parameter
-        if there are no model to score variants with]
+        if there are no model to score variants with or if
+        an interval based model is requested along with other models]
     """
-    model_group = model.split("/")[0]
-    if (
-        model_group in variant_centered.MODEL_GROUPS
-        or model_group in interval_based.MODEL_GROUPS
+    for model_name in model:
+        model_group = model_name.split("/")[0]
+        if (
+            model_group not in options.VARIANT_CENTERED_MODEL_GROUPS
+            and model_group not in options.INTERVAL_BASED_MODEL_GROUPS
+        ):
+            print(
+                f"Removing {model_group} as it is not supported. \
+                Please consult the documentation"
+            )
+            raise click.BadParameter(
+                "Please select atleast one supported model group."
+            )
+    if len(model) > 1 and any(
+        model_name.split("/")[0] in options.INTERVAL_BASED_MODEL_GROUPS
+        for model_name in model
     ):
-        return model
-    else:
-        print(
-            f"Removing {model_group} as it is not supported. \
-            Please consult the documentation"
-        )
         raise click.BadParameter(
-            "Please select atleast one supported model group."
+            "Only variant centered models can be scored together."
         )
+    return model
 
 
 def validate_scoring_function(
     ctx: click.Context, param: click.Parameter, scoring_function: tuple
 ) -> List[Dict[str, ScoringFunction]]:
     """This is a callback for validation of scoring functions w.r.t
-    scores.AVAILABLE_SCORING_FUNCTIONS
+    options.AVAILABLE_SCORING_FUNCTIONS. Built-in scoring functions are
+    imported later by load_scoring_functions.
     """
     scoring_functions = []
     for scoring_function_name in list(scoring_function):
-        if scoring_function_name in scores.AVAILABLE_SCORING_FUNCTIONS:
+        if scoring_function_name in options.AVAILABLE_SCORING_FUNCTIONS:
             click.echo(
                 f"Adding {scoring_function_name} from kipoi_veff2.scores"
             )
             func_name = scoring_function_name
-            mod = importlib.import_module("kipoi_veff2.scores")
-            func = getattr(mod, func_name)
+            func = None
         else:
             if "." in scoring_function_name:
                 mod_name, func_name = scoring_function_name.rsplit(".", 1)
@@ -78,6 +87,146 @@ def validate_scoring_function(
     return scoring_functions
 
 
+def load_scoring_functions(
+    scoring_functions: List[Dict[str, Optional[ScoringFunction]]]
+) -> List[Dict[str, ScoringFunction]]:
+    """This function imports the built-in scoring functions accepted by
+    validate_scoring_function from kipoi_veff2.scores"""
+    scores = importlib.import_module("kipoi_veff2.scores")
+    return [
+        {
+            "name": scoring_function["name"],
+            "func": scoring_function["func"]
+            or getattr(scores, scoring_function["name"]),
+        }
+        for scoring_function in scoring_functions
+    ]
+
+
+def validate_region(
+    ctx: click.Context, param: click.Parameter, region: tuple
+) -> List[str]:
+    """This is a callback for validation of requested regions of the
+    form chr:start-end
+
+    Raises:
+        click.BadParameter: If a region is not of the form chr:start-end
+    """
+    try:
+        for region_str in region:
+            options.parse_region_coordinates(region_str)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    return list(region)
+
+
+def validate_shard(
+    ctx: click.Context, param: click.Parameter, shard: Optional[str]
+) -> Optional[Tuple[int, int]]:
+    """This is a callback for validation of a requested shard of the
+    form i/N
+
+    Raises:
+        click.BadParameter: If the shard is not of the form i/N with
+        1 <= i <= N
+    """
+    if shard is None:
+        return None
+    try:
+        return options.parse_shard(shard)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
+def validate_float_format(
+    ctx: click.Context, param: click.Parameter, float_format: Optional[str]
+) -> Optional[str]:
+    """This is a callback for validation of a printf style float format
+
+    Raises:
+        click.BadParameter: If the float format can not format a number
+    """
+    if float_format is None:
+        return None
+    try:
+        options.validate_float_format(float_format)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    return float_format
+
+
+def get_variant_centered_model_config(
+    model: str,
+    sequence_length: Optional[int],
+    pairs_per_batch: Optional[int] = None,
+) -> Any:
+    """This function instantiates the model configuration of a variant
+    centered model using the configuration of its model group. If a
+    sequence length or a number of pairs per batch is provided through
+    cli, it overrides the one of the model group. Unless the model group
+    has a batch size, the batch size of the model's tuning profile on the
+    current machine is used if there is one."""
+    from kipoi_veff2 import tuning, variant_centered
+
+    model_group = model.split("/")[0]
+    # A copy is necessary since the same model group configuration
+    # is shared by every model of the group
+    model_group_config_dict = dict(
+        variant_centered.VARIANT_CENTERED_MODEL_GROUP_CONFIGS.get(
+            model_group, {}
+        )
+    )
+    if sequence_length is not None:
+        # None is to match the value we use in
+        # get_required_sequence_length
+        model_group_config_dict["required_sequence_length"] = sequence_length
+    if pairs_per_batch is not None:
+        model_group_config_dict["pairs_per_batch"] = pairs_per_batch
+    model_config = variant_centered.get_model_config(
+        model_name=model, **model_group_config_dict
+    )
+    if "batch_size" not in model_group_config_dict:
+        tuned_batch_size = tuning.load_tuned_batch_size(
+            model, model_config.get_required_sequence_length()
+        )
+        if tuned_batch_size is not None:
+            model_config.batch_size = tuned_batch_size
+    if sequence_length is not None:
+        assert (
+            getattr(model_config, "required_sequence_length")
+            == sequence_length
+        )
+    return model_config
+
+
+def get_result_cache(
+    result_cache_file: Optional[str], result_cache_size: Optional[int]
+) -> Any:
+    """This function opens the result cache requested through cli with a
+    maximum size in MiB if there is one"""
+    if result_cache_file is None:
+        return None
+    from kipoi_veff2 import result_cache
+
+    if result_cache_size is None:
+        return result_cache.ResultCache(result_cache_file)
+    return result_cache.ResultCache(
+        result_cache_file, result_cache_size * 2**20
+    )
+
+
+def get_model_output_file(output_tsv: str, model: str) -> str:
+    """This function returns the name of the output file of a single
+    model when the scored effects of every model are written into
+    separate files"""
+    output_path = Path(output_tsv)
+    return str(
+        output_path.with_name(
+            f"{output_path.stem}.{model.replace('/', '_')}{output_path.suffix}"
+        )
+    )
+
+
 @click.command()
 @click.argument(
     "input_vcf", required=True, type=click.Path(exists=True, readable=True)
@@ -94,13 +243,17 @@ def validate_scoring_function(
     "-m",
     "--model",
     required=True,
+    multiple=True,
     type=str,
     callback=validate_model,
     help="Run variant effect prediction using this model. \
         Example (Variant centered): python kipoi_veff2/cli.py in.vcf in.fa \
                  out.tsv -m Basset -s diff\
         Example (Interval based): python kipoi_veff2/cli.py in.vcf in.fa\
-                -g in.gtf -m 'MMSplice/modularPredictions' out.tsv",
+                -g in.gtf -m 'MMSplice/modularPredictions' out.tsv\
+        Multiple variant centered models can be scored together in a\
+        single run: python kipoi_veff2/cli.py in.vcf in.fa out.tsv\
+                -m Basset -m 'DeepSEA/predict'",
 )
 @click.option(
     "-s",
@@ -116,48 +269,306 @@ def validate_scoring_function(
         For interval based models scoring functions are redundant as\
         the model perform the scoring as part of prediction",
 )
+@click.option(
+    "--output-per-model",
+    "output_per_model",
+    is_flag=True,
+    help="Write the scored effects of every model into a separate file \
+        named after output_tsv and the model. Example: out.tsv with\
+        -m Basset -m 'DeepSEA/predict' --output-per-model results in\
+        out.Basset.tsv and out.DeepSEA_predict.tsv",
+)
+@click.option(
+    "--sort-block-size",
+    "sort_block_size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Read the vcf file in blocks of this many variants and sort every\
+        block by contig and position before sequence extraction and\
+        inference. Useful for unsorted or concatenated vcf files. Scored\
+        effects are written in the original order of the vcf file.",
+)
+@click.option(
+    "--sorted-output",
+    "sorted_output",
+    is_flag=True,
+    help="Together with --sort-block-size, write the scored effects in the\
+        sorted order of every block instead of the original order",
+)
+@click.option(
+    "--prefetch-batches",
+    "prefetch_batches",
+    default=0,
+    type=click.IntRange(min=0),
+    help="For variant centered models, read and extract up to this many\
+        batches ahead and write the scored effects in background threads\
+        while the models infer. 0 disables prefetching.",
+)
+@click.option(
+    "--workers",
+    "workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Score the variants in this many worker processes, each with its\
+        own copy of the model(s). The scored effects are written in the\
+        same order as with a single process.",
+)
+@click.option(
+    "--region",
+    "region",
+    multiple=True,
+    callback=validate_region,
+    help="Only score the variants within this region of the form\
+        chr:start-end. Can be given multiple times. Requires a bgzipped\
+        vcf file with a tabix or CSI index.",
+)
+@click.option(
+    "--shard",
+    "shard",
+    default=None,
+    callback=validate_shard,
+    help="Split the genome into N spans of equal length and only score\
+        the variants within the i-th span, numbered from 1 to N. Example:\
+        --shard 3/10. Requires a bgzipped vcf file with a tabix or CSI\
+        index.",
+)
+@click.option(
+    "--checkpoint-interval",
+    "checkpoint_interval",
+    default=None,
+    type=click.FloatRange(min=0),
+    help="Record the progress of the run in a checkpoint next to the\
+        output file at most every this many seconds. The checkpoint is\
+        removed when the run is complete.",
+)
+@click.option(
+    "--resume",
+    "resume",
+    is_flag=True,
+    help="Continue an interrupted run from its checkpoint. All other\
+        arguments and options must be the same as in the interrupted run.",
+)
+@click.option(
+    "--output-format",
+    "output_format",
+    default="tsv",
+    type=click.Choice(options.OUTPUT_FORMATS),
+    help="Write the scored effects as tsv (default), parquet or arrow.\
+        Parquet and arrow require pyarrow.",
+)
+@click.option(
+    "--float-format",
+    "float_format",
+    default=None,
+    callback=validate_float_format,
+    help="Write the scores of tsv output with this printf style format,\
+        for example %.6g. By default, scores are written exactly.",
+)
+@click.option(
+    "--precision",
+    "precision",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Write the scores of tsv output with at most this many\
+        significant digits. Shorthand for --float-format %.<precision>g.",
+)
+@click.option(
+    "--compression-threads",
+    "compression_threads",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Compress tsv output whose name ends with .gz or .bgz in this\
+        many threads. Such output is BGZF compressed and indexed with\
+        tabix if its rows are sorted.",
+)
+@click.option(
+    "--pairs-per-batch",
+    "pairs_per_batch",
+    default=None,
+    type=click.IntRange(min=1),
+    help="For models that infer with pairs of reference and alternative\
+        sequence (Basenji), infer with up to this many pairs at once.\
+        Falls back to a single pair if the model can not take larger\
+        batches.",
+)
+@click.option(
+    "--auto-batch-size",
+    "auto_batch_size",
+    is_flag=True,
+    help="Tune the batch size of every variant centered model by probing\
+        increasing batch sizes on the current machine before scoring. The\
+        tuned batch sizes are saved and later runs on the same machine use\
+        them automatically.",
+)
+@click.option(
+    "--memory-limit",
+    "memory_limit",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Together with --auto-batch-size, only choose batch sizes whose\
+        peak memory stays below this many MiB. Half of the physical memory\
+        by default.",
+)
+@click.option(
+    "--result-cache",
+    "result_cache_file",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="For variant centered models, look up the scores of every batch in\
+        this sqlite database and only infer with variants which are not\
+        in it. New scores are added to it. Jobs on the same node can share\
+        the same result cache.",
+)
+@click.option(
+    "--result-cache-size",
+    "result_cache_size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Together with --result-cache, evict the least recently used\
+        scores once the result cache grows beyond this many MiB. 10240 MiB\
+        by default.",
+)
+@click.option(
+    "--profile",
+    "profile",
+    is_flag=True,
+    help="Record the wall and cpu time, calls and batches of every stage\
+        of the run. The profile is printed as a table when the run ends and\
+        written as json to OUTPUT_TSV.profile.json.",
+)
 def score_variants(
     input_vcf: click.Path,
     input_fasta: click.Path,
     input_gtf: Optional[click.Path],
     sequence_length: Optional[int],
     output_tsv: str,
-    model: str,
+    model: tuple,
     scoring_function: List[Dict[str, ScoringFunction]],
+    output_per_model: bool,
+    sort_block_size: Optional[int],
+    sorted_output: bool,
+    prefetch_batches: int,
+    workers: int,
+    region: List[str],
+    shard: Optional[Tuple[int, int]],
+    checkpoint_interval: Optional[float],
+    resume: bool,
+    output_format: str,
+    float_format: Optional[str],
+    precision: Optional[int],
+    compression_threads: int,
+    pairs_per_batch: Optional[int],
+    auto_batch_size: bool,
+    memory_limit: Optional[int],
+    result_cache_file: Optional[str],
+    result_cache_size: Optional[int],
+    profile: bool,
 ) -> None:
     """Perform variant effect prediction with a vcf, fasta
     and optionally gtf files along with a model and optional
     scoring funciton dictinary and write the
     scored effect prediction to an output tsv file"""
-    model_group = model.split("/")[0]
-    if model_group in variant_centered.MODEL_GROUPS:
-        model_group_config_dict = (
-            variant_centered.VARIANT_CENTERED_MODEL_GROUP_CONFIGS.get(
-                model_group, {}
-            )
-        )
-        if sequence_length is not None:
-            # None is to match the value we use in
-            # get_required_sequence_length
-            model_group_config_dict[
-                "required_sequence_length"
-            ] = sequence_length
-        model_config = variant_centered.get_model_config(
-            model_name=model, **model_group_config_dict
+    if region and shard is not None:
+        raise click.BadParameter(
+            "--region and --shard can not be used together."
         )
-        if sequence_length is not None:
-            assert (
-                getattr(model_config, "required_sequence_length")
-                == sequence_length
+    if precision is not None:
+        if float_format is not None:
+            raise click.BadParameter(
+                "--float-format and --precision can not be used together."
+            )
+        float_format = f"%.{precision}g"
+    if model[0].split("/")[0] in options.INTERVAL_BASED_MODEL_GROUPS:
+        variant_centered_options = {
+            "--prefetch-batches": prefetch_batches > 0,
+            "--pairs-per-batch": pairs_per_batch is not None,
+            "--auto-batch-size": auto_batch_size,
+            "--memory-limit": memory_limit is not None,
+            "--result-cache": result_cache_file is not None,
+            "--result-cache-size": result_cache_size is not None,
+        }
+        for option_name, is_set in variant_centered_options.items():
+            if is_set:
+                raise click.UsageError(
+                    f"{option_name} can only be used with variant centered \
+                        models."
+                )
+    profile_file = profiling.get_profile_file(output_tsv) if profile else None
+    with profiling.profile_run(profile_file):
+        # Scoring variants requires kipoi, kipoiseq, cyvcf2 and numpy whose
+        # import is slow, so they are only imported once the options are
+        # valid
+        with profiling.stage("import"):
+            from kipoi_veff2 import interval_based, regions, variant_centered
+
+        if shard is not None:
+            selected_regions = regions.get_shard_regions(
+                regions.get_shard_contig_lengths(input_fasta, input_vcf),
+                *shard,
+            )
+        else:
+            selected_regions = [
+                regions.parse_region(region_str) for region_str in region
+            ] or None
+        model_group = model[0].split("/")[0]
+        if model_group in variant_centered.MODEL_GROUPS:
+            model_configs = [
+                get_variant_centered_model_config(
+                    model_name, sequence_length, pairs_per_batch
+                )
+                for model_name in model
+            ]
+            if output_per_model:
+                output_files = [
+                    get_model_output_file(output_tsv, model_name)
+                    for model_name in model
+                ]
+            else:
+                output_files = output_tsv
+            variant_centered.score_variants_multi_model(
+                model_configs,
+                input_vcf,
+                input_fasta,
+                output_files,
+                load_scoring_functions(scoring_function),
+                sort_block_size=sort_block_size,
+                sorted_output=sorted_output,
+                prefetch_batches=prefetch_batches,
+                workers=workers,
+                regions=selected_regions,
+                checkpoint_interval=checkpoint_interval,
+                resume=resume,
+                output_format=output_format,
+                float_format=float_format,
+                compression_threads=compression_threads,
+                auto_batch_size=auto_batch_size,
+                memory_limit=None
+                if memory_limit is None
+                else memory_limit * 2**20,
+                result_cache=get_result_cache(
+                    result_cache_file, result_cache_size
+                ),
+            )
+        elif model_group in interval_based.MODEL_GROUPS:
+            model_config = interval_based.INTERVAL_BASED_MODEL_CONFIGS[
+                model[0]
+            ]
+            interval_based.score_variants(
+                model_config,
+                input_vcf,
+                input_fasta,
+                input_gtf,
+                output_tsv,
+                sort_block_size=sort_block_size,
+                sorted_output=sorted_output,
+                workers=workers,
+                regions=selected_regions,
+                checkpoint_interval=checkpoint_interval,
+                resume=resume,
+                output_format=output_format,
+                float_format=float_format,
+                compression_threads=compression_threads,
             )
-        variant_centered.score_variants(
-            model_config, input_vcf, input_fasta, output_tsv, scoring_function
-        )
-    elif model_group in interval_based.MODEL_GROUPS:
-        model_config = interval_based.INTERVAL_BASED_MODEL_CONFIGS[model]
-        interval_based.score_variants(
-            model_config, input_vcf, input_fasta, input_gtf, output_tsv
-        )
 
 
 if __name__ == "__main__":
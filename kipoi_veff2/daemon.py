@@ -0,0 +1,220 @@
+import json
+import os
+from pathlib import Path
+import socket
+from typing import Any, Dict, List, Optional, Union
+
+import click
+
+from kipoi_veff2 import cli
+from kipoi_veff2 import options
+
+
+def send_request(
+    socket_file: Union[str, Path], request: Dict[str, Any]
+) -> Dict[str, Any]:
+    """This function sends a request to the daemon listening on a unix
+    socket and returns its response
+
+    Raises:
+        RuntimeError: If the daemon could not process the request
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_file))
+        with client.makefile("rwb") as stream:
+            stream.write((json.dumps(request) + "\n").encode())
+            stream.flush()
+            response = json.loads(stream.readline())
+    if response.get("status") != "ok":
+        raise RuntimeError(response.get("error", "Invalid response"))
+    return response
+
+
+@click.group()
+def daemon() -> None:
+    """Keep variant centered models loaded in a daemon and score vcf
+    files or inline variants with them on demand"""
+
+
+@daemon.command()
+@click.argument("socket_file", required=True, type=click.Path())
+@click.argument(
+    "input_fasta", required=True, type=click.Path(exists=True, readable=True)
+)
+@click.option(
+    "-m",
+    "--model",
+    required=True,
+    multiple=True,
+    type=str,
+    callback=cli.validate_model,
+    help="Keep this variant centered model loaded. Can be given multiple\
+        times.",
+)
+@click.option(
+    "-s",
+    "--scoring_function",
+    required=False,
+    multiple=True,
+    type=str,
+    callback=cli.validate_scoring_function,
+    help="Score every model with this function. Can be given multiple\
+        times.",
+)
+@click.option("-l", "--seq-length", "sequence_length", default=None, type=int)
+@click.option(
+    "--pairs-per-batch",
+    "pairs_per_batch",
+    default=None,
+    type=click.IntRange(min=1),
+    help="For models that infer with pairs of reference and alternative\
+        sequence (Basenji), infer with up to this many pairs at once.",
+)
+@click.option(
+    "--result-cache",
+    "result_cache_file",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Look up scores in this result cache and add new scores to it,\
+        like kipoi_veff2_predict --result-cache.",
+)
+@click.option(
+    "--result-cache-size",
+    "result_cache_size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Evict the least recently used scores once the result cache grows\
+        beyond this many MiB. 10240 MiB by default.",
+)
+def serve(
+    socket_file: str,
+    input_fasta: str,
+    model: tuple,
+    scoring_function: List[Dict[str, Any]],
+    sequence_length: Optional[int],
+    pairs_per_batch: Optional[int],
+    result_cache_file: Optional[str],
+    result_cache_size: Optional[int],
+) -> None:
+    """Load the models and serve scoring jobs on a unix socket until the
+    daemon is stopped"""
+    if any(
+        model_name.split("/")[0] in options.INTERVAL_BASED_MODEL_GROUPS
+        for model_name in model
+    ):
+        raise click.BadParameter(
+            "Only variant centered models can be served by the daemon."
+        )
+    # The daemon imports the scoring stack once the options are valid
+    from kipoi_veff2 import server
+
+    scoring_daemon = server.ScoringDaemon(
+        [
+            cli.get_variant_centered_model_config(
+                model_name, sequence_length, pairs_per_batch
+            )
+            for model_name in model
+        ],
+        os.path.abspath(input_fasta),
+        cli.load_scoring_functions(scoring_function),
+        cli.get_result_cache(result_cache_file, result_cache_size),
+    )
+    click.echo(f"Serving {', '.join(model)} on {socket_file}")
+    try:
+        server.serve(socket_file, scoring_daemon)
+    except ValueError as err:
+        raise click.ClickException(str(err))
+
+
+@daemon.command()
+@click.argument("socket_file", required=True, type=click.Path(exists=True))
+@click.argument(
+    "input_vcf", required=True, type=click.Path(exists=True, readable=True)
+)
+@click.argument("output_tsv", required=True)
+@click.option(
+    "-f",
+    "--fasta",
+    "input_fasta",
+    default=None,
+    type=click.Path(exists=True, readable=True),
+    help="Extract sequences from this fasta file instead of the one the\
+        daemon was started with.",
+)
+@click.option(
+    "-m",
+    "--model",
+    multiple=True,
+    type=str,
+    help="Only score with this of the loaded models. Can be given multiple\
+        times. All loaded models by default.",
+)
+@click.option(
+    "--output-format",
+    "output_format",
+    default="tsv",
+    type=click.Choice(options.OUTPUT_FORMATS),
+    help="Write the scored effects as tsv (default), parquet or arrow.",
+)
+@click.option(
+    "--float-format",
+    "float_format",
+    default=None,
+    callback=cli.validate_float_format,
+    help="Write the scores of tsv output with this printf style format,\
+        for example %.6g. By default, scores are written exactly.",
+)
+def submit(
+    socket_file: str,
+    input_vcf: str,
+    output_tsv: str,
+    input_fasta: Optional[str],
+    model: tuple,
+    output_format: str,
+    float_format: Optional[str],
+) -> None:
+    """Score a vcf file with the daemon and write the scored effects
+    like kipoi_veff2_predict"""
+    try:
+        send_request(
+            socket_file,
+            {
+                "command": "score",
+                "vcf_file": os.path.abspath(input_vcf),
+                "fasta_file": None
+                if input_fasta is None
+                else os.path.abspath(input_fasta),
+                "output_file": os.path.abspath(output_tsv),
+                "output_format": output_format,
+                "models": list(model),
+                "float_format": float_format,
+            },
+        )
+    except (OSError, RuntimeError) as err:
+        raise click.ClickException(str(err))
+
+
+@daemon.command()
+@click.argument("socket_file", required=True, type=click.Path(exists=True))
+def status(socket_file: str) -> None:
+    """Print the models loaded by the daemon"""
+    try:
+        response = send_request(socket_file, {"command": "status"})
+    except (OSError, RuntimeError) as err:
+        raise click.ClickException(str(err))
+    for model in response["models"]:
+        click.echo(model)
+
+
+@daemon.command()
+@click.argument("socket_file", required=True, type=click.Path(exists=True))
+def stop(socket_file: str) -> None:
+    """Stop the daemon once the jobs it is scoring are done"""
+    try:
+        send_request(socket_file, {"command": "shutdown"})
+    except (OSError, RuntimeError) as err:
+        raise click.ClickException(str(err))
+
+
+if __name__ == "__main__":
+    daemon()
@@ -0,0 +1,188 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Union
+import warnings
+
+import click
+import numpy as np
+from pyfaidx import Fasta
+
+GENOME_INDEX_SUFFIX = ".veff2.npy"
+GENOME_INDEX_METADATA_SUFFIX = ".veff2.json"
+GENOME_INDEX_VERSION = 1
+# Number of bases read from the fasta file at once while building the index
+CHUNK_SIZE = 10000000
+
+
+def get_genome_index_files(fasta_file: Union[str, Path]) -> tuple:
+    """This function returns the paths of the genome index and its
+    sidecar metadata file which are stored next to the fasta file"""
+    fasta_file = str(fasta_file)
+    return (
+        fasta_file + GENOME_INDEX_SUFFIX,
+        fasta_file + GENOME_INDEX_METADATA_SUFFIX,
+    )
+
+
+def get_fasta_signature(fasta_file: Union[str, Path]) -> Dict[str, int]:
+    """This function returns the size and the modification time of the
+    fasta file. It is used to detect a genome index that is older than
+    its fasta file."""
+    fasta_stat = os.stat(fasta_file)
+    return {"size": fasta_stat.st_size, "mtime_ns": fasta_stat.st_mtime_ns}
+
+
+def build_genome_index(fasta_file: Union[str, Path]) -> None:
+    """This function converts a fasta file into a single uint8 array holding
+    the ascii code of every base of every contig one after another. The
+    array is stored as a .npy file next to the fasta file so that it can be
+    memory mapped. The offset and length of every contig are stored in a
+    sidecar json file. The fasta file is read in chunks of CHUNK_SIZE
+    bases to keep memory bounded."""
+    index_file, metadata_file = get_genome_index_files(fasta_file)
+    fasta = Fasta(str(fasta_file), as_raw=True, sequence_always_upper=False)
+    contigs = {}
+    total_length = 0
+    for name in fasta.keys():
+        length = len(fasta[name])
+        contigs[name] = {"offset": total_length, "length": length}
+        total_length += length
+    sequence = np.lib.format.open_memmap(
+        index_file, mode="w+", dtype=np.uint8, shape=(total_length,)
+    )
+    for name, contig in contigs.items():
+        for start in range(0, contig["length"], CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, contig["length"])
+            sequence[
+                contig["offset"] + start : contig["offset"] + end
+            ] = np.frombuffer(
+                fasta[name][start:end].encode("ascii"), dtype=np.uint8
+            )
+    sequence.flush()
+    del sequence
+    fasta.close()
+    with open(metadata_file, "w") as metadata_json:
+        json.dump(
+            {
+                "version": GENOME_INDEX_VERSION,
+                "fasta": get_fasta_signature(fasta_file),
+                "contigs": contigs,
+            },
+            metadata_json,
+        )
+
+
+class GenomeIndex:
+    """This class gives access to a genome index built by build_genome_index.
+    The index is memory mapped read only, so that concurrent processes on
+    the same node share the same pages in the page cache. It can be used as
+    reference sequence extractor of kipoiseq's VariantSeqExtractor. Like
+    pyfaidx, sequences reaching beyond the end of a contig are truncated."""
+
+    def __init__(self, fasta_file: Union[str, Path]) -> None:
+        index_file, metadata_file = get_genome_index_files(fasta_file)
+        with open(metadata_file, "r") as metadata_json:
+            self.contigs = json.load(metadata_json)["contigs"]
+        self.sequence = np.load(index_file, mmap_mode="r")
+
+    @staticmethod
+    def is_available(fasta_file: Union[str, Path]) -> bool:
+        """This function determines whether an up to date genome index
+        exists for the fasta file. A warning is issued if the genome index
+        is older than the fasta file."""
+        index_file, metadata_file = get_genome_index_files(fasta_file)
+        if not (Path(index_file).exists() and Path(metadata_file).exists()):
+            return False
+        with open(metadata_file, "r") as metadata_json:
+            metadata = json.load(metadata_json)
+        if metadata.get("version") != GENOME_INDEX_VERSION or metadata.get(
+            "fasta"
+        ) != get_fasta_signature(fasta_file):
+            warnings.warn(
+                f"Ignoring the genome index of {fasta_file} as it is out of \
+                    date. Please rebuild it with kipoi_veff2_index"
+            )
+            return False
+        return True
+
+    def fetch(self, chrom: str, start: int, end: int) -> str:
+        """Returns the sequence of a contig between the 0-based start
+        and end
+
+        Raises:
+            ValueError: If start is negative
+        """
+        if start < 0:
+            raise ValueError(
+                "Requested start coordinate must be greater than 1."
+            )
+        contig = self.contigs[chrom]
+        end = min(end, contig["length"])
+        return (
+            self.sequence[contig["offset"] + start : contig["offset"] + end]
+            .tobytes()
+            .decode("ascii")
+        )
+
+    def extract(self, interval: Any, **kwargs) -> str:
+        """Returns the sequence of an interval. This is the interface of
+        kipoiseq's extractors"""
+        return self.fetch(interval.chrom, interval.start, interval.end)
+
+    def fetch_windows(
+        self, chroms: List[str], starts: List[int], length: int
+    ) -> List[str]:
+        """Returns the sequences of length bases starting at the 0-based
+        starts for a whole batch at once. Windows reaching beyond the
+        end of their contig are fetched one by one."""
+        offsets = np.array(
+            [self.contigs[chrom]["offset"] for chrom in chroms], dtype=np.int64
+        )
+        starts = np.array(starts, dtype=np.int64)
+        contig_lengths = np.array(
+            [self.contigs[chrom]["length"] for chrom in chroms], dtype=np.int64
+        )
+        if np.any(starts < 0):
+            raise ValueError(
+                "Requested start coordinate must be greater than 1."
+            )
+        within_contig = starts + length <= contig_lengths
+        windows = self.sequence[
+            (offsets + starts)[within_contig, np.newaxis] + np.arange(length)
+        ]
+        sequences = windows.tobytes().decode("ascii")
+        within_contig_sequences = iter(
+            sequences[index : index + length]
+            for index in range(0, len(sequences), length)
+        )
+        return [
+            next(within_contig_sequences)
+            if is_within_contig
+            else self.fetch(chrom, start, start + length)
+            for chrom, start, is_within_contig in zip(
+                chroms, starts.tolist(), within_contig
+            )
+        ]
+
+    def close(self) -> None:
+        """Closes the memory map"""
+        self.sequence = None
+
+
+@click.command()
+@click.argument(
+    "input_fasta", required=True, type=click.Path(exists=True, readable=True)
+)
+def index(input_fasta: str) -> None:
+    """Build a memory mapped genome index next to the input fasta file.
+    Variant centered effect prediction uses it automatically instead of
+    reading the fasta file."""
+    build_genome_index(input_fasta)
+    click.echo(
+        f"Genome index written to {get_genome_index_files(input_fasta)[0]}"
+    )
+
+
+if __name__ == "__main__":
+    index()
@@ -1,12 +1,44 @@
-import csv
+from contextlib import ExitStack
+from functools import partial
+import multiprocessing
 from pathlib import Path
-from typing import Any, Callable, Dict, Union, List
+from tempfile import TemporaryDirectory
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Union,
+    List,
+)
 
+from cyvcf2 import VCF
 from dataclasses import dataclass
 import numpy as np
-import kipoi
+from kipoiseq.dataclasses import Interval
 
-MODEL_GROUPS = ["MMSplice"]
+from kipoi_veff2 import bgzf
+from kipoi_veff2 import model_cache
+from kipoi_veff2 import profiling
+from kipoi_veff2.checkpoint import (
+    Checkpoint,
+    get_checkpoint_file,
+    load_checkpoint,
+    skip_done,
+)
+from kipoi_veff2.options import INTERVAL_BASED_MODEL_GROUPS
+from kipoi_veff2.output import get_output
+from kipoi_veff2.pipeline import imap_ordered
+from kipoi_veff2.regions import read_records
+from kipoi_veff2.variant_centered import batcher
+
+MODEL_GROUPS = INTERVAL_BASED_MODEL_GROUPS
+# Number of vcf records scored at once by a worker process
+WORKER_CHUNK_SIZE = 10000
+# Number of output rows written at once
+OUTPUT_BLOCK_SIZE = 1000
 
 
 @dataclass
@@ -23,21 +55,27 @@ class ModelConfig:
     cli_to_dataloader_parameter_map: Dict[str, str]
     get_variant_info: Callable[[Dict[str, Any]], Dict[str, str]]
 
+    @property
+    def model_description(self) -> Any:
+        """The full kipoi description of the model. It is read once per
+        process, see model_cache.get_kipoi_model_description"""
+        return model_cache.get_kipoi_model_description(self.model)
+
     def get_column_labels(self) -> List:
         """This function produces the header of the output tsv. The first
         five columns comprises of the information about the variant namely
         #CHROM, POS, ID, REF, ALT. The rest of the column headers are
         annotations from the model's description yaml in kipoi if
         available. Otherwise, we use numerics in increasing order
-        starting from 1.
+        starting from 1. The model description is read from the
+        description cache, see model_cache.get_model_description.
 
         Raises:
             IOError: If the model description is invalid
         """
-        self.model_description = kipoi.get_model_descr(self.model)
-        targets = self.model_description.schema.targets
-        column_labels = targets.column_labels
-        target_shape = targets.shape[0]
+        model_description = model_cache.get_model_description(self.model)
+        column_labels = model_description.column_labels
+        target_shape = model_description.target_shape[0]
         variant_column_labels = ["#CHROM", "POS", "ID", "REF", "ALT"]
         if column_labels:
             if len(column_labels) == target_shape:
@@ -56,14 +94,16 @@ class ModelConfig:
 
     def get_dataloader(self, cli_params: Dict[str, str]) -> Any:
         """This function returns an dataloader instance initialized
-        with the input vcf, fasta and gtf files.
+        with the input vcf, fasta and gtf files. The model is loaded once
+        per process and so is the annotation of the gtf file, see
+        get_annotation_caching_dataloader_class.
 
         Raises:
             IOError: If the cli_to_dataloader_parameter_map dict of the
             model configuration does not exactly match the expected input
             parameters of the dataloader
         """
-        self.kipoi_model_with_dataloader = kipoi.get_model(
+        self.kipoi_model_with_dataloader = model_cache.get_model(
             self.model, source="kipoi", with_dataloader=True
         )
         dataloader_args = {}
@@ -78,9 +118,49 @@ class ModelConfig:
             dataloader_param_name,
         ) in self.cli_to_dataloader_parameter_map.items():
             dataloader_args[dataloader_param_name] = cli_params[cli_param_name]
-        return self.kipoi_model_with_dataloader.default_dataloader(
-            **dataloader_args
+        return get_annotation_caching_dataloader_class(
+            self.kipoi_model_with_dataloader.default_dataloader
+        )(**dataloader_args)
+
+
+# Annotations read by the dataloaders of the current process by the
+# arguments they were read with
+_annotations = {}
+# Dataloader classes of get_annotation_caching_dataloader_class
+_dataloader_classes = {}
+
+
+def get_annotation_caching_dataloader_class(dataloader_class: Any) -> Any:
+    """This function returns a subclass of a dataloader class which reads
+    the exons of the gtf file once per process. The MMSplice dataloaders
+    parse the whole gtf file in _read_exons whenever they are
+    instantiated, which is what scoring a vcf file in chunks does. The
+    parsed exons are only read by the dataloaders. Dataloader classes
+    without _read_exons are returned as they are."""
+    if not hasattr(dataloader_class, "_read_exons"):
+        return dataloader_class
+    if dataloader_class not in _dataloader_classes:
+
+        class AnnotationCachingDataloader(dataloader_class):
+            def _read_exons(self, gtf: Any, *args: Any, **kwargs: Any) -> Any:
+                key = (
+                    dataloader_class,
+                    str(gtf),
+                    repr(args),
+                    repr(sorted(kwargs.items())),
+                )
+                if key not in _annotations:
+                    _annotations[key] = super()._read_exons(
+                        gtf, *args, **kwargs
+                    )
+                return _annotations[key]
+
+        AnnotationCachingDataloader.__name__ = dataloader_class.__name__
+        AnnotationCachingDataloader.__qualname__ = (
+            dataloader_class.__qualname__
         )
+        _dataloader_classes[dataloader_class] = AnnotationCachingDataloader
+    return _dataloader_classes[dataloader_class]
 
 
 INTERVAL_BASED_MODEL_CONFIGS = {
@@ -175,12 +255,303 @@ INTERVAL_BASED_MODEL_CONFIGS = {
 }
 
 
+def open_vcf(vcf_file: Union[str, Path]) -> Any:
+    """This function opens a vcf file for writing. It is BGZF compressed
+    if its name ends with .gz or .bgz, like the temporary vcf chunks."""
+    if bgzf.is_bgzf_file(vcf_file):
+        return bgzf.BgzfWriter(vcf_file)
+    return open(vcf_file, "w")
+
+
+def write_locality_sorted_vcf(
+    vcf_file: Union[str, Path],
+    sorted_vcf_file: Union[str, Path],
+    block_size: int,
+) -> None:
+    """This function copies the input vcf file where every block of
+    block_size records is sorted by contig and position"""
+    vcf = VCF(str(vcf_file))
+    with open_vcf(sorted_vcf_file) as sorted_vcf:
+        sorted_vcf.write(vcf.raw_header)
+        for block in batcher(iter(vcf), block_size):
+            for record in sorted(
+                block, key=lambda record: (record.CHROM, record.POS)
+            ):
+                sorted_vcf.write(str(record))
+
+
+def write_region_vcf(
+    vcf_file: Union[str, Path],
+    region_vcf_file: Union[str, Path],
+    regions: List[Interval],
+) -> None:
+    """This function copies the records of the input vcf file within the
+    regions to region_vcf_file using the index of the input vcf file"""
+    with open(region_vcf_file, "w") as region_vcf:
+        region_vcf.write(VCF(str(vcf_file)).raw_header)
+        for record in read_records(vcf_file, regions):
+            region_vcf.write(str(record))
+
+
+def restore_vcf_order(rows: Iterable[List], records: List[Any]) -> List[List]:
+    """This function returns the output rows of a block of records in the
+    order of the records. Since the dataloaders of interval based models
+    do not necessarily preserve the order of the vcf file, the rows of
+    every allele of a record are looked up by contig, position, reference
+    and alternative allele, or by contig and position if the dataloader
+    changed the alleles. The rows of duplicate records are split evenly
+    between them. Rows that do not belong to any record are returned at
+    the end."""
+    record_indices = {}
+    for index, record in enumerate(records):
+        for alt in record.ALT:
+            record_indices.setdefault(
+                (record.CHROM, record.POS, record.REF, alt), []
+            ).append(index)
+        record_indices.setdefault((record.CHROM, record.POS), []).append(index)
+    row_groups = {}
+    remaining_rows = []
+    for row in rows:
+        chrom, pos, ref, alt = str(row[0]), int(row[1]), row[3], row[4]
+        if (chrom, pos, str(ref), str(alt)) in record_indices:
+            key = (chrom, pos, str(ref), str(alt))
+        elif (chrom, pos) in record_indices:
+            key = (chrom, pos)
+        else:
+            remaining_rows.append(row)
+            continue
+        row_groups.setdefault(key, []).append(row)
+    record_rows = [[] for _ in records]
+    for key, group_rows in row_groups.items():
+        indices = sorted(set(record_indices[key]))
+        if len(key) == 2:
+            # Rows of a position are assigned to its first record
+            indices = indices[:1]
+        for index, index_rows in zip(
+            indices, split_evenly(group_rows, len(indices))
+        ):
+            record_rows[index].extend(index_rows)
+    return [row for rows in record_rows for row in rows] + remaining_rows
+
+
+def split_evenly(items: List, parts: int) -> List[List]:
+    """This function splits items into parts consecutive lists of the same
+    length. Any remaining items are added to the last list."""
+    size = len(items) // parts
+    return [
+        items[index * size : (index + 1) * size]
+        if index < parts - 1
+        else items[index * size :]
+        for index in range(parts)
+    ]
+
+
+def get_record_key(record: Any) -> tuple:
+    """This function returns the fields identifying a cyvcf2 record"""
+    return (record.CHROM, record.POS, record.REF, ",".join(record.ALT))
+
+
+def write_vcf_chunks(
+    vcf_file: Union[str, Path],
+    records: Iterator,
+    chunk_dir: Union[str, Path],
+    chunk_size: int,
+) -> Iterator[tuple]:
+    """This function splits the records of the input vcf file into BGZF
+    compressed vcf files of chunk_size records in chunk_dir. The chunks
+    are written lazily. A tuple containing the path of the chunk, its number of
+    records and its last record is returned for every chunk in the order
+    of the records."""
+    raw_header = VCF(str(vcf_file)).raw_header
+    for index, chunk in enumerate(batcher(records, chunk_size)):
+        chunk_file = str(Path(chunk_dir) / f"chunk_{index}.vcf.gz")
+        with open_vcf(chunk_file) as chunk_vcf:
+            chunk_vcf.write(raw_header)
+            for record in chunk:
+                chunk_vcf.write(str(record))
+        yield chunk_file, len(chunk), get_record_key(chunk[-1])
+
+
+# State of a worker process of score_variants
+_worker = {}
+
+
+def init_worker(
+    model_config: "ModelConfig",
+    fasta_file: Union[str, Path],
+    gtf_file: Union[str, Path],
+) -> None:
+    """This function keeps the model configuration and the input files
+    of a worker process. The model is loaded and the gtf file is parsed
+    with the first chunk, see ModelConfig.get_dataloader."""
+    _worker["model_config"] = model_config
+    _worker["fasta_file"] = fasta_file
+    _worker["gtf_file"] = gtf_file
+
+
+def score_chunk(
+    model_config: ModelConfig,
+    fasta_file: Union[str, Path],
+    gtf_file: Union[str, Path],
+    vcf_file: str,
+    sort: bool = False,
+) -> List[List]:
+    """This function returns the output rows of a vcf chunk. If sort is
+    True, the dataloader reads a copy of the chunk sorted by contig and
+    position and the rows are returned in the order of the chunk."""
+    dataloader_vcf_file = vcf_file
+    if sort:
+        records = list(VCF(vcf_file))
+        dataloader_vcf_file = str(
+            Path(vcf_file).with_name(f"sorted_{Path(vcf_file).name}")
+        )
+        write_locality_sorted_vcf(
+            vcf_file, dataloader_vcf_file, max(len(records), 1)
+        )
+    try:
+        dataloader = model_config.get_dataloader(
+            {
+                "fasta_file": fasta_file,
+                "gtf_file": gtf_file,
+                "vcf_file": dataloader_vcf_file,
+            }
+        )
+        rows = list(get_rows(model_config, dataloader))
+    finally:
+        if sort:
+            Path(dataloader_vcf_file).unlink()
+    if sort:
+        return restore_vcf_order(rows, records)
+    return rows
+
+
+def score_chunk_in_worker(vcf_file: str, sort: bool = False) -> List[List]:
+    """This function returns the output rows of a vcf chunk in a worker
+    process initialized by init_worker, see score_chunk. Use it with
+    profiling.run_in_worker."""
+    return score_chunk(
+        _worker["model_config"],
+        _worker["fasta_file"],
+        _worker["gtf_file"],
+        vcf_file,
+        sort,
+    )
+
+
+def score_chunks(
+    model_config: ModelConfig,
+    fasta_file: Union[str, Path],
+    gtf_file: Union[str, Path],
+    chunks: Iterator[tuple],
+    sort: bool = False,
+) -> Iterator[tuple]:
+    """This function scores the vcf chunks of write_vcf_chunks one after
+    the other in the current process and returns every chunk along with
+    its output rows like score_chunks_in_workers. Every chunk is deleted
+    once it is scored."""
+    for chunk in chunks:
+        rows = score_chunk(model_config, fasta_file, gtf_file, chunk[0], sort)
+        Path(chunk[0]).unlink()
+        yield chunk, rows
+
+
+def score_chunks_in_workers(
+    pool: Any, chunks: Iterator[tuple], workers: int, sort: bool = False
+) -> Iterator[tuple]:
+    """This function scores the vcf chunks of write_vcf_chunks in the
+    worker processes of pool and returns every chunk along with its output
+    rows in the order of the chunks. Every chunk is deleted once it is
+    scored. See score_chunk_in_worker for sort."""
+    for chunk, rows in profiling.collect(
+        imap_ordered(
+            pool,
+            partial(profiling.run_in_worker, score_chunk_in_worker),
+            ((chunk, (chunk[0], sort)) for chunk in chunks),
+            2 * workers,
+        )
+    ):
+        Path(chunk[0]).unlink()
+        yield chunk, rows
+
+
+def get_chunk_row_blocks(
+    scored_chunks: Iterator[tuple],
+    checkpoint: Optional[Checkpoint],
+    output: Any,
+    records_done: int,
+) -> Iterator[List[List]]:
+    """This function returns the output rows of the scored chunks in blocks
+    of at most OUTPUT_BLOCK_SIZE rows. Since the next block is only
+    requested once the previous one is written, every row of a chunk is
+    written when the rows of the next chunk are requested. This is when
+    the progress is recorded in the checkpoint."""
+    for (_, chunk_records, last_record), rows in scored_chunks:
+        yield from batcher(iter(rows), OUTPUT_BLOCK_SIZE)
+        records_done += chunk_records
+        if checkpoint is not None:
+            checkpoint.update([output.handle], records_done, last_record)
+
+
+def get_columns(rows: List[List]) -> tuple:
+    """This function splits output rows into the five variant columns and
+    the matrix of scored effects which are expected by the outputs of
+    kipoi_veff2.output"""
+    variant_columns = [
+        list(column) for column in zip(*(row[:5] for row in rows))
+    ]
+    return variant_columns, [np.array([row[5:] for row in rows])]
+
+
+def get_rows(model_config: ModelConfig, dataloader: Any) -> Iterator[List]:
+    """This function predicts the scored effects with the dataloader in
+    batches and returns the output rows made of the variant information
+    and the scored effects"""
+    for batch in profiling.iterate("dataloader", dataloader.batch_iter()):
+        profiling.next_batch()
+        with profiling.stage("prediction"):
+            predictions = (
+                model_config.kipoi_model_with_dataloader.predict_on_batch(
+                    batch["inputs"]
+                )
+            )
+
+        if not np.isscalar(predictions) and not isinstance(
+            predictions, np.ndarray
+        ):
+            raise ValueError(
+                "Only predictions of type scalar or \
+                    numpy.ndarray are supported"
+            )
+
+        if np.isscalar(predictions):
+            predictions = [predictions]
+        for index, pred in enumerate(predictions):
+            pred = [pred] if np.isscalar(pred) else list(pred)
+            variant_info = model_config.get_variant_info(batch, index)
+            yield [
+                variant_info["chrom"],
+                variant_info["pos"],
+                variant_info["id"],
+                variant_info["ref"],
+                variant_info["alt"],
+            ] + pred
+
+
 def score_variants(
     model_config: ModelConfig,
     vcf_file: Union[str, Path],
     fasta_file: Union[str, Path],
     gtf_file: Union[str, Path],
     output_file: Union[str, Path],
+    sort_block_size: Optional[int] = None,
+    sorted_output: bool = False,
+    workers: int = 1,
+    regions: Optional[List[Interval]] = None,
+    checkpoint_interval: Optional[float] = None,
+    resume: bool = False,
+    output_format: str = "tsv",
+    float_format: Optional[str] = None,
+    compression_threads: int = 1,
 ) -> None:
     """This function scores variants. The steps are as follows
     1. A dataloader object is instantiated with the input files
@@ -188,44 +559,157 @@ def score_variants(
     predicted in batches
     3. Variant information is extracted from the data in batches
     4. Scored effects along with variant information is written
-    to the tsv file."""
-    dataloader = model_config.get_dataloader(
-        {
-            "fasta_file": fasta_file,
-            "gtf_file": gtf_file,
-            "vcf_file": vcf_file,
-        }
-    )
-    with open(output_file, "w") as output_tsv:
-        tsv_writer = csv.writer(output_tsv, delimiter="\t")
-        tsv_writer.writerow(model_config.get_column_labels())
-        for batch in dataloader.batch_iter():
-            predictions = (
-                model_config.kipoi_model_with_dataloader.predict_on_batch(
-                    batch["inputs"]
+    to the tsv file.
+
+    If sort_block_size is provided, the dataloader reads a temporary copy
+    of the vcf file where every block of sort_block_size records is sorted
+    by contig and position. The scored effects are written in the original
+    order of the vcf file unless sorted_output is True. To restore it,
+    every block is scored as a chunk like with several workers and its
+    output rows are put back in the order of its records, see
+    restore_vcf_order.
+
+    If workers is greater than 1, the vcf file is split into chunks of
+    WORKER_CHUNK_SIZE records which are scored in as many worker processes,
+    each with its own copy of the model. The output rows of the chunks
+    are written in the order of the chunks.
+
+    If regions are provided, the records within the regions are read
+    through the index of the vcf file and copied to a temporary vcf file
+    which is scored instead of the whole vcf file.
+
+    If checkpoint_interval is provided, the progress of the run is
+    recorded in a checkpoint next to the output file at most every
+    checkpoint_interval seconds. The vcf file is then scored in chunks of
+    WORKER_CHUNK_SIZE records like with several workers and the progress
+    is recorded once a chunk is fully written. With a single worker, the
+    chunks are scored in the current process. The checkpoint is removed
+    when the run is complete. If resume is True, an interrupted run with
+    the same settings continues from its checkpoint.
+
+    The scored effects are written as tsv by default or as parquet or
+    arrow, see kipoi_veff2.output. Scores in tsv files are written exactly
+    unless a printf style float_format such as %.6g is provided. Tsv files
+    whose name ends with .gz or .bgz are BGZF compressed with
+    compression_threads threads and indexed with tabix if their rows are
+    sorted.
+
+    Raises:
+        ValueError: If checkpoints are requested while the original order
+        of the vcf file is restored or for columnar output, or the
+        checkpoint of a resumed run does not match the run
+    """
+    checkpointing = checkpoint_interval is not None or resume
+    restore_order = sort_block_size is not None and not sorted_output
+    if checkpointing and restore_order:
+        raise ValueError(
+            "Checkpoints of interval based models require sorted_output \
+                together with sort_block_size"
+        )
+    if checkpointing and output_format != "tsv":
+        raise ValueError("Checkpoints are only supported for tsv output")
+    settings = {
+        "vcf_file": str(vcf_file),
+        "fasta_file": str(fasta_file),
+        "gtf_file": str(gtf_file),
+        "output_files": [str(output_file)],
+        "models": [model_config.model],
+        "sort_block_size": sort_block_size,
+        "sorted_output": sorted_output,
+        "regions": None
+        if regions is None
+        else [[region.chrom, region.start, region.end] for region in regions],
+        "float_format": float_format,
+    }
+    checkpoint_file = get_checkpoint_file(output_file)
+    with TemporaryDirectory() as temp_dir, ExitStack() as stack:
+        if regions is not None:
+            region_vcf_file = str(Path(temp_dir) / "regions.vcf")
+            write_region_vcf(vcf_file, region_vcf_file, regions)
+            vcf_file = region_vcf_file
+        if sort_block_size is not None and not restore_order:
+            dataloader_vcf_file = str(Path(temp_dir) / "sorted.vcf")
+            write_locality_sorted_vcf(
+                vcf_file, dataloader_vcf_file, sort_block_size
+            )
+        else:
+            dataloader_vcf_file = vcf_file
+        progress = None
+        if resume:
+            progress = load_checkpoint(
+                checkpoint_file, settings, [output_file]
+            )
+        checkpoint = (
+            None
+            if checkpoint_interval is None
+            else Checkpoint(checkpoint_file, settings, checkpoint_interval)
+        )
+        # A resumed run appends to the output file truncated to the
+        # checkpoint which already has its header
+        output = get_output(
+            output_format,
+            output_file,
+            model_config.get_column_labels(),
+            append=progress is not None,
+            float_format=float_format,
+            compression_threads=compression_threads,
+        )
+        stack.enter_context(output)
+        if workers > 1 or checkpointing or restore_order:
+            records = iter(VCF(dataloader_vcf_file))
+            records_done = 0
+            if progress is not None:
+                records_done, last_record_done = progress
+                records = skip_done(
+                    records, records_done, last_record_done, get_record_key
                 )
+            chunks = write_vcf_chunks(
+                dataloader_vcf_file,
+                records,
+                temp_dir,
+                sort_block_size if restore_order else WORKER_CHUNK_SIZE,
             )
-
-            if not np.isscalar(predictions) and not isinstance(
-                predictions, np.ndarray
-            ):
-                raise ValueError(
-                    "Only predictions of type scalar or \
-                        numpy.ndarray are supported"
+            if workers > 1:
+                # Workers are forked, so the model configuration does not
+                # need to be picklable
+                pool = stack.enter_context(
+                    multiprocessing.get_context("fork").Pool(
+                        workers,
+                        initializer=init_worker,
+                        initargs=(model_config, fasta_file, gtf_file),
+                    )
                 )
-
-            if np.isscalar(predictions):
-                predictions = [predictions]
-            for index, pred in enumerate(predictions):
-                pred = [pred] if np.isscalar(pred) else list(pred)
-                variant_info = model_config.get_variant_info(batch, index)
-                tsv_writer.writerow(
-                    [
-                        variant_info["chrom"],
-                        variant_info["pos"],
-                        variant_info["id"],
-                        variant_info["ref"],
-                        variant_info["alt"],
-                    ]
-                    + pred
+                scored_chunks = score_chunks_in_workers(
+                    pool, chunks, workers, sort=restore_order
                 )
+            else:
+                scored_chunks = score_chunks(
+                    model_config,
+                    fasta_file,
+                    gtf_file,
+                    chunks,
+                    sort=restore_order,
+                )
+            row_blocks = get_chunk_row_blocks(
+                scored_chunks,
+                checkpoint,
+                output,
+                records_done,
+            )
+        else:
+            dataloader = model_config.get_dataloader(
+                {
+                    "fasta_file": fasta_file,
+                    "gtf_file": gtf_file,
+                    "vcf_file": dataloader_vcf_file,
+                }
+            )
+            row_blocks = batcher(
+                get_rows(model_config, dataloader), OUTPUT_BLOCK_SIZE
+            )
+        for rows in row_blocks:
+            with profiling.stage("writing"):
+                output.write(*get_columns(rows))
+    if checkpoint is not None:
+        # The run is complete
+        checkpoint.remove()
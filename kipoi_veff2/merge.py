@@ -1,6 +1,415 @@
+from contextlib import ExitStack
+from functools import partial
+import gzip
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+import warnings
+
 import click
 
-import pandas as pd
+from kipoi_veff2 import bgzf
+from kipoi_veff2 import profiling
+
+VARIANT_COLUMN_LABELS = ["#CHROM", "POS", "ID", "REF", "ALT"]
+# Number of rows read from every input file at a time when the input files
+# are merged in step
+MERGE_BLOCK_SIZE = 1000
+# Number of characters of rows which are sorted in memory at a time when
+# an input file is sorted before the input files are joined
+SORT_BUFFER_SIZE = 64 * 1024 * 1024
+# Input files are merged in groups of at most this many files, so that
+# neither open files nor memory grow with the number of input files
+MAX_OPEN_FILES = 128
+
+SortKey = Tuple[str, int, str, str, str]
+
+
+def open_tsv(tsv_file: Union[str, Path]) -> Any:
+    """This function opens a tsv file for reading which may be gzip or
+    BGZF compressed. Rows end with a newline no matter whether the file
+    was written with \\r\\n line endings."""
+    if bgzf.is_bgzf_file(tsv_file):
+        return gzip.open(tsv_file, "rt")
+    return open(tsv_file, "r")
+
+
+def open_merged_tsv(merged_file: Union[str, Path]) -> Any:
+    """This function opens the merged tsv file for writing. It is BGZF
+    compressed if its name ends with .gz or .bgz."""
+    if bgzf.is_bgzf_file(merged_file):
+        return bgzf.BgzfWriter(merged_file)
+    return open(merged_file, "w")
+
+
+def split_row(row: str) -> Tuple[str, str]:
+    """This function splits a row into the text of its five variant
+    columns and the text of its scores"""
+    fields = row.rstrip("\n").split("\t", 5)
+    return "\t".join(fields[:5]), fields[5] if len(fields) > 5 else ""
+
+
+def get_sort_key(variant_text: str) -> SortKey:
+    """This function returns the key by which rows are sorted before they
+    are joined, which is the contig, the position as a number, the id,
+    the reference and the alternative allele"""
+    chrom, pos, variant_id, ref, alt = variant_text.split("\t")
+    return chrom, int(pos), variant_id, ref, alt
+
+
+def read_score_labels(tsv_handle: Any) -> List[str]:
+    """This function reads the header of an open tsv file and returns the
+    labels of its score columns"""
+    score_text = split_row(next(tsv_handle, ""))[1]
+    return score_text.split("\t") if score_text else []
+
+
+def read_block(
+    tsv_handle: Any, block_size: int, number_of_columns: int
+) -> List[Tuple[str, ...]]:
+    """This function reads up to block_size rows of an open tsv file with
+    number_of_columns columns and returns them as six columns of text, the
+    five variant columns and the scores, or as five columns if the file
+    has no scores. Rows are split by builtins only. Narrow files, like the
+    output of a single DeepBind model, are split all at once. For wider
+    files, only the variant columns are split off every row.
+
+    Raises:
+        ValueError: If a row does not have as many columns as expected
+    """
+    block_text = "".join(itertools.islice(tsv_handle, block_size))
+    if not block_text:
+        return []
+    block_text = block_text.rstrip("\n")
+    if number_of_columns <= 6:
+        fields = block_text.replace("\n", "\t").split("\t")
+        if len(fields) % number_of_columns == 0:
+            return [
+                tuple(fields[column::number_of_columns])
+                for column in range(number_of_columns)
+            ]
+    else:
+        rows = list(
+            map(
+                str.split,
+                block_text.split("\n"),
+                itertools.repeat("\t"),
+                itertools.repeat(5),
+            )
+        )
+        if all(len(row) == 6 for row in rows):
+            return list(zip(*rows))
+    raise ValueError(
+        f"Every row of {tsv_handle.name} must have {number_of_columns} \
+            columns like its header"
+    )
+
+
+def write_header(merged_handle: Any, score_labels: List[List[str]]) -> None:
+    merged_handle.write(
+        "\t".join(
+            VARIANT_COLUMN_LABELS
+            + [label for labels in score_labels for label in labels]
+        )
+        + "\n"
+    )
+
+
+def merge_in_step(
+    input_files: List[Union[str, Path]],
+    merged_file: Union[str, Path],
+    block_size: int = MERGE_BLOCK_SIZE,
+) -> bool:
+    """This function merges tsv files whose rows hold the same variants in
+    the same order. The files are read in step, block_size rows at a time,
+    and the scores of every row are copied as they are. If the variants
+    of the files differ, False is returned and the merged file is
+    incomplete."""
+    with ExitStack() as stack:
+        merged_handle = stack.enter_context(open_merged_tsv(merged_file))
+        input_handles = [
+            stack.enter_context(open_tsv(input_file))
+            for input_file in input_files
+        ]
+        score_labels = [
+            read_score_labels(input_handle) for input_handle in input_handles
+        ]
+        write_header(merged_handle, score_labels)
+        while True:
+            with profiling.stage("read"):
+                blocks = [
+                    read_block(input_handle, block_size, len(labels) + 5)
+                    for input_handle, labels in zip(
+                        input_handles, score_labels
+                    )
+                ]
+            variant_columns = blocks[0][:5]
+            if any(block[:5] != variant_columns for block in blocks[1:]):
+                return False
+            if not variant_columns:
+                return True
+            profiling.next_batch()
+            # Rows are assembled from the columns of every file at once
+            with profiling.stage("write"):
+                merged_handle.write(
+                    "\n".join(
+                        map(
+                            "\t".join,
+                            zip(
+                                *variant_columns,
+                                *[
+                                    block[5]
+                                    for block in blocks
+                                    if len(block) > 5
+                                ],
+                            ),
+                        )
+                    )
+                    + "\n"
+                )
+
+
+def read_sorted_run(run_file: Union[str, Path]) -> Iterator[str]:
+    with open(run_file, "r") as run_handle:
+        yield from run_handle
+
+
+def get_row_sort_key(row: str) -> SortKey:
+    return get_sort_key(split_row(row)[0])
+
+
+@profiling.profiled("sort")
+def sort_tsv(
+    input_file: Union[str, Path],
+    sorted_file: Union[str, Path],
+    buffer_size: int = SORT_BUFFER_SIZE,
+) -> str:
+    """This function sorts the rows of a tsv file by variant, see
+    get_sort_key, and writes them together with the header to sorted_file.
+    Rows of buffer_size characters at a time are sorted in memory and
+    written to temporary runs next to sorted_file which are merged in the
+    end. Rows of the same variant keep their order. The sorted file is
+    returned."""
+    run_files = []
+    with open_tsv(input_file) as input_handle:
+        header = next(input_handle, "")
+        while True:
+            rows = []
+            rows_size = 0
+            for row in input_handle:
+                rows.append(row if row.endswith("\n") else row + "\n")
+                rows_size += len(row)
+                if rows_size >= buffer_size:
+                    break
+            if not rows:
+                break
+            rows.sort(key=get_row_sort_key)
+            run_files.append(f"{sorted_file}.run{len(run_files)}")
+            with open(run_files[-1], "w") as run_handle:
+                run_handle.writelines(rows)
+    with open(sorted_file, "w") as sorted_handle:
+        sorted_handle.write(header)
+        sorted_handle.writelines(
+            heapq.merge(
+                *[read_sorted_run(run_file) for run_file in run_files],
+                key=get_row_sort_key,
+            )
+        )
+    for run_file in run_files:
+        os.remove(run_file)
+    return str(sorted_file)
+
+
+def read_sorted_rows(
+    input_handle: Any, file_index: int
+) -> Iterator[Tuple[SortKey, int, str, str]]:
+    for row in input_handle:
+        variant_text, scores = split_row(row)
+        yield get_sort_key(variant_text), file_index, variant_text, scores
+
+
+@profiling.profiled("join")
+def join_sorted(
+    input_files: List[Union[str, Path]], merged_file: Union[str, Path]
+) -> bool:
+    """This function joins tsv files which are sorted by variant, see
+    sort_tsv, into a merged file which is sorted by variant as well. A
+    variant which is missing in some of the files gets empty scores for
+    these files. If a variant occurs several times in a file, its n-th
+    occurrences in the files are joined. True is returned for the sake of
+    merge_in_groups."""
+    with ExitStack() as stack:
+        merged_handle = stack.enter_context(open_merged_tsv(merged_file))
+        input_handles = [
+            stack.enter_context(open_tsv(input_file))
+            for input_file in input_files
+        ]
+        score_labels = [
+            read_score_labels(input_handle) for input_handle in input_handles
+        ]
+        write_header(merged_handle, score_labels)
+        missing_scores = ["\t" * (len(labels) - 1) for labels in score_labels]
+        sorted_rows = heapq.merge(
+            *[
+                read_sorted_rows(input_handle, file_index)
+                for file_index, input_handle in enumerate(input_handles)
+            ],
+            key=lambda sorted_row: sorted_row[:2],
+        )
+        for _, variant_rows in itertools.groupby(
+            sorted_rows, key=lambda sorted_row: sorted_row[0]
+        ):
+            file_scores = [[] for _ in input_files]
+            for _, file_index, variant_text, scores in variant_rows:
+                file_scores[file_index].append(scores)
+            for occurrence in range(max(map(len, file_scores))):
+                merged_handle.write(
+                    "\t".join(
+                        [variant_text]
+                        + [
+                            scores[occurrence]
+                            if occurrence < len(scores)
+                            else missing
+                            for scores, missing, labels in zip(
+                                file_scores, missing_scores, score_labels
+                            )
+                            if labels
+                        ]
+                    )
+                    + "\n"
+                )
+    return True
+
+
+def split_evenly(items: List, number_of_groups: int) -> List[List]:
+    """This function splits items into consecutive groups whose sizes
+    differ by at most one"""
+    group_size, remainder = divmod(len(items), number_of_groups)
+    groups = []
+    start = 0
+    for group_index in range(number_of_groups):
+        end = start + group_size + (group_index < remainder)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+def merge_in_groups(
+    merge_files: Callable[[List[str], str], bool],
+    input_files: List[str],
+    merged_file: Union[str, Path],
+    temp_dir: str,
+    pool: Optional[Any] = None,
+    workers: int = 1,
+    max_open_files: int = MAX_OPEN_FILES,
+) -> bool:
+    """This function merges the input files with merge_files while
+    opening at most max_open_files input files at a time. Consecutive
+    groups of input files are merged into temporary files, which are
+    merged again, until there are few enough of them. With several
+    workers, the input files are split into at least as many groups
+    which are merged in parallel by the pool. The columns keep the order
+    of the input files. False is returned as soon as merge_files fails."""
+    level = 0
+    while True:
+        number_of_groups = math.ceil(len(input_files) / max_open_files)
+        if workers > 1 and len(input_files) >= 2 * workers:
+            number_of_groups = max(number_of_groups, workers)
+        if number_of_groups <= 1:
+            return merge_files(input_files, str(merged_file))
+        group_files = [
+            str(Path(temp_dir) / f"merged.{level}.{group_index}.tsv")
+            for group_index in range(number_of_groups)
+        ]
+        merge_tasks = list(
+            zip(split_evenly(input_files, number_of_groups), group_files)
+        )
+        if pool is None:
+            merged = itertools.starmap(merge_files, merge_tasks)
+        else:
+            merged = profiling.starmap(pool, merge_files, merge_tasks)
+        if not all(merged):
+            return False
+        input_files = group_files
+        level += 1
+
+
+def merge_tsvs(
+    input_files: List[Union[str, Path]],
+    merged_file: Union[str, Path],
+    block_size: int = MERGE_BLOCK_SIZE,
+    workers: int = 1,
+    max_open_files: int = MAX_OPEN_FILES,
+) -> None:
+    """This function merges the scored effects of several tsv files into
+    a single tsv file whose score columns are the score columns of the
+    input files in their order. Peak memory does not depend on the
+    number of input files or rows.
+    1. If the input files hold the same variants in the same order, which
+    is the case for outputs of the same vcf file, they are read in step
+    block_size rows at a time and the rows are written in this order.
+    2. Otherwise, every input file is sorted by variant on disk and the
+    sorted files are joined with a k-way merge. The merged file is then
+    sorted by contig, position, id, reference and alternative allele and a
+    variant which is missing in an input file gets empty scores.
+    In both cases, at most max_open_files input files are merged at a time
+    and scores are copied as they are. Temporary files are written next to
+    the merged file. With several workers, input files are sorted and
+    groups of input files are merged in as many processes."""
+    input_files = [str(input_file) for input_file in input_files]
+    max_open_files = max(max_open_files, 2)
+    with ExitStack() as stack:
+        temp_dir = stack.enter_context(
+            TemporaryDirectory(dir=Path(merged_file).resolve().parent)
+        )
+        pool = None
+        if workers > 1:
+            pool = stack.enter_context(multiprocessing.Pool(workers))
+        if merge_in_groups(
+            partial(merge_in_step, block_size=block_size),
+            input_files,
+            merged_file,
+            temp_dir,
+            pool,
+            workers,
+            max_open_files,
+        ):
+            return
+        warnings.warn(
+            "The input files do not hold the same variants in the same \
+                order. They are sorted and joined instead and the merged \
+                file is sorted by variant."
+        )
+        sort_tasks = [
+            (input_file, str(Path(temp_dir) / f"sorted.{file_index}.tsv"))
+            for file_index, input_file in enumerate(input_files)
+        ]
+        if pool is None:
+            sorted_files = list(itertools.starmap(sort_tsv, sort_tasks))
+        else:
+            sorted_files = profiling.starmap(pool, sort_tsv, sort_tasks)
+        merge_in_groups(
+            join_sorted,
+            sorted_files,
+            merged_file,
+            temp_dir,
+            pool,
+            workers,
+            max_open_files,
+        )
 
 
 @click.command()
@@ -11,15 +420,51 @@ import pandas as pd
     required=True,
 )
 @click.argument("merged_tsv", nargs=1, type=click.Path(), required=True)
-def merge(input_tsvs, merged_tsv) -> None:
+@click.option(
+    "--block-size",
+    "block_size",
+    default=MERGE_BLOCK_SIZE,
+    type=click.IntRange(min=1),
+    help="Read this many rows of every input file at a time.",
+)
+@click.option(
+    "--workers",
+    "workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Read, sort and merge the input files in this many processes.",
+)
+@click.option(
+    "--max-open-files",
+    "max_open_files",
+    default=MAX_OPEN_FILES,
+    type=click.IntRange(min=2),
+    help="Merge at most this many input files at a time. More input files\
+        are merged in groups through temporary files.",
+)
+@click.option(
+    "--profile",
+    "profile",
+    is_flag=True,
+    help="Record the wall and cpu time, calls and batches of every stage\
+        of the merge. The profile is printed as a table when the merge ends\
+        and written as json to MERGED_TSV.profile.json.",
+)
+def merge(
+    input_tsvs: Tuple[str, ...],
+    merged_tsv: str,
+    block_size: int,
+    workers: int,
+    max_open_files: int,
+    profile: bool,
+) -> None:
     """Merge multiple tsvs into a single tsvs"""
-    index_columns = ["#CHROM", "POS", "ID", "REF", "ALT"]
-    dfs = [
-        pd.read_csv(input_tsv, sep="\t", index_col=index_columns)
-        for input_tsv in input_tsvs
-    ]
-    df_merged = pd.concat(dfs, axis=1)
-    df_merged.to_csv(merged_tsv, sep="\t")
+    with profiling.profile_run(
+        profiling.get_profile_file(merged_tsv) if profile else None
+    ):
+        merge_tsvs(
+            list(input_tsvs), merged_tsv, block_size, workers, max_open_files
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import kipoi
+
+from kipoi_veff2 import profiling
+
+DESCRIPTION_DIR_VARIABLE = "KIPOI_VEFF2_DESCRIPTION_DIR"
+DEFAULT_DESCRIPTION_DIR = Path("~", ".kipoi_veff2", "descriptions")
+DESCRIPTION_CACHE_VERSION = 2
+
+# Models and full kipoi model descriptions loaded by the current process
+# keyed by model name and keyword arguments. Every entry records the
+# process that loaded it, so that forked processes load their own models.
+_models = {}
+_kipoi_descriptions = {}
+# Parsed model descriptions keyed by model name
+_descriptions = {}
+# Local models and their descriptions registered by name, see
+# register_model
+_registered_models = {}
+
+
+@dataclass
+class DataloaderDescription:
+    """This class holds the name and the default arguments of the default
+    dataloader of a model"""
+
+    defined_as: Optional[str]
+    default_args: Dict[str, Any]
+
+
+@dataclass
+class ModelDescription:
+    """This class holds the parts of a kipoi model description needed to
+    score variants namely the column labels and the shape of the targets
+    along with the default dataloader and the version of the model. Unlike
+    kipoi model descriptions, it can be stored as json."""
+
+    column_labels: Optional[List[str]]
+    target_shape: List[Optional[int]]
+    default_dataloader: DataloaderDescription
+    version: Optional[str] = None
+
+
+def get_description_file(model: str) -> Path:
+    """This function returns the path of the cached description of a
+    model. The directory can be set with the KIPOI_VEFF2_DESCRIPTION_DIR
+    environment variable."""
+    description_dir = (
+        os.environ.get(DESCRIPTION_DIR_VARIABLE) or DEFAULT_DESCRIPTION_DIR
+    )
+    return Path(description_dir).expanduser() / (
+        model.replace("/", "_") + ".json"
+    )
+
+
+def register_model(
+    model: str, kipoi_model: Any, description: ModelDescription
+) -> None:
+    """This function makes a local model available under a name without
+    kipoi, for instance the stub models of kipoi_veff2.benchmark. The
+    model needs a predict_on_batch function like a kipoi model. Registered
+    models are shared with forked worker processes."""
+    _registered_models[model] = (kipoi_model, description)
+
+
+@profiling.profiled("model_loading")
+def get_model(model: str, **kwargs) -> Any:
+    """This function returns the kipoi model of kipoi.get_model(model,
+    **kwargs) or the registered model of this name. A kipoi model is
+    loaded once per process."""
+    if model in _registered_models:
+        return _registered_models[model][0]
+    key = (model, tuple(sorted(kwargs.items())))
+    pid, kipoi_model = _models.get(key, (None, None))
+    if pid != os.getpid():
+        kipoi_model = kipoi.get_model(model, **kwargs)
+        _models[key] = (os.getpid(), kipoi_model)
+    return kipoi_model
+
+
+def get_kipoi_model_description(model: str) -> Any:
+    """This function returns the full kipoi description of a model. It is
+    taken from the model if it is loaded by the current process and read
+    once per process otherwise."""
+    for (model_name, _), (pid, kipoi_model) in _models.items():
+        if (
+            model_name == model
+            and pid == os.getpid()
+            and getattr(kipoi_model, "description", None) is not None
+        ):
+            return kipoi_model.description
+    pid, kipoi_description = _kipoi_descriptions.get(model, (None, None))
+    if pid != os.getpid():
+        kipoi_description = kipoi.get_model_descr(model)
+        _kipoi_descriptions[model] = (os.getpid(), kipoi_description)
+    return kipoi_description
+
+
+def parse_model_description(kipoi_description: Any) -> ModelDescription:
+    """This function extracts a ModelDescription from a kipoi model
+    description"""
+    targets = kipoi_description.schema.targets
+    dataloader = kipoi_description.default_dataloader
+    version = getattr(
+        getattr(kipoi_description, "info", None), "version", None
+    )
+    return ModelDescription(
+        column_labels=(
+            list(targets.column_labels) if targets.column_labels else None
+        ),
+        target_shape=list(targets.shape),
+        default_dataloader=DataloaderDescription(
+            defined_as=getattr(dataloader, "defined_as", None),
+            default_args=dict(getattr(dataloader, "default_args", {}) or {}),
+        ),
+        version=None if version is None else str(version),
+    )
+
+
+def read_model_description(model: str) -> Optional[ModelDescription]:
+    """This function returns the cached description of a model if there
+    is one written by the same version of kipoi"""
+    description_file = get_description_file(model)
+    try:
+        with open(description_file, "r") as description_json:
+            cached_description = json.load(description_json)
+    except (OSError, ValueError):
+        return None
+    if (
+        cached_description.get("version") != DESCRIPTION_CACHE_VERSION
+        or cached_description.get("kipoi_version") != kipoi.__version__
+    ):
+        return None
+    description = cached_description["description"]
+    return ModelDescription(
+        column_labels=description["column_labels"],
+        target_shape=description["target_shape"],
+        default_dataloader=DataloaderDescription(
+            **description["default_dataloader"]
+        ),
+        version=description["version"],
+    )
+
+
+def write_model_description(model: str, description: ModelDescription) -> None:
+    """This function caches the description of a model on disk. Every
+    process writes to its own temporary file which atomically replaces
+    the cached description. A description that can not be stored as json
+    is not cached."""
+    description_file = get_description_file(model)
+    try:
+        text = json.dumps(
+            {
+                "version": DESCRIPTION_CACHE_VERSION,
+                "kipoi_version": kipoi.__version__,
+                "model": model,
+                "description": asdict(description),
+            }
+        )
+    except (TypeError, ValueError):
+        return
+    description_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_description_file = description_file.with_name(
+        f"{description_file.name}.{os.getpid()}.tmp"
+    )
+    with open(temp_description_file, "w") as description_json:
+        description_json.write(text)
+    os.replace(temp_description_file, description_file)
+
+
+def get_model_description(model: str) -> ModelDescription:
+    """This function returns the parsed description of a model. It is
+    read from the description cache on disk if possible, so that kipoi
+    does not have to parse the model's yaml files. Otherwise, it is parsed
+    from the kipoi model description and cached. Delete the cached
+    description to pick up changes of the model description. Registered
+    models have the description they were registered with."""
+    if model in _registered_models:
+        return _registered_models[model][1]
+    if model not in _descriptions:
+        description = read_model_description(model)
+        if description is None:
+            description = parse_model_description(
+                get_kipoi_model_description(model)
+            )
+            write_model_description(model, description)
+        _descriptions[model] = description
+    return _descriptions[model]
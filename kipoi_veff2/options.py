@@ -0,0 +1,94 @@
+import re
+from typing import Tuple
+
+# Everything needed to validate the options of kipoi_veff2_predict. This
+# module must only import the standard library, so that printing the help
+# or rejecting invalid options does not wait for kipoi, kipoiseq, cyvcf2,
+# numpy or pandas to be imported.
+
+VARIANT_CENTERED_MODEL_GROUPS = {
+    "Basset",
+    "DeepBind",
+    "DeepSEA",
+    "MPRA-DragoNN",
+    "pwm_HOCOMOCO",
+    "Basenji",
+}
+INTERVAL_BASED_MODEL_GROUPS = ["MMSplice"]
+AVAILABLE_SCORING_FUNCTIONS = [
+    "diff",
+    "alt",
+    "ref",
+    "logit",
+    "logit_alt",
+    "logit_ref",
+    "deepsea_effect",
+]
+OUTPUT_FORMATS = ["tsv", "parquet", "arrow"]
+# Characters a formatted score must not contain as they would be quoted
+# in a tsv file
+TSV_SPECIAL_CHARACTERS = ("\t", '"', "\r", "\n")
+REGION_PATTERN = re.compile(r"^(?P<chrom>[^:]+):(?P<start>\d+)-(?P<end>\d+)$")
+SHARD_PATTERN = re.compile(r"^(?P<shard>\d+)/(?P<shards>\d+)$")
+
+
+def parse_region_coordinates(region: str) -> Tuple[str, int, int]:
+    """This function converts a region of the form chr:start-end with
+    1-based inclusive coordinates, as used by tabix and samtools, to the
+    contig, 0-based start and end of a half open interval. Thousands
+    separators are ignored.
+
+    Raises:
+        ValueError: If the region is not of the form chr:start-end or
+        start is greater than end
+    """
+    match = REGION_PATTERN.match(region.replace(",", ""))
+    if match is None:
+        raise ValueError(
+            f"Invalid region {region}. Regions must be of the form \
+                chr:start-end"
+        )
+    start, end = int(match.group("start")), int(match.group("end"))
+    if start < 1 or start > end:
+        raise ValueError(
+            f"Invalid region {region}. Start must be between 1 and end"
+        )
+    return match.group("chrom"), start - 1, end
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """This function converts a shard of the form i/N, where shards are
+    numbered from 1 to N, to a tuple (i, N)
+
+    Raises:
+        ValueError: If the shard is not of the form i/N with 1 <= i <= N
+    """
+    match = SHARD_PATTERN.match(shard)
+    if match is None or not (
+        1 <= int(match.group("shard")) <= int(match.group("shards"))
+    ):
+        raise ValueError(
+            f"Invalid shard {shard}. Shards must be of the form i/N \
+                with 1 <= i <= N"
+        )
+    return int(match.group("shard")), int(match.group("shards"))
+
+
+def validate_float_format(float_format: str) -> None:
+    """This function checks that float_format is a printf style format
+    of a single number
+
+    Raises:
+        ValueError: If float_format can not format a number
+    """
+    try:
+        formatted = float_format % 0.5
+    except (TypeError, ValueError):
+        formatted = None
+    if not isinstance(formatted, str) or any(
+        character in formatted for character in TSV_SPECIAL_CHARACTERS
+    ):
+        raise ValueError(
+            f"Invalid float format {float_format}. Please provide a printf \
+                style format of a single number such as %.6g."
+        )
@@ -0,0 +1,324 @@
+import gzip
+import itertools
+from pathlib import Path
+from typing import Any, List, Optional, Union
+import warnings
+
+import numpy as np
+
+from kipoi_veff2 import bgzf
+from kipoi_veff2.options import (
+    OUTPUT_FORMATS,
+    TSV_SPECIAL_CHARACTERS,
+    validate_float_format,
+)
+
+VARIANT_COLUMN_LABELS = ["#CHROM", "POS", "ID", "REF", "ALT"]
+# Rows end like the rows of a csv writer, whose fields are quoted if they
+# contain any of the special characters
+TSV_LINE_END = "\r\n"
+# Number of rows of an appended output file checked at once
+EXISTING_ROWS_BLOCK_SIZE = 10000
+
+
+def format_field(value: Any) -> str:
+    """This function formats a variant column value the same way as a
+    csv writer with a tab delimiter. None becomes an empty field and
+    fields containing a tab, a quote or a line break are quoted."""
+    if value is None:
+        return ""
+    field = str(value)
+    if any(character in field for character in TSV_SPECIAL_CHARACTERS):
+        return '"' + field.replace('"', '""') + '"'
+    return field
+
+
+def format_score_block(
+    score_block: np.ndarray, float_format: Optional[str] = None
+) -> List[str]:
+    """This function formats a score matrix into one string of tab
+    separated scores per row. Without a float_format, every score is
+    formatted like str() of the score which is what a csv writer does.
+    With a printf style float_format such as %.6g, every row is formatted
+    with a single format operation."""
+    score_block = np.asarray(score_block)
+    if float_format is None:
+        return [
+            "\t".join(score_row)
+            for score_row in score_block.astype(str).tolist()
+        ]
+    row_format = "\t".join([float_format] * score_block.shape[1])
+    return [
+        row_format % tuple(score_row) for score_row in score_block.tolist()
+    ]
+
+
+def format_header(column_labels: List[str]) -> str:
+    """This function formats the header line of a tsv file"""
+    return "\t".join(map(format_field, column_labels)) + TSV_LINE_END
+
+
+def format_rows(
+    variant_columns: List[List],
+    score_blocks: List[np.ndarray],
+    float_format: Optional[str] = None,
+) -> str:
+    """This function formats a block of rows of a tsv file given the five
+    variant columns and one or more score matrices whose columns follow
+    one another. See format_score_block for float_format."""
+    formatted_columns = [
+        [
+            "\t".join(map(format_field, variant_row))
+            for variant_row in zip(*variant_columns)
+        ]
+    ] + [
+        format_score_block(score_block, float_format)
+        for score_block in score_blocks
+        if np.shape(score_block)[1] > 0
+    ]
+    return "".join(
+        "\t".join(row_parts) + TSV_LINE_END
+        for row_parts in zip(*formatted_columns)
+    )
+
+
+class TsvOutput:
+    """This class writes scored effects to a tab separated file. Every row
+    holds the five variant columns followed by the scores. If append is
+    True, rows are appended to an existing file which already has its
+    header. A whole block is formatted at once and written with a single
+    write call. By default, the output is the same as writing every row
+    with a csv writer. If float_format is provided, scores are formatted
+    with it instead, see format_score_block.
+
+    If the output file ends with .gz or .bgz, it is BGZF compressed with
+    compression_threads threads, see kipoi_veff2.bgzf. If its rows turn
+    out to be sorted by contig and position, it is indexed with tabix
+    once it is closed after the run is complete. An index of an earlier
+    run is removed when the output file is opened. The rows an appended
+    file already holds are read once to check whether they are sorted.
+
+    Used as a context manager, the output is closed when the with block
+    exits and only indexed if the with block did not raise."""
+
+    def __init__(
+        self,
+        output_file: Union[str, Path],
+        column_labels: List[str],
+        append: bool = False,
+        float_format: Optional[str] = None,
+        compression_threads: int = 1,
+    ) -> None:
+        if float_format is not None:
+            validate_float_format(float_format)
+        self.output_file = output_file
+        self.float_format = float_format
+        self.compressed = bgzf.is_bgzf_file(output_file)
+        self.is_sorted = True
+        self.last_chrom = None
+        self.last_pos = 0
+        self.seen_chroms = set()
+        if self.compressed:
+            index_file = Path(f"{output_file}.tbi")
+            if index_file.exists():
+                index_file.unlink()
+            if append:
+                self.check_existing_rows()
+            self.handle = bgzf.BgzfWriter(
+                output_file, append, compression_threads
+            )
+        else:
+            self.handle = open(output_file, "a" if append else "w")
+        if not append:
+            self.handle.write(format_header(column_labels))
+
+    def write(
+        self, variant_columns: List[List], score_blocks: List[np.ndarray]
+    ) -> None:
+        """Writes a block of rows given the five variant columns and one
+        or more score matrices of shape (number of rows, number of
+        scores) whose columns follow one another"""
+        if len(variant_columns[0]) == 0:
+            return
+        if self.compressed and self.is_sorted:
+            self.check_sorted(variant_columns[0], variant_columns[1])
+        self.handle.write(
+            format_rows(variant_columns, score_blocks, self.float_format)
+        )
+
+    def check_existing_rows(self) -> None:
+        """Checks whether the rows of the output file to be appended to
+        are sorted, so that the rows of a resumed run continue the check
+        where the interrupted run stopped"""
+        with gzip.open(self.output_file, "rt") as output_handle:
+            rows = (line for line in output_handle if not line.startswith("#"))
+            while self.is_sorted:
+                fields = [
+                    row.split("\t", 2)
+                    for row in itertools.islice(rows, EXISTING_ROWS_BLOCK_SIZE)
+                ]
+                if not fields:
+                    return
+                self.check_sorted(
+                    [field[0] for field in fields],
+                    [int(field[1]) for field in fields],
+                )
+
+    def check_sorted(self, chroms: List[str], positions: List[int]) -> None:
+        """Checks that every contig is contiguous and positions within a
+        contig do not decrease, which is what tabix requires"""
+        for chrom, pos in zip(chroms, positions):
+            if chrom != self.last_chrom:
+                if chrom in self.seen_chroms:
+                    self.is_sorted = False
+                    return
+                self.seen_chroms.add(chrom)
+                self.last_chrom = chrom
+            elif pos < self.last_pos:
+                self.is_sorted = False
+                return
+            self.last_pos = pos
+
+    def close(self, complete: bool = True) -> None:
+        """Closes the output file. A BGZF compressed output file is only
+        indexed if complete is True, since the rows of an incomplete run
+        are missing from it."""
+        self.handle.close()
+        if self.compressed and complete:
+            if self.is_sorted:
+                bgzf.build_tabix_index(self.output_file)
+            else:
+                warnings.warn(
+                    f"{self.output_file} is not indexed because its rows \
+                        are not sorted by contig and position"
+                )
+
+    def __enter__(self) -> "TsvOutput":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self.close(complete=exc_type is None)
+
+
+class ArrowOutput:
+    """This class writes scored effects to a Parquet or an Arrow IPC file.
+    Every block is written as a row group (Parquet) or a record batch
+    (Arrow). The variant columns are typed, POS as int64 and the others as
+    strings, and scores are stored as float32. Column names are the column
+    labels of the tsv output. pyarrow is an optional dependency which is
+    only required for these formats."""
+
+    def __init__(
+        self,
+        output_file: Union[str, Path],
+        column_labels: List[str],
+        output_format: str,
+    ) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(
+                f"Writing {output_format} output requires pyarrow. Please \
+                    install it with pip install pyarrow."
+            )
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                pa.field(VARIANT_COLUMN_LABELS[0], pa.string()),
+                pa.field(VARIANT_COLUMN_LABELS[1], pa.int64()),
+            ]
+            + [
+                pa.field(column_label, pa.string())
+                for column_label in VARIANT_COLUMN_LABELS[2:]
+            ]
+            + [
+                pa.field(column_label, pa.float32())
+                for column_label in column_labels[5:]
+            ]
+        )
+        if output_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(
+                str(output_file), self.schema
+            )
+        else:
+            self.writer = pyarrow.ipc.new_file(str(output_file), self.schema)
+
+    def write(
+        self, variant_columns: List[List], score_blocks: List[np.ndarray]
+    ) -> None:
+        """Writes a block of rows given the five variant columns and one
+        or more score matrices of shape (number of rows, number of
+        scores) whose columns follow one another"""
+        columns = [
+            self.pa.array(
+                [None if value is None else str(value) for value in column],
+                type=self.pa.string(),
+            )
+            if index != 1
+            else self.pa.array(column, type=self.pa.int64())
+            for index, column in enumerate(variant_columns)
+        ]
+        for score_block in score_blocks:
+            # Every score column is contiguous in the transposed matrix
+            score_columns = np.ascontiguousarray(
+                np.asarray(score_block, dtype=np.float32).T
+            )
+            columns += [
+                self.pa.array(score_column) for score_column in score_columns
+            ]
+        self.writer.write_table(
+            self.pa.Table.from_arrays(columns, schema=self.schema)
+        )
+
+    def close(self, complete: bool = True) -> None:
+        self.writer.close()
+
+    def __enter__(self) -> "ArrowOutput":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self.close(complete=exc_type is None)
+
+
+def get_output(
+    output_format: str,
+    output_file: Union[str, Path],
+    column_labels: List[str],
+    append: bool = False,
+    float_format: Optional[str] = None,
+    compression_threads: int = 1,
+) -> Any:
+    """This function returns a writer of scored effects in the requested
+    output format. A float_format and compression_threads are only used
+    for tsv output.
+
+    Raises:
+        ValueError: If the output format is not supported, rows are
+        appended to a columnar output file or a float format is provided
+        for a columnar output file
+    """
+    if output_format == "tsv":
+        return TsvOutput(
+            output_file,
+            column_labels,
+            append,
+            float_format,
+            compression_threads,
+        )
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output format {output_format}. Supported output \
+                formats are {', '.join(OUTPUT_FORMATS)}"
+        )
+    if append:
+        raise ValueError(
+            f"Rows can not be appended to {output_format} output files"
+        )
+    if float_format is not None:
+        raise ValueError(
+            f"A float format is not supported for {output_format} output \
+                files which store scores as float32"
+        )
+    return ArrowOutput(output_file, column_labels, output_format)
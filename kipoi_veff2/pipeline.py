@@ -0,0 +1,136 @@
+from collections import deque
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+# Marks the end of a queue
+_END = object()
+# Seconds to wait before checking again whether a stage has been stopped
+_POLL_INTERVAL = 0.1
+
+
+class _Error:
+    """This class wraps an exception raised in a background thread so
+    that it can be raised again in the main thread"""
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+def prefetch(iterable: Iterable, size: int) -> Iterator:
+    """This function iterates over iterable in a background thread and keeps
+    up to size items ready for the consumer. Items are returned in the same
+    order. An exception raised while producing an item is raised again in
+    the consumer. If the consumer stops early, the background thread stops
+    after the item it is currently producing."""
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(item: Any) -> None:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                put(item)
+        except BaseException as error:
+            put(_Error(error))
+            return
+        put(_END)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            if isinstance(item, _Error):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def imap_ordered(
+    pool: Any, func: Callable, tasks: Iterable[Tuple[Any, tuple]], size: int
+) -> Iterator[Tuple[Any, Any]]:
+    """This function applies func to the arguments of every task in the
+    worker processes of a multiprocessing pool. Every task is a tuple of
+    a context, which stays in the current process, and the arguments of
+    func. Tuples of the context and the result of every task are returned
+    in the order of the tasks. Unlike pool.imap, at most size tasks are
+    pending at any time, so tasks are only read as fast as they are done.
+    An exception raised by func is raised again when its result is
+    due."""
+    pending = deque()
+    for context, args in tasks:
+        if len(pending) >= size:
+            done_context, result = pending.popleft()
+            yield done_context, result.get()
+        pending.append((context, pool.apply_async(func, args)))
+    while pending:
+        done_context, result = pending.popleft()
+        yield done_context, result.get()
+
+
+class BackgroundWriter:
+    """This class executes write calls one after another in a background
+    thread, in the order they were submitted. At most size calls are
+    pending at any time, submitting more blocks until one is done. An
+    exception raised by a write call is raised again in the main thread
+    on the next submit or when the writer is closed. It is meant to be
+    used as a context manager."""
+
+    def __init__(self, size: int) -> None:
+        self.tasks = queue.Queue(maxsize=size)
+        self.error = None
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def _work(self) -> None:
+        while True:
+            task = self.tasks.get()
+            if task is _END:
+                return
+            if self.error is not None:
+                # Skip the remaining tasks after a failure
+                continue
+            func, args = task
+            try:
+                func(*args)
+            except BaseException as error:
+                self.error = error
+
+    def submit(self, func: Callable, *args: Any) -> None:
+        """Schedules func(*args) after all previously submitted calls"""
+        if self.error is not None:
+            raise self.error
+        self.tasks.put((func, args))
+
+    def close(self) -> None:
+        """Waits for all submitted calls to finish"""
+        if self.worker.is_alive():
+            self.tasks.put(_END)
+            self.worker.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if exc_type is None:
+            self.close()
+        elif self.worker.is_alive():
+            # Do not mask the exception of the main thread
+            self.tasks.put(_END)
+            self.worker.join()
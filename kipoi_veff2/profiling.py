@@ -0,0 +1,349 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import partial, wraps
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+PROFILE_VERSION = 1
+# Cpu time of the current thread, so that stages of background threads are
+# not charged with the cpu time of other threads. time.thread_time requires
+# python 3.7.
+get_thread_time = getattr(time, "thread_time", time.process_time)
+
+
+@dataclass
+class StageProfile:
+    """This class holds the cumulative wall and cpu time in seconds spent
+    in a stage, the number of times the stage was entered and the number of
+    batches it ran in"""
+
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    calls: int = 0
+    batches: int = 0
+
+
+class NullStage:
+    """This class is the context manager of every stage while profiling
+    is disabled. It does nothing."""
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+
+NULL_STAGE = NullStage()
+
+
+class Profiler:
+    """This class records how much time is spent in every stage of a run.
+    Batches are counted with next_batch and a stage counts every batch it
+    runs in once. Stages can be entered from several threads. A forked
+    process starts over with an empty profile, which it sends back to its
+    parent with pop, see run_in_worker."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.cpu_start = get_total_cpu_time()
+        self.reset()
+
+    def reset(self) -> None:
+        """This function clears all stages of the profile"""
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.batches = 0
+        self.last_batches = {}
+
+    def check_process(self) -> None:
+        """This function clears the profile inherited by a forked
+        process"""
+        if self.pid != os.getpid():
+            self.reset()
+
+    def next_batch(self) -> None:
+        """This function starts the next batch of the run"""
+        self.check_process()
+        self.batches += 1
+
+    def add(
+        self,
+        stage: str,
+        seconds: float,
+        cpu_seconds: float,
+        calls: int = 1,
+        batches: Optional[int] = None,
+    ) -> None:
+        """This function adds time spent in a stage to the profile. Unless
+        a number of batches is given, the current batch is counted if it is
+        the first time the stage runs in it."""
+        self.check_process()
+        with self.lock:
+            stage_profile = self.stages.setdefault(stage, StageProfile())
+            stage_profile.seconds += seconds
+            stage_profile.cpu_seconds += cpu_seconds
+            stage_profile.calls += calls
+            if batches is not None:
+                stage_profile.batches += batches
+            elif self.last_batches.get(stage) != self.batches:
+                stage_profile.batches += 1
+                self.last_batches[stage] = self.batches
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """This function records the time spent in the with block as
+        time spent in stage"""
+        start = time.perf_counter()
+        cpu_start = get_thread_time()
+        try:
+            yield
+        finally:
+            self.add(
+                stage,
+                time.perf_counter() - start,
+                get_thread_time() - cpu_start,
+            )
+
+    def merge(self, profile: Optional[Dict[str, Any]]) -> None:
+        """This function adds the batches and stages of a profile returned
+        by pop in another process"""
+        if profile is None:
+            return
+        for stage, stage_profile in profile["stages"].items():
+            self.add(stage, **stage_profile)
+        with self.lock:
+            self.batches += profile["batches"]
+
+    def pop(self) -> Dict[str, Any]:
+        """This function returns the batches and stages recorded so far and
+        clears them"""
+        self.check_process()
+        with self.lock:
+            profile = {
+                "batches": self.batches,
+                "stages": {
+                    stage: asdict(stage_profile)
+                    for stage, stage_profile in self.stages.items()
+                },
+            }
+        self.reset()
+        return profile
+
+    def to_dict(self) -> Dict[str, Any]:
+        """This function returns the profile of the run so far. The total
+        cpu time includes the cpu time of finished child processes."""
+        with self.lock:
+            return {
+                "version": PROFILE_VERSION,
+                "seconds": time.perf_counter() - self.start,
+                "cpu_seconds": get_total_cpu_time() - self.cpu_start,
+                "batches": self.batches,
+                "stages": {
+                    stage: asdict(stage_profile)
+                    for stage, stage_profile in self.stages.items()
+                },
+            }
+
+
+def get_total_cpu_time() -> float:
+    """This function returns the user and system cpu time of the current
+    process and its finished child processes"""
+    times = os.times()
+    return (
+        times.user + times.system + times.children_user + times.children_system
+    )
+
+
+# Profiler of the current run if profiling is enabled
+_profiler = None
+
+
+def enable() -> Profiler:
+    """This function starts profiling the current process and returns its
+    profiler"""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    """This function stops profiling and returns the profiler of the run
+    if profiling was enabled"""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def stage(stage_name: str) -> Any:
+    """This function returns a context manager recording the time spent
+    in its with block as time spent in stage_name. While profiling is
+    disabled, it does nothing."""
+    if _profiler is None:
+        return NULL_STAGE
+    return _profiler.stage(stage_name)
+
+
+def profiled(stage_name: str) -> Callable[[Callable], Callable]:
+    """This function returns a decorator recording the time spent in a
+    function as time spent in stage_name"""
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def profiled_func(*args: Any, **kwargs: Any) -> Any:
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(stage_name):
+                return func(*args, **kwargs)
+
+        return profiled_func
+
+    return decorator
+
+
+def next_batch() -> None:
+    """This function starts the next batch if profiling is enabled"""
+    if _profiler is not None:
+        _profiler.next_batch()
+
+
+def iterate(stage_name: str, items: Iterable) -> Iterator:
+    """This function returns the items of an iterable and records the
+    time spent producing every item as time spent in stage_name. Every
+    item counts as a batch of the stage. While profiling is disabled, the
+    items are returned as they are."""
+    if _profiler is None:
+        return iter(items)
+    return iterate_profiled(_profiler, stage_name, iter(items))
+
+
+def iterate_profiled(
+    profiler: Profiler, stage_name: str, items: Iterator
+) -> Iterator:
+    while True:
+        start = time.perf_counter()
+        cpu_start = get_thread_time()
+        item = next(items, StopIteration)
+        profiler.add(
+            stage_name,
+            time.perf_counter() - start,
+            get_thread_time() - cpu_start,
+            batches=int(item is not StopIteration),
+        )
+        if item is StopIteration:
+            return
+        yield item
+
+
+def run_in_worker(func: Callable, *args: Any) -> Tuple[Any, Optional[Dict]]:
+    """This function calls func in a worker process and returns its result
+    along with the stages profiled in the worker process since its last
+    task, or None if profiling is disabled"""
+    result = func(*args)
+    return result, None if _profiler is None else _profiler.pop()
+
+
+def collect(results: Iterable[Tuple[Any, tuple]]) -> Iterator[Tuple[Any, Any]]:
+    """This function merges the worker profiles of the tasks of
+    pipeline.imap_ordered whose function is wrapped by run_in_worker into
+    the profile of the current process. The tuples of the context and the
+    result of every task are returned."""
+    for context, (result, worker_profile) in results:
+        if _profiler is not None:
+            _profiler.merge(worker_profile)
+        yield context, result
+
+
+def starmap(pool: Any, func: Callable, tasks: List[tuple]) -> List[Any]:
+    """This function returns pool.starmap(func, tasks) and merges the
+    stages profiled in the worker processes"""
+    results = []
+    for result, worker_profile in pool.starmap(
+        partial(run_in_worker, func), tasks
+    ):
+        if _profiler is not None:
+            _profiler.merge(worker_profile)
+        results.append(result)
+    return results
+
+
+def format_table(profile: Dict[str, Any]) -> str:
+    """This function formats a profile as a table with a row per stage
+    sorted by wall time. The share of every stage is relative to the wall
+    time of the run. Stages of worker processes or background threads run
+    concurrently, so their shares can add up to more than 100%."""
+    rows = [
+        f"{'stage':<14}{'seconds':>10}{'cpu s':>10}{'share':>8}"
+        f"{'calls':>10}{'batches':>9}"
+    ]
+    for stage_name, stage_profile in sorted(
+        profile["stages"].items(), key=lambda item: -item[1]["seconds"]
+    ):
+        share = (
+            stage_profile["seconds"] / profile["seconds"]
+            if profile["seconds"] > 0
+            else 0
+        )
+        rows.append(
+            f"{stage_name:<14}{stage_profile['seconds']:>10.3f}"
+            f"{stage_profile['cpu_seconds']:>10.3f}{share:>8.1%}"
+            f"{stage_profile['calls']:>10}{stage_profile['batches']:>9}"
+        )
+    rows.append(
+        f"{'total':<14}{profile['seconds']:>10.3f}"
+        f"{profile['cpu_seconds']:>10.3f}{1:>8.1%}{'':>10}"
+        f"{profile['batches']:>9}"
+    )
+    return "\n".join(rows)
+
+
+def get_profile_file(output_file: Union[str, Path]) -> str:
+    """This function returns the json file of the profile of a run next to
+    its output file"""
+    return f"{output_file}.profile.json"
+
+
+def write_profile(
+    profile: Dict[str, Any], profile_file: Union[str, Path]
+) -> None:
+    with open(profile_file, "w") as profile_handle:
+        json.dump(profile, profile_handle, indent=1)
+
+
+@contextmanager
+def profile_run(profile_file: Optional[Union[str, Path]]) -> Iterator[None]:
+    """This function profiles the with block if a profile file is given.
+    When the with block exits, even with an exception, the profile is
+    written to the profile file as json and printed as a table to
+    stderr."""
+    if profile_file is None:
+        yield
+        return
+    profiler = enable()
+    try:
+        yield
+    finally:
+        disable()
+        profile = profiler.to_dict()
+        write_profile(profile, profile_file)
+        print(format_table(profile), file=sys.stderr)
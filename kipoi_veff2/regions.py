@@ -0,0 +1,138 @@
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+import warnings
+
+from cyvcf2 import VCF
+from kipoiseq.dataclasses import Interval
+from pyfaidx import Fasta
+
+from kipoi_veff2 import options
+
+parse_shard = options.parse_shard
+
+
+def parse_region(region: str) -> Interval:
+    """This function converts a region of the form chr:start-end with
+    1-based inclusive coordinates, as used by tabix and samtools, to a
+    0-based half open interval. See options.parse_region_coordinates.
+
+    Raises:
+        ValueError: If the region is not of the form chr:start-end or
+        start is greater than end
+    """
+    return Interval(*options.parse_region_coordinates(region))
+
+
+def get_contig_lengths(fasta_file: Union[str, Path]) -> Dict[str, int]:
+    """This function returns the length of every contig of the fasta file
+    in the order of the fasta file"""
+    fasta = Fasta(str(fasta_file))
+    contig_lengths = {name: len(fasta[name]) for name in fasta.keys()}
+    fasta.close()
+    return contig_lengths
+
+
+def get_shard_contig_lengths(
+    fasta_file: Union[str, Path], vcf_file: Union[str, Path]
+) -> Dict[str, int]:
+    """This function returns the lengths of the contigs the genome is
+    sharded by: the contigs of the fasta file in its order followed by
+    the contigs of the index of the vcf file which are not in the fasta
+    file. As their length is unknown, such a contig is given the position
+    of its last record as length and a warning is issued, so that no
+    record of the vcf file is left out of the shards.
+
+    Raises:
+        ValueError: If the vcf file is not indexed
+    """
+    contig_lengths = get_contig_lengths(fasta_file)
+    vcf = open_indexed_vcf(vcf_file)
+    missing_contigs = [
+        chrom for chrom in vcf.seqnames if chrom not in contig_lengths
+    ]
+    if missing_contigs:
+        warnings.warn(
+            f"{', '.join(missing_contigs)} of {vcf_file} are not in \
+                {fasta_file}. They are sharded after the contigs of the \
+                fasta file."
+        )
+    for chrom in missing_contigs:
+        contig_lengths[chrom] = max(
+            (record.POS for record in vcf(chrom)), default=0
+        )
+    vcf.close()
+    return contig_lengths
+
+
+def get_shard_regions(
+    contig_lengths: Dict[str, int], shard: int, shards: int
+) -> List[Interval]:
+    """This function splits the genome, made of the contigs one after
+    another, into shards spans of equal length and returns the regions
+    of the shard-th span (1-based). Every position of the genome belongs
+    to exactly one shard, so the shards of a vcf file are disjoint and
+    together cover all of its records."""
+    genome_length = sum(contig_lengths.values())
+    shard_start = genome_length * (shard - 1) // shards
+    shard_end = genome_length * shard // shards
+    regions = []
+    contig_offset = 0
+    for chrom, length in contig_lengths.items():
+        start = max(shard_start - contig_offset, 0)
+        end = min(shard_end - contig_offset, length)
+        if start < end:
+            regions.append(Interval(chrom, start, end))
+        contig_offset += length
+    return regions
+
+
+def get_vcf_index_file(vcf_file: Union[str, Path]) -> str:
+    """This function returns the path of the CSI index of the vcf file if
+    there is one and the path of its tabix index otherwise"""
+    csi_file = f"{vcf_file}.csi"
+    return csi_file if Path(csi_file).exists() else f"{vcf_file}.tbi"
+
+
+def open_indexed_vcf(vcf_file: Union[str, Path]) -> VCF:
+    """This function opens the vcf file together with its tabix or CSI
+    index
+
+    Raises:
+        ValueError: If the vcf file is not indexed
+    """
+    vcf = VCF(str(vcf_file))
+    try:
+        vcf.set_index(get_vcf_index_file(vcf_file))
+    except OSError:
+        raise ValueError(
+            f"Selecting regions requires a bgzipped vcf file with a tabix \
+                or CSI index. Please index {vcf_file} with tabix."
+        )
+    return vcf
+
+
+def read_records(
+    vcf_file: Union[str, Path], regions: Optional[List[Interval]] = None
+) -> Iterator:
+    """This function iterates over the cyvcf2 records of the vcf file. If
+    regions are provided, the tabix or CSI index of the vcf file is used
+    to seek straight to the records of every region in turn. A record
+    belongs to a region if its position lies within the region, so a
+    deletion spanning the border of two adjacent regions is only
+    returned once.
+
+    Raises:
+        ValueError: If regions are provided and the vcf file is not
+        indexed
+    """
+    if regions is None:
+        yield from VCF(str(vcf_file))
+        return
+    vcf = open_indexed_vcf(vcf_file)
+    seqnames = set(vcf.seqnames)
+    for region in regions:
+        if region.chrom not in seqnames:
+            continue
+        for record in vcf(f"{region.chrom}:{region.start + 1}-{region.end}"):
+            if region.start < record.POS <= region.end:
+                yield record
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+RESULT_CACHE_VERSION = 1
+# Default maximum size of a result cache in bytes
+DEFAULT_MAX_SIZE = 10 * 2**30
+# Eviction shrinks the cache to this fraction of its maximum size, so that
+# it does not evict on every batch once it is full
+EVICTION_TARGET = 0.9
+# Seconds a job waits for another job holding the cache lock
+LOCK_TIMEOUT = 600
+# Maximum number of keys looked up with a single query
+QUERY_SIZE = 500
+
+
+def get_model_key(
+    model: str,
+    model_version: Optional[str],
+    sequence_length: int,
+    scoring_functions: List[str],
+) -> bytes:
+    """This function returns the part of the cache keys of a model which
+    is shared by all variants. Scores are only reused for the same model,
+    model version, sequence length and list of scoring functions."""
+    return json.dumps(
+        [
+            RESULT_CACHE_VERSION,
+            model,
+            model_version,
+            sequence_length,
+            scoring_functions,
+        ]
+    ).encode()
+
+
+def get_keys(
+    model_key: bytes, refs: List[str], alts: List[str]
+) -> List[bytes]:
+    """This function returns the cache keys of the scores of variants
+    given the model key and the reference and alternative sequences of
+    every variant. The keys are content addressed, so the same variant
+    window of another vcf file or fasta file hits the cache."""
+    return [
+        hashlib.sha256(
+            b"\0".join([model_key, ref.encode(), alt.encode()])
+        ).digest()
+        for ref, alt in zip(refs, alts)
+    ]
+
+
+class ResultCache:
+    """This class stores scored effects of variants in a sqlite database
+    on disk, so that variants which were scored before by any job are not
+    inferred again. Every row of scores is keyed by get_keys. Once the
+    database grows beyond max_size bytes, the least recently used scores
+    are evicted. Several processes and threads can share the same cache.
+    Every process opens its own connection and sqlite serializes writes
+    across processes."""
+
+    def __init__(
+        self, cache_file: Union[str, Path], max_size: int = DEFAULT_MAX_SIZE
+    ) -> None:
+        self.cache_file = str(Path(cache_file).expanduser())
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.pid = None
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self) -> sqlite3.Connection:
+        """This function returns the connection of the current process.
+        Connections are not inherited by forked worker processes."""
+        if self.pid != os.getpid():
+            Path(self.cache_file).parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(
+                self.cache_file,
+                timeout=LOCK_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores (key BLOB PRIMARY KEY, \
+                    dtype TEXT, value BLOB, last_used REAL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS scores_last_used ON \
+                    scores (last_used)"
+            )
+            self.pid = os.getpid()
+        return self.connection
+
+    def get(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """This function returns the cached rows of scores of the keys
+        found in the cache and marks them as recently used"""
+        unique_keys = list(dict.fromkeys(keys))
+        rows = {}
+        with self.lock:
+            connection = self.connect()
+            for start in range(0, len(unique_keys), QUERY_SIZE):
+                query_keys = unique_keys[start : start + QUERY_SIZE]
+                for key, dtype, value in connection.execute(
+                    f"SELECT key, dtype, value FROM scores WHERE key IN \
+                        ({', '.join('?' * len(query_keys))})",
+                    query_keys,
+                ):
+                    rows[key] = np.frombuffer(value, dtype=np.dtype(dtype))
+            if rows:
+                last_used = time.time()
+                with connection:
+                    connection.execute("BEGIN")
+                    connection.executemany(
+                        "UPDATE scores SET last_used = ? WHERE key = ?",
+                        [(last_used, key) for key in rows],
+                    )
+            self.hits += sum(key in rows for key in keys)
+            self.misses += sum(key not in rows for key in keys)
+        return rows
+
+    def put(self, keys: List[bytes], scores: np.ndarray) -> None:
+        """This function caches the rows of a score matrix under their
+        keys and evicts the least recently used scores if the cache is too
+        large"""
+        scores = np.ascontiguousarray(scores)
+        dtype = scores.dtype.str
+        last_used = time.time()
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                    [
+                        (key, dtype, row.tobytes(), last_used)
+                        for key, row in zip(keys, scores)
+                    ],
+                )
+            self.evict(connection)
+
+    def get_size(self, connection: sqlite3.Connection) -> int:
+        """This function returns the number of bytes used by the cache
+        database not counting free pages"""
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def evict(self, connection: sqlite3.Connection) -> None:
+        """This function deletes the least recently used scores until the
+        cache uses at most EVICTION_TARGET of its maximum size. Pages of
+        deleted scores are reused by later scores, so the database file
+        does not grow much beyond the maximum size."""
+        if self.get_size(connection) <= self.max_size:
+            return
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            size = self.get_size(connection)
+            while size > self.max_size * EVICTION_TARGET:
+                (count,) = connection.execute(
+                    "SELECT COUNT(*) FROM scores"
+                ).fetchone()
+                if count == 0:
+                    break
+                evicted = count - int(
+                    count * self.max_size * EVICTION_TARGET / size
+                )
+                connection.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM \
+                        scores ORDER BY last_used LIMIT ?)",
+                    (max(evicted, 1),),
+                )
+                size = self.get_size(connection)
+
+    def close(self) -> None:
+        """This function closes the connection of the current process"""
+        with self.lock:
+            if self.pid == os.getpid():
+                self.connection.close()
+            self.pid = None
+            self.connection = None
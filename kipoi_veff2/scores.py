@@ -1,17 +1,11 @@
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 import warnings
 
 import numpy as np
 
-AVAILABLE_SCORING_FUNCTIONS = [
-    "diff",
-    "alt",
-    "ref",
-    "logit",
-    "logit_alt",
-    "logit_ref",
-    "deepsea_effect",
-]
+from kipoi_veff2 import options
+
+AVAILABLE_SCORING_FUNCTIONS = options.AVAILABLE_SCORING_FUNCTIONS
 
 
 def diff(ref_pred: Any, alt_pred: Any) -> List:
@@ -83,3 +77,161 @@ def deepsea_effect(ref_pred: Any, alt_pred: Any) -> List:
     diffs = preds["alt"] - preds["ref"]
     scores = np.abs(logit_diffs) * np.abs(diffs)
     return scores
+
+
+# Built-in scoring functions which compute_scores evaluates together by
+# name. Scoring functions are matched by identity, since custom scoring
+# functions are not necessarily hashable.
+FUSED_SCORING_FUNCTIONS = {
+    "diff": diff,
+    "ref": ref,
+    "alt": alt,
+    "logit": logit,
+    "logit_alt": logit_alt,
+    "logit_ref": logit_ref,
+    "deepsea_effect": deepsea_effect,
+}
+LOGIT_SCORING_FUNCTIONS = {"logit", "logit_alt", "logit_ref", "deepsea_effect"}
+
+
+def get_fused_name(func: Any) -> Optional[str]:
+    """This function returns the name of a scoring function in
+    FUSED_SCORING_FUNCTIONS or None if it is not one of them"""
+    return next(
+        (
+            name
+            for name, fused_func in FUSED_SCORING_FUNCTIONS.items()
+            if func is fused_func
+        ),
+        None,
+    )
+
+
+def as_score_matrix(scores: np.ndarray) -> np.ndarray:
+    """This function turns the scores of a scoring function into a matrix
+    with one row per variant"""
+    if scores.ndim == 0:
+        scores = scores[np.newaxis]
+    if scores.ndim == 1:
+        scores = scores[:, np.newaxis]
+    return scores
+
+
+def get_logits(pred: np.ndarray) -> np.ndarray:
+    """This function returns ln(P/(1 - P)) computed like logit_alt and
+    logit_ref, whose warning is issued by compute_scores instead"""
+    return np.log(pred / (1 - pred))
+
+
+def compute_scores(
+    ref_pred: Any, alt_pred: Any, scoring_functions: List[Dict[str, Any]]
+) -> np.ndarray:
+    """This function scores reference and alternative predictions with
+    several scoring functions and returns the scores of all of them
+    column wise in the order of scoring_functions as a float32 matrix.
+    The built-in scoring functions of this module are evaluated together
+    in a single pass which writes their scores straight into the columns
+    of the preallocated matrix. The logits of the predictions are
+    computed once and the bounds of the predictions are checked once.
+    Any other scoring function is called with the predictions as usual
+    and its scores are copied into its columns. The scores are those of
+    the scoring functions called one by one, rounded to float32.
+    Predictions with more than two axes are scored one function at a
+    time."""
+    ref_pred = np.asarray(ref_pred)
+    alt_pred = np.asarray(alt_pred)
+    funcs = [
+        scoring_function["func"] for scoring_function in scoring_functions
+    ]
+    pred_shape = np.broadcast(ref_pred, alt_pred).shape
+    if len(pred_shape) > 2:
+        return np.concatenate(
+            [
+                as_score_matrix(np.asarray(func(ref_pred, alt_pred)))
+                for func in funcs
+            ],
+            axis=1,
+        )
+    names = [get_fused_name(func) for func in funcs]
+    # Shape of the score matrix of every built-in scoring function
+    fused_shape = (
+        pred_shape[0] if pred_shape else 1,
+        pred_shape[1] if len(pred_shape) == 2 else 1,
+    )
+    custom_blocks = {
+        index: as_score_matrix(np.asarray(func(ref_pred, alt_pred)))
+        for index, (func, name) in enumerate(zip(funcs, names))
+        if name is None
+    }
+    widths = [
+        fused_shape[1] if name is not None else custom_blocks[index].shape[1]
+        for index, name in enumerate(names)
+    ]
+    number_of_rows = (
+        fused_shape[0]
+        if len(custom_blocks) < len(funcs)
+        else next(iter(custom_blocks.values())).shape[0]
+    )
+    score_matrix = np.empty((number_of_rows, sum(widths)), dtype=np.float32)
+    columns = {}
+    start = 0
+    for index, (name, width) in enumerate(zip(names, widths)):
+        if name is None:
+            score_matrix[:, start : start + width] = custom_blocks[index]
+        else:
+            # A view of the columns shaped like the predictions, which
+            # the built-in scoring function writes into
+            columns[name] = score_matrix[:, start : start + width].reshape(
+                pred_shape
+            )
+        start += width
+    if LOGIT_SCORING_FUNCTIONS.intersection(columns):
+        if (
+            ref_pred.min() < 0
+            or ref_pred.max() > 1
+            or alt_pred.min() < 0
+            or alt_pred.max() > 1
+        ):
+            warnings.warn(
+                "Using log_odds on model outputs that are not bound [0,1]"
+            )
+        # The logits are computed in the dtype of the predictions like the
+        # scoring functions do and only rounded once they are written
+        alt_logits = get_logits(alt_pred)
+        ref_logits = get_logits(ref_pred)
+        if "logit_alt" in columns:
+            np.copyto(columns["logit_alt"], alt_logits, casting="unsafe")
+        if "logit_ref" in columns:
+            np.copyto(columns["logit_ref"], ref_logits, casting="unsafe")
+    if "ref" in columns:
+        np.copyto(columns["ref"], ref_pred, casting="unsafe")
+    if "alt" in columns:
+        np.copyto(columns["alt"], alt_pred, casting="unsafe")
+    if "diff" in columns:
+        np.subtract(alt_pred, ref_pred, out=columns["diff"], casting="unsafe")
+    if "logit" in columns:
+        np.subtract(
+            alt_logits, ref_logits, out=columns["logit"], casting="unsafe"
+        )
+    if "deepsea_effect" in columns:
+        effects = columns["deepsea_effect"]
+        if np.result_type(ref_pred, alt_pred) == np.float32:
+            # The scores are not rounded, so the logits and the differences
+            # written above are reused
+            np.abs(
+                columns["logit"]
+                if "logit" in columns
+                else alt_logits - ref_logits,
+                out=effects,
+            )
+            effects *= np.abs(
+                columns["diff"] if "diff" in columns else alt_pred - ref_pred
+            )
+        else:
+            np.multiply(
+                np.abs(alt_logits - ref_logits),
+                np.abs(alt_pred - ref_pred),
+                out=effects,
+                casting="unsafe",
+            )
+    return score_matrix
@@ -0,0 +1,453 @@
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import socket
+import socketserver
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+from kipoiseq.dataclasses import Variant
+
+from kipoi_veff2 import output
+from kipoi_veff2 import options
+from kipoi_veff2 import variant_centered
+from kipoi_veff2.result_cache import ResultCache
+
+# Number of pieces of a job which are queued at a time
+MAX_QUEUED_PIECES = 4
+# Number of fasta files whose sequence extractors are kept open
+MAX_OPEN_FASTA_FILES = 4
+
+
+class ScoringDaemon:
+    """This class keeps variant centered models loaded and scores the
+    variants of jobs submitted by several threads at once. The variants of
+    a job are read lazily and split into pieces of the batch size of its
+    models. The sequences of every piece are extracted in the submitting
+    thread and at most MAX_QUEUED_PIECES pieces of a job are queued. A
+    single scoring thread takes the pieces in turn and fills a batch with
+    pieces of other jobs that use the same models and fasta file, so that
+    concurrent small jobs share predict_on_batch calls. The scores do not
+    depend on how the pieces are batched. Variants are scored with the scoring
+    functions given at startup and sequences are extracted from fasta_file
+    unless a job provides its own fasta file. The sequence extractors of
+    the MAX_OPEN_FASTA_FILES most recently used fasta files are kept open.
+    Scores are looked up in a result cache if one is provided."""
+
+    def __init__(
+        self,
+        model_configs: List[variant_centered.ModelConfig],
+        fasta_file: Union[str, Path],
+        scoring_functions: List[Dict[str, Any]] = [],
+        result_cache: Optional[ResultCache] = None,
+    ) -> None:
+        self.models = variant_centered.get_models(
+            model_configs, scoring_functions, result_cache=result_cache
+        )
+        self.model_indices = {
+            model["config"].model: index
+            for index, model in enumerate(self.models)
+        }
+        self.fasta_file = str(fasta_file)
+        self.sequence_length = max(
+            model["sequence_length"] for model in self.models
+        )
+        # Sequence extractors and the locks serializing their use keyed
+        # by fasta file in the order of their last use
+        self.extractors = OrderedDict()
+        self.extractors_lock = threading.Lock()
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        """Starts the scoring thread"""
+        self.thread.start()
+
+    def close(self) -> None:
+        """Stops the scoring thread once every pending piece is scored"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        with self.extractors_lock:
+            for extractor in self.extractors.values():
+                if extractor["users"] == 0:
+                    close_extractor(extractor)
+            self.extractors.clear()
+
+    def get_model_indices(self, models: Optional[List[str]]) -> tuple:
+        """Returns the indices of the requested models, all models by
+        default
+
+        Raises:
+            ValueError: If a requested model is not loaded
+        """
+        if not models:
+            return tuple(range(len(self.models)))
+        unknown_models = [
+            model for model in models if model not in self.model_indices
+        ]
+        if unknown_models:
+            raise ValueError(
+                f"{', '.join(unknown_models)} not loaded. Loaded models are \
+                    {', '.join(self.model_indices)}"
+            )
+        return tuple(self.model_indices[model] for model in models)
+
+    def get_column_labels(self, model_indices: tuple) -> List[str]:
+        """Returns the header of the output of the models"""
+        return variant_centered.get_headers(
+            [self.models[index] for index in model_indices], True
+        )[0]
+
+    @contextmanager
+    def use_extractor(self, fasta_file: str) -> Iterator[Dict[str, Any]]:
+        """Provides the variant sequence extractor and the genome index of
+        a fasta file along with the lock serializing their use. Once more
+        than MAX_OPEN_FASTA_FILES fasta files are open, the least recently
+        used one is closed as soon as no job uses it anymore."""
+        with self.extractors_lock:
+            extractor = self.extractors.pop(fasta_file, None)
+            if extractor is None:
+                (
+                    variant_extractor,
+                    genome_index,
+                ) = variant_centered.get_variant_extractor(fasta_file)
+                extractor = {
+                    "variant_extractor": variant_extractor,
+                    "genome_index": genome_index,
+                    "lock": threading.Lock(),
+                    "users": 0,
+                }
+            self.extractors[fasta_file] = extractor
+            extractor["users"] += 1
+            while len(self.extractors) > MAX_OPEN_FASTA_FILES:
+                _, evicted_extractor = self.extractors.popitem(last=False)
+                if evicted_extractor["users"] == 0:
+                    close_extractor(evicted_extractor)
+        try:
+            yield extractor
+        finally:
+            with self.extractors_lock:
+                extractor["users"] -= 1
+                if (
+                    extractor["users"] == 0
+                    and self.extractors.get(fasta_file) is not extractor
+                ):
+                    close_extractor(extractor)
+
+    def iter_scores(
+        self,
+        variants: Iterable[Variant],
+        fasta_file: Optional[str] = None,
+        model_indices: Optional[tuple] = None,
+    ) -> Iterator[tuple]:
+        """Returns the variants of a job piece by piece along with the
+        scored effects of every requested model. The variants are read
+        lazily and at most MAX_QUEUED_PIECES pieces of the job are queued
+        at a time, so that the memory of a job does not grow with its
+        number of variants.
+
+        Raises:
+            Exception: Any error raised while scoring a piece of the job
+        """
+        if model_indices is None:
+            model_indices = self.get_model_indices(None)
+        batch_size = max(
+            self.models[index]["config"].get_variants_per_batch()
+            for index in model_indices
+        )
+        fasta_file = str(fasta_file or self.fasta_file)
+        queued = deque()
+        with self.use_extractor(fasta_file) as extractor:
+            for piece_variants in variant_centered.batcher(
+                iter(variants), batch_size
+            ):
+                with extractor["lock"]:
+                    refs, alts = variant_centered.extract_sequences(
+                        extractor["variant_extractor"],
+                        extractor["genome_index"],
+                        piece_variants,
+                        self.sequence_length,
+                    )
+                piece = {
+                    "done": threading.Event(),
+                    "error": None,
+                    "model_indices": model_indices,
+                    "fasta_file": fasta_file,
+                    "batch_size": batch_size,
+                    "variants": piece_variants,
+                    "refs": refs,
+                    "alts": alts,
+                    "scores": None,
+                }
+                with self.condition:
+                    self.pending.append(piece)
+                    self.condition.notify()
+                queued.append(piece)
+                if len(queued) >= MAX_QUEUED_PIECES:
+                    yield wait_for_piece(queued.popleft())
+        while queued:
+            yield wait_for_piece(queued.popleft())
+
+    def score(
+        self,
+        variants: Iterable[Variant],
+        fasta_file: Optional[str] = None,
+        model_indices: Optional[tuple] = None,
+    ) -> List[np.ndarray]:
+        """Returns the scored effects of every requested model for all
+        variants of a job, see iter_scores. It blocks until all pieces of
+        the job are scored."""
+        if model_indices is None:
+            model_indices = self.get_model_indices(None)
+        model_scores = [
+            [
+                np.zeros(
+                    (0, len(self.models[index]["column_labels"]) - 5),
+                    np.float32,
+                )
+            ]
+            for index in model_indices
+        ]
+        for _, piece_scores in self.iter_scores(
+            variants, fasta_file, model_indices
+        ):
+            for scores, model_piece_scores in zip(model_scores, piece_scores):
+                scores.append(model_piece_scores)
+        return [
+            np.concatenate(scores[1:] or scores, axis=0)
+            for scores in model_scores
+        ]
+
+    def take_batch(self) -> Optional[List[Dict[str, Any]]]:
+        """Waits for a pending piece and returns it along with the pending
+        pieces of other jobs that use the same models and the same fasta
+        file and fit in the same batch. None is returned once the daemon is
+        closed and no piece is pending."""
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            batch = [self.pending.popleft()]
+            size = len(batch[0]["variants"])
+            for piece in list(self.pending):
+                if (
+                    piece["model_indices"] == batch[0]["model_indices"]
+                    and piece["fasta_file"] == batch[0]["fasta_file"]
+                    and size + len(piece["variants"]) <= batch[0]["batch_size"]
+                ):
+                    self.pending.remove(piece)
+                    batch.append(piece)
+                    size += len(piece["variants"])
+            return batch
+
+    def run(self) -> None:
+        """Scores pending pieces batch by batch until the daemon is
+        closed. This is the target of the scoring thread."""
+        while True:
+            batch = self.take_batch()
+            if batch is None:
+                return
+            try:
+                batch_scores = variant_centered.score_batch(
+                    [
+                        self.models[index]
+                        for index in batch[0]["model_indices"]
+                    ],
+                    [ref for piece in batch for ref in piece["refs"]],
+                    [alt for piece in batch for alt in piece["alts"]],
+                    [
+                        variant
+                        for piece in batch
+                        for variant in piece["variants"]
+                    ],
+                )
+            except Exception as err:
+                for piece in batch:
+                    piece["error"] = err
+                    piece["done"].set()
+                continue
+            start = 0
+            for piece in batch:
+                end = start + len(piece["variants"])
+                piece["scores"] = [
+                    model_scores[start:end] for model_scores in batch_scores
+                ]
+                # The sequences are not needed anymore
+                piece["refs"] = piece["alts"] = None
+                start = end
+                piece["done"].set()
+
+
+def close_extractor(extractor: Dict[str, Any]) -> None:
+    """This function closes the fasta file or the genome index of a
+    variant sequence extractor"""
+    extractor["variant_extractor"].ref_seq_extractor.close()
+
+
+def wait_for_piece(piece: Dict[str, Any]) -> tuple:
+    """This function waits until a piece of a job is scored and returns
+    its variants and the scored effects of every model
+
+    Raises:
+        Exception: Any error raised while scoring the piece
+    """
+    piece["done"].wait()
+    if piece["error"] is not None:
+        raise piece["error"]
+    return piece["variants"], piece["scores"]
+
+
+def get_job_variants(request: Dict[str, Any]) -> Iterable[Variant]:
+    """This function returns the variants of a scoring job. They are
+    either read lazily from the vcf file of the job or given inline as
+    lists of the form [chrom, pos, id, ref, alt] like the first five
+    columns of the output, see variant_centered.get_variants.
+
+    Raises:
+        ValueError: If the job has neither a vcf file nor variants
+    """
+    if request.get("variants") is not None:
+        return variant_centered.get_variants(request["variants"])
+    if request.get("vcf_file") is not None:
+        return variant_centered.get_variants(request["vcf_file"])
+    raise ValueError("A job requires either a vcf_file or variants")
+
+
+def run_job(
+    scoring_daemon: ScoringDaemon, request: Dict[str, Any]
+) -> Dict[str, Any]:
+    """This function scores the variants of a job with a scoring daemon.
+    If the job has an output file, the scored effects are written to it
+    exactly like kipoi_veff2_predict does, in the output_format of the
+    job, tsv by default. Otherwise, they are returned as the text of a tsv
+    file. A float_format can be given like with --float-format.
+
+    Raises:
+        ValueError: If the job is invalid
+    """
+    float_format = request.get("float_format")
+    if float_format is not None:
+        options.validate_float_format(float_format)
+    model_indices = scoring_daemon.get_model_indices(request.get("models"))
+    pieces = scoring_daemon.iter_scores(
+        get_job_variants(request), request.get("fasta_file"), model_indices
+    )
+    column_labels = scoring_daemon.get_column_labels(model_indices)
+    if request.get("output_file") is not None:
+        with output.get_output(
+            request.get("output_format", "tsv"),
+            request["output_file"],
+            column_labels,
+            float_format=float_format,
+        ) as job_output:
+            for piece_variants, piece_scores in pieces:
+                variant_centered.write_rows(
+                    [job_output], piece_variants, piece_scores
+                )
+        return {"output_file": request["output_file"]}
+    tsv_blocks = [output.format_header(column_labels)]
+    for piece_variants, piece_scores in pieces:
+        tsv_blocks.append(
+            output.format_rows(
+                variant_centered.get_variant_columns(piece_variants),
+                piece_scores,
+                float_format,
+            )
+        )
+    return {"tsv": "".join(tsv_blocks)}
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """This class handles the requests of a connection to the daemon. Every
+    request and every response is a json object on a single line. A
+    request runs a scoring job unless its command is status, which returns
+    the loaded models, or shutdown, which stops the daemon. Errors are
+    returned with the status error."""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            shutdown = False
+            try:
+                request = json.loads(line)
+                command = request.get("command", "score")
+                if command == "score":
+                    response = run_job(self.server.scoring_daemon, request)
+                elif command == "status":
+                    response = {
+                        "models": list(
+                            self.server.scoring_daemon.model_indices
+                        )
+                    }
+                elif command == "shutdown":
+                    response = {}
+                    shutdown = True
+                else:
+                    raise ValueError(f"Unknown command {command}")
+                response["status"] = "ok"
+            except Exception as err:
+                response = {
+                    "status": "error",
+                    "error": f"{type(err).__name__}: {err}",
+                }
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+            if shutdown:
+                # shutdown waits for serve_forever to return, so it can
+                # not be called from a request handler thread directly
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """This class serves a scoring daemon on a unix socket. Every
+    connection is handled in its own thread and closing the server waits
+    for the jobs of all connections to be done."""
+
+    def __init__(
+        self, socket_file: Union[str, Path], scoring_daemon: ScoringDaemon
+    ) -> None:
+        self.scoring_daemon = scoring_daemon
+        super().__init__(str(socket_file), DaemonRequestHandler)
+
+
+def is_listening(socket_file: Union[str, Path]) -> bool:
+    """This function determines whether a daemon listens on a socket"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_file))
+        except OSError:
+            return False
+    return True
+
+
+def serve(
+    socket_file: Union[str, Path], scoring_daemon: ScoringDaemon
+) -> None:
+    """This function serves a scoring daemon on a unix socket until it
+    receives a shutdown request. A socket file left behind by a daemon
+    that is not running any more is replaced.
+
+    Raises:
+        ValueError: If another daemon listens on the socket
+    """
+    if os.path.exists(socket_file):
+        if is_listening(socket_file):
+            raise ValueError(f"A daemon is already listening on {socket_file}")
+        os.remove(socket_file)
+    scoring_daemon.start()
+    server = DaemonServer(socket_file, scoring_daemon)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_file)
+        scoring_daemon.close()
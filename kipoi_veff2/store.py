@@ -0,0 +1,454 @@
+from contextlib import contextmanager, ExitStack
+import fcntl
+from functools import partial
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+import click
+
+from kipoi_veff2 import merge
+
+MANIFEST_FILE = "store.json"
+VARIANTS_FILE = "variants.tsv"
+SCORES_DIR = "scores"
+LOCK_FILE = ".lock"
+STORE_VERSION = 1
+
+
+@contextmanager
+def lock_store(store_dir: Union[str, Path]) -> Iterator[None]:
+    """This function locks a store for the duration of a with block, so
+    that several jobs can append to it at the same time"""
+    Path(store_dir, SCORES_DIR).mkdir(parents=True, exist_ok=True)
+    with open(Path(store_dir, LOCK_FILE), "w") as lock_handle:
+        fcntl.flock(lock_handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+
+def read_manifest(store_dir: Union[str, Path]) -> Dict[str, Any]:
+    """This function returns the manifest of a store. It lists the score
+    files in the order of their columns, the outputs appended so far and
+    the number of compactions.
+
+    Raises:
+        ValueError: If the manifest was written by an unsupported version
+    """
+    manifest_file = Path(store_dir, MANIFEST_FILE)
+    if not manifest_file.exists():
+        return {
+            "version": STORE_VERSION,
+            "score_files": [],
+            "appended": [],
+            "compactions": 0,
+        }
+    with open(manifest_file, "r") as manifest_json:
+        manifest = json.load(manifest_json)
+    if manifest.get("version") != STORE_VERSION:
+        raise ValueError(f"{store_dir} is not a supported store")
+    return manifest
+
+
+def write_manifest(
+    store_dir: Union[str, Path], manifest: Dict[str, Any]
+) -> None:
+    """This function writes the manifest of a store atomically. Writing
+    the manifest commits an append or a compaction."""
+    temp_manifest_file = Path(store_dir, MANIFEST_FILE + ".tmp")
+    with open(temp_manifest_file, "w") as manifest_json:
+        json.dump(manifest, manifest_json, indent=1)
+    os.replace(temp_manifest_file, Path(store_dir, MANIFEST_FILE))
+
+
+def get_score_file_name(score_labels: List[str]) -> str:
+    """This function names the score file of an output after its first
+    score column and a digest of all its score columns, for instance
+    Basset_8988T_diff.<digest>.tsv, so that outputs whose first score
+    columns are the same get score files of their own"""
+    digest = hashlib.sha1("\t".join(score_labels).encode()).hexdigest()
+    return f"{score_labels[0].replace('/', '_')}.{digest[:12]}.tsv"
+
+
+def write_scores(
+    input_file: Union[str, Path],
+    variants_file: Union[str, Path],
+    scores_file: Union[str, Path],
+    block_size: int = merge.MERGE_BLOCK_SIZE,
+) -> None:
+    """This function writes the score columns of an output, including
+    their header, to scores_file. The output is read in step with the
+    variants of the store and compared to them block by block. If
+    variants_file does not exist yet, the variant columns of the output
+    are written to it instead.
+
+    Raises:
+        ValueError: If the output does not hold the variants of the store
+        in the same order or has no scores
+    """
+    create_variants = not Path(variants_file).exists()
+    with ExitStack() as stack:
+        input_handle = stack.enter_context(merge.open_tsv(input_file))
+        score_labels = merge.read_score_labels(input_handle)
+        if not score_labels:
+            raise ValueError(f"{input_file} has no scores")
+        scores_handle = stack.enter_context(open(scores_file, "w"))
+        scores_handle.write("\t".join(score_labels) + "\n")
+        if create_variants:
+            variants_handle = stack.enter_context(open(variants_file, "w"))
+            variants_handle.write(
+                "\t".join(merge.VARIANT_COLUMN_LABELS) + "\n"
+            )
+        else:
+            variants_handle = stack.enter_context(
+                merge.open_tsv(variants_file)
+            )
+            next(variants_handle)
+        while True:
+            block = merge.read_block(
+                input_handle, block_size, len(score_labels) + 5
+            )
+            if create_variants:
+                if block:
+                    variants_handle.write(
+                        "\n".join(map("\t".join, zip(*block[:5]))) + "\n"
+                    )
+            # At the end of the output, a single row is read to make sure
+            # that the variants of the store end as well
+            elif (
+                merge.read_block(
+                    variants_handle, len(block[0]) if block else 1, 5
+                )
+                != block[:5]
+            ):
+                raise ValueError(
+                    f"{input_file} does not hold the variants of the store \
+                        in the same order. Please merge it with \
+                        kipoi_veff2_merge instead."
+                )
+            if not block:
+                return
+            scores_handle.write("\n".join(block[5]) + "\n")
+
+
+def append_to_store(
+    store_dir: Union[str, Path],
+    input_file: Union[str, Path],
+    block_size: int = merge.MERGE_BLOCK_SIZE,
+) -> str:
+    """This function appends the scores of an output of kipoi_veff2_predict
+    to a store as additional columns. A store is a directory with
+    - variants.tsv which holds the variant columns of the outputs once,
+    - scores/ which holds one file of score columns per appended output,
+    - store.json, the manifest which lists the score files in the order of
+    their columns.
+    Neither the variants nor the scores in the store are read or
+    rewritten, except that the variants are compared with the variants of
+    the output while its scores are copied. The first output appended to
+    a store determines its variants and every further output must hold
+    the same variants in the same order, which is the case for outputs of
+    the same vcf file. Several jobs can append to a store at the same
+    time. The name of the new score file is returned.
+
+    Raises:
+        ValueError: If the output does not hold the variants of the store,
+        has no scores or was appended before
+    """
+    with merge.open_tsv(input_file) as input_handle:
+        score_labels = merge.read_score_labels(input_handle)
+    if not score_labels:
+        raise ValueError(f"{input_file} has no scores")
+    score_file_name = get_score_file_name(score_labels)
+    scores_dir = Path(store_dir, SCORES_DIR)
+    variants_file = Path(store_dir, VARIANTS_FILE)
+    temp_suffix = f".{os.getpid()}.tmp"
+    temp_scores_file = scores_dir / (score_file_name + temp_suffix)
+    temp_variants_file = Path(store_dir, VARIANTS_FILE + temp_suffix)
+    try:
+        if not variants_file.exists():
+            with lock_store(store_dir):
+                if not variants_file.exists():
+                    write_scores(
+                        input_file,
+                        temp_variants_file,
+                        temp_scores_file,
+                        block_size,
+                    )
+                    os.replace(temp_variants_file, variants_file)
+        # Scores are copied without holding the lock
+        if not temp_scores_file.exists():
+            write_scores(
+                input_file, variants_file, temp_scores_file, block_size
+            )
+        with lock_store(store_dir):
+            manifest = read_manifest(store_dir)
+            if score_file_name in manifest["appended"]:
+                raise ValueError(
+                    f"The scores of {input_file} were already appended to \
+                        {store_dir}"
+                )
+            os.replace(temp_scores_file, scores_dir / score_file_name)
+            manifest["score_files"].append(score_file_name)
+            manifest["appended"].append(score_file_name)
+            write_manifest(store_dir, manifest)
+    finally:
+        for temp_file in [temp_scores_file, temp_variants_file]:
+            if temp_file.exists():
+                os.remove(temp_file)
+    return score_file_name
+
+
+def paste_in_step(
+    input_files: List[Union[str, Path]],
+    merged_file: Union[str, Path],
+    block_size: int = merge.MERGE_BLOCK_SIZE,
+) -> bool:
+    """This function pastes the rows of files with the same number of rows
+    side by side, separated by a tab. The files are read in step,
+    block_size rows at a time. True is returned for the sake of
+    merge.merge_in_groups.
+
+    Raises:
+        ValueError: If the files have different numbers of rows
+    """
+    with ExitStack() as stack:
+        merged_handle = stack.enter_context(merge.open_merged_tsv(merged_file))
+        input_handles = [
+            stack.enter_context(merge.open_tsv(input_file))
+            for input_file in input_files
+        ]
+        while True:
+            blocks = [
+                "".join(itertools.islice(input_handle, block_size))
+                for input_handle in input_handles
+            ]
+            rows = [block.rstrip("\n").split("\n") for block in blocks]
+            if any(
+                len(block_rows) != len(rows[0])
+                or bool(block) != bool(blocks[0])
+                for block, block_rows in zip(blocks, rows)
+            ):
+                raise ValueError(
+                    f"The files {', '.join(map(str, input_files))} do not \
+                        have the same number of rows"
+                )
+            if not blocks[0]:
+                return True
+            merged_handle.write("\n".join(map("\t".join, zip(*rows))) + "\n")
+
+
+def paste_files(
+    input_files: List[str],
+    merged_file: Union[str, Path],
+    temp_dir: str,
+    block_size: int,
+    workers: int,
+    max_open_files: int,
+) -> None:
+    """This function pastes files side by side with at most max_open_files
+    files open at a time, see merge.merge_in_groups"""
+    with ExitStack() as stack:
+        pool = None
+        if workers > 1:
+            pool = stack.enter_context(multiprocessing.Pool(workers))
+        merge.merge_in_groups(
+            partial(paste_in_step, block_size=block_size),
+            input_files,
+            merged_file,
+            temp_dir,
+            pool,
+            workers,
+            max(max_open_files, 2),
+        )
+
+
+def compact_store(
+    store_dir: Union[str, Path],
+    block_size: int = merge.MERGE_BLOCK_SIZE,
+    workers: int = 1,
+    max_open_files: int = merge.MAX_OPEN_FILES,
+) -> None:
+    """This function compacts a store by pasting all of its score files
+    into a single score file, which keeps the order of the columns and
+    makes exporting the store faster. Outputs can still be appended to a
+    compacted store. Appends wait until the compaction is complete."""
+    with lock_store(store_dir):
+        manifest = read_manifest(store_dir)
+        if len(manifest["score_files"]) <= 1:
+            return
+        scores_dir = Path(store_dir, SCORES_DIR)
+        compacted_file_name = f"compacted.{manifest['compactions']}.tsv"
+        with TemporaryDirectory(dir=store_dir) as temp_dir:
+            temp_compacted_file = Path(temp_dir, compacted_file_name)
+            paste_files(
+                [
+                    str(scores_dir / score_file_name)
+                    for score_file_name in manifest["score_files"]
+                ],
+                temp_compacted_file,
+                temp_dir,
+                block_size,
+                workers,
+                max_open_files,
+            )
+            os.replace(temp_compacted_file, scores_dir / compacted_file_name)
+        old_score_files = manifest["score_files"]
+        manifest["score_files"] = [compacted_file_name]
+        manifest["compactions"] += 1
+        write_manifest(store_dir, manifest)
+        for score_file_name in old_score_files:
+            os.remove(scores_dir / score_file_name)
+
+
+def export_store(
+    store_dir: Union[str, Path],
+    merged_file: Union[str, Path],
+    block_size: int = merge.MERGE_BLOCK_SIZE,
+    workers: int = 1,
+    max_open_files: int = merge.MAX_OPEN_FILES,
+) -> None:
+    """This function writes the variants and all score columns of a store
+    to a single tsv file like the one written by kipoi_veff2_merge. The
+    merged file is compressed if its name ends with .gz or .bgz.
+
+    Raises:
+        ValueError: If the store is empty
+    """
+    with lock_store(store_dir):
+        manifest = read_manifest(store_dir)
+        if not manifest["score_files"]:
+            raise ValueError(f"The store {store_dir} is empty")
+        with TemporaryDirectory(
+            dir=Path(merged_file).resolve().parent
+        ) as temp_dir:
+            paste_files(
+                [str(Path(store_dir, VARIANTS_FILE))]
+                + [
+                    str(Path(store_dir, SCORES_DIR, score_file_name))
+                    for score_file_name in manifest["score_files"]
+                ],
+                merged_file,
+                temp_dir,
+                block_size,
+                workers,
+                max_open_files,
+            )
+
+
+@click.group()
+def store() -> None:
+    """Append the outputs of kipoi_veff2_predict to a merged result store
+    as soon as they are written, and compact or export the store"""
+
+
+@store.command()
+@click.argument("store_dir", nargs=1, type=click.Path(), required=True)
+@click.argument(
+    "input_tsvs",
+    nargs=-1,
+    type=click.Path(exists=True, readable=True),
+    required=True,
+)
+@click.option(
+    "--block-size",
+    "block_size",
+    default=merge.MERGE_BLOCK_SIZE,
+    type=click.IntRange(min=1),
+    help="Read this many rows of every file at a time.",
+)
+def append(
+    store_dir: str, input_tsvs: Tuple[str, ...], block_size: int
+) -> None:
+    """Append the scores of tsvs to a store as additional columns"""
+    for input_tsv in input_tsvs:
+        try:
+            append_to_store(store_dir, input_tsv, block_size)
+        except ValueError as err:
+            raise click.ClickException(str(err))
+
+
+@store.command()
+@click.argument(
+    "store_dir", nargs=1, type=click.Path(exists=True), required=True
+)
+@click.option(
+    "--block-size",
+    "block_size",
+    default=merge.MERGE_BLOCK_SIZE,
+    type=click.IntRange(min=1),
+    help="Read this many rows of every file at a time.",
+)
+@click.option(
+    "--workers",
+    "workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Paste groups of score files in this many processes.",
+)
+@click.option(
+    "--max-open-files",
+    "max_open_files",
+    default=merge.MAX_OPEN_FILES,
+    type=click.IntRange(min=2),
+    help="Paste at most this many files at a time. More files are pasted\
+        in groups through temporary files.",
+)
+def compact(
+    store_dir: str, block_size: int, workers: int, max_open_files: int
+) -> None:
+    """Paste all score files of a store into a single score file"""
+    compact_store(store_dir, block_size, workers, max_open_files)
+
+
+@store.command()
+@click.argument(
+    "store_dir", nargs=1, type=click.Path(exists=True), required=True
+)
+@click.argument("merged_tsv", nargs=1, type=click.Path(), required=True)
+@click.option(
+    "--block-size",
+    "block_size",
+    default=merge.MERGE_BLOCK_SIZE,
+    type=click.IntRange(min=1),
+    help="Read this many rows of every file at a time.",
+)
+@click.option(
+    "--workers",
+    "workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Paste groups of score files in this many processes.",
+)
+@click.option(
+    "--max-open-files",
+    "max_open_files",
+    default=merge.MAX_OPEN_FILES,
+    type=click.IntRange(min=2),
+    help="Paste at most this many files at a time. More files are pasted\
+        in groups through temporary files.",
+)
+def export(
+    store_dir: str,
+    merged_tsv: str,
+    block_size: int,
+    workers: int,
+    max_open_files: int,
+) -> None:
+    """Write the variants and all scores of a store to a single tsv"""
+    try:
+        export_store(
+            store_dir, merged_tsv, block_size, workers, max_open_files
+        )
+    except ValueError as err:
+        raise click.ClickException(str(err))
+
+
+if __name__ == "__main__":
+    store()
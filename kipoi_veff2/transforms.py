@@ -0,0 +1,111 @@
+from typing import Any, List
+
+import numpy as np
+from kipoiseq.utils import parse_alphabet, parse_dtype
+
+
+class BatchOneHot:
+    """This class one hot encodes a whole batch of sequences of equal
+    length in a single vectorized operation. It produces the same
+    tensor layout as stacking the output of kipoiseq's ReorderedOneHot
+    for every sequence. Every base is looked up in a table indexed by
+    its byte value. Like with ReorderedOneHot, bases of the neutral
+    alphabet are encoded with neutral_value and any other character,
+    including lower case bases of soft masked genomes, is encoded as
+    zeros."""
+
+    def __init__(
+        self,
+        alphabet: Any = "ACGT",
+        neutral_alphabet: str = "N",
+        neutral_value: float = 0.25,
+        dtype: Any = None,
+        alphabet_axis: int = 1,
+        dummy_axis: int = None,
+    ) -> None:
+        if dummy_axis is not None:
+            if alphabet_axis == dummy_axis:
+                raise ValueError("dummy_axis can't be the same as dummy_axis")
+            if not (dummy_axis >= 0 and dummy_axis <= 2):
+                raise ValueError("dummy_axis can be either 0,1 or 2")
+        self.alphabet = parse_alphabet(alphabet)
+        self.dtype = parse_dtype(dtype)
+        self.alphabet_axis = alphabet_axis
+        self.dummy_axis = dummy_axis
+        self.lookup_table = np.zeros(
+            (256, len(self.alphabet)), dtype=self.dtype
+        )
+        for index, base in enumerate(self.alphabet):
+            self.lookup_table[ord(base), index] = 1
+        for base in neutral_alphabet:
+            self.lookup_table[ord(base)] = neutral_value
+        if dummy_axis is not None and dummy_axis < 2:
+            # dummy axis is added before the alphabet axis which
+            # is at the end now
+            self.existing_alphabet_axis = 2
+        else:
+            self.existing_alphabet_axis = 1
+
+    def __call__(self, sequences: List[str]) -> np.ndarray:
+        """Returns an array of shape (number of sequences, ...) where
+        the trailing dimensions are the ones of ReorderedOneHot
+
+        Raises:
+            ValueError: If the sequences are not of equal length
+        """
+        sequence_length = len(sequences[0]) if sequences else 0
+        if any(len(sequence) != sequence_length for sequence in sequences):
+            raise ValueError(
+                "All sequences in a batch must be of equal length"
+            )
+        codes = np.frombuffer(
+            "".join(sequences).encode("ascii"), dtype=np.uint8
+        ).reshape(len(sequences), sequence_length)
+        batch = self.lookup_table[codes]
+        if self.dummy_axis is not None:
+            batch = np.expand_dims(batch, self.dummy_axis + 1)
+        if self.existing_alphabet_axis != self.alphabet_axis:
+            batch = np.swapaxes(
+                batch, self.existing_alphabet_axis + 1, self.alphabet_axis + 1
+            )
+        return np.ascontiguousarray(batch)
+
+    def get_sequence_view(self, batch: np.ndarray) -> np.ndarray:
+        """Returns a view of an encoded batch with the layout
+        (number of sequences, sequence length, alphabet size)"""
+        if self.existing_alphabet_axis != self.alphabet_axis:
+            batch = np.swapaxes(
+                batch, self.existing_alphabet_axis + 1, self.alphabet_axis + 1
+            )
+        if self.dummy_axis is not None:
+            batch = np.squeeze(batch, axis=self.dummy_axis + 1)
+        return batch
+
+    def set_bases(
+        self,
+        batch: np.ndarray,
+        rows: List[int],
+        position: int,
+        bases: List[str],
+    ) -> None:
+        """Rewrites the base at position of the encoded sequences in rows
+        of batch in place. This is how an alternative sequence of a single
+        nucleotide variant is derived from an encoded reference sequence"""
+        codes = np.frombuffer("".join(bases).encode("ascii"), dtype=np.uint8)
+        self.get_sequence_view(batch)[rows, position] = self.lookup_table[
+            codes
+        ]
+
+
+class StackedTransform:
+    """This class applies a transform that works on a single sequence to
+    every sequence of a batch and stacks the results. It is used for
+    transforms that are provided directly through ModelConfig"""
+
+    def __init__(self, transform: Any) -> None:
+        self.transform = transform
+
+    def __call__(self, sequences: List[str]) -> np.ndarray:
+        return np.stack(
+            [self.transform(sequence) for sequence in sequences], axis=0
+        )
@@ -0,0 +1,202 @@
+import json
+import os
+from pathlib import Path
+import platform
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+import warnings
+
+import numpy as np
+
+TUNING_PROFILE_VERSION = 1
+TUNING_DIR_VARIABLE = "KIPOI_VEFF2_TUNING_DIR"
+DEFAULT_TUNING_DIR = Path("~", ".kipoi_veff2", "tuning")
+# Batch sizes probed in increasing order
+BATCH_SIZES = [2**exponent for exponent in range(4, 15)]
+# Minimum time in seconds spent inferring with every batch size
+MIN_PROBE_TIME = 0.5
+# Fraction of the physical memory used as memory limit by default
+DEFAULT_MEMORY_FRACTION = 0.5
+# A larger batch size is only chosen if it is at least this much faster
+MIN_SPEEDUP = 1.05
+
+
+def get_tuning_dir() -> Path:
+    """This function returns the directory of the tuning profiles of the
+    current machine. The base directory can be set with the
+    KIPOI_VEFF2_TUNING_DIR environment variable."""
+    tuning_dir = os.environ.get(TUNING_DIR_VARIABLE) or DEFAULT_TUNING_DIR
+    return Path(tuning_dir).expanduser() / platform.node()
+
+
+def get_tuning_profile_file(model: str) -> Path:
+    """This function returns the path of the tuning profile of a model"""
+    return get_tuning_dir() / f"{model.replace('/', '_')}.json"
+
+
+def get_peak_memory() -> int:
+    """This function returns the peak resident memory of the current
+    process in bytes"""
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak_memory if sys.platform == "darwin" else peak_memory * 1024
+
+
+def get_default_memory_limit() -> int:
+    """This function returns DEFAULT_MEMORY_FRACTION of the physical
+    memory of the machine in bytes"""
+    return int(
+        os.sysconf("SC_PAGE_SIZE")
+        * os.sysconf("SC_PHYS_PAGES")
+        * DEFAULT_MEMORY_FRACTION
+    )
+
+
+def get_random_sequences(
+    number_of_sequences: int, sequence_length: int
+) -> List[str]:
+    """This function returns random DNA sequences to probe a model with"""
+    rng = np.random.default_rng(0)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)[
+        rng.integers(4, size=number_of_sequences * sequence_length)
+    ]
+    sequences = bases.tobytes().decode("ascii")
+    return [
+        sequences[start : start + sequence_length]
+        for start in range(0, len(sequences), sequence_length)
+    ]
+
+
+def probe_batch_size(
+    kipoi_model: Any, batch: np.ndarray, min_probe_time: float
+) -> Dict[str, float]:
+    """This function infers with a batch repeatedly for at least
+    min_probe_time seconds and returns the throughput in sequences per
+    second along with the peak memory of the process afterwards"""
+    number_of_calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while number_of_calls == 0 or elapsed < min_probe_time:
+        kipoi_model.predict_on_batch(batch)
+        number_of_calls += 1
+        elapsed = time.perf_counter() - start
+    return {
+        "batch_size": len(batch),
+        "sequences_per_second": number_of_calls * len(batch) / elapsed,
+        "peak_memory": get_peak_memory(),
+    }
+
+
+def tune_batch_size(
+    kipoi_model: Any,
+    transform: Any,
+    sequence_length: int,
+    memory_limit: Optional[int] = None,
+    batch_sizes: List[int] = BATCH_SIZES,
+    min_probe_time: float = MIN_PROBE_TIME,
+) -> Dict[str, Any]:
+    """This function probes the throughput and the peak memory of a model
+    for increasing batch sizes on the current machine and returns a tuning
+    profile holding the chosen batch size along with the measurements.
+    Probing stops once the throughput stops improving, the model fails to
+    infer or the peak memory would exceed memory_limit bytes, which is
+    DEFAULT_MEMORY_FRACTION of the physical memory by default. The memory
+    of the next batch size is extrapolated from the last two batch sizes.
+    The smallest batch size within MIN_SPEEDUP of the best throughput
+    under the memory limit is chosen. Peak memory is the resident memory
+    of the process, memory of accelerators is not taken into account."""
+    if memory_limit is None:
+        memory_limit = get_default_memory_limit()
+    sequences = get_random_sequences(max(batch_sizes), sequence_length)
+    # The first inference is often slower and is left out
+    kipoi_model.predict_on_batch(transform(sequences[: batch_sizes[0]]))
+    measurements = []
+    for batch_size in batch_sizes:
+        if len(measurements) >= 2:
+            previous, last = measurements[-2:]
+            memory_per_sequence = max(
+                last["peak_memory"] - previous["peak_memory"], 0
+            ) / (last["batch_size"] - previous["batch_size"])
+            if (
+                last["peak_memory"]
+                + memory_per_sequence * (batch_size - last["batch_size"])
+                > memory_limit
+            ):
+                break
+        try:
+            measurement = probe_batch_size(
+                kipoi_model, transform(sequences[:batch_size]), min_probe_time
+            )
+        except MemoryError:
+            break
+        if measurement["peak_memory"] > memory_limit:
+            break
+        measurements.append(measurement)
+        best_throughput = max(
+            measurement["sequences_per_second"] for measurement in measurements
+        )
+        if len(measurements) >= 3 and all(
+            measurement["sequences_per_second"] * MIN_SPEEDUP < best_throughput
+            for measurement in measurements[-2:]
+        ):
+            break
+    if not measurements:
+        warnings.warn(
+            f"Every probed batch size exceeds the memory limit of \
+                {memory_limit} bytes. Using a batch size of \
+                {batch_sizes[0]}"
+        )
+        chosen_batch_size = batch_sizes[0]
+    else:
+        best_throughput = max(
+            measurement["sequences_per_second"] for measurement in measurements
+        )
+        chosen_batch_size = min(
+            measurement["batch_size"]
+            for measurement in measurements
+            if measurement["sequences_per_second"] * MIN_SPEEDUP
+            >= best_throughput
+        )
+    return {
+        "version": TUNING_PROFILE_VERSION,
+        "sequence_length": sequence_length,
+        "memory_limit": memory_limit,
+        "batch_size": chosen_batch_size,
+        "measurements": measurements,
+    }
+
+
+def save_tuning_profile(model: str, profile: Dict[str, Any]) -> None:
+    """This function writes the tuning profile of a model atomically. Every
+    process writes to its own temporary file which replaces the profile."""
+    profile_file = get_tuning_profile_file(model)
+    profile_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_profile_file = profile_file.with_name(
+        f"{profile_file.name}.{os.getpid()}.tmp"
+    )
+    with open(temp_profile_file, "w") as profile_json:
+        json.dump(dict(profile, model=model), profile_json, indent=1)
+    os.replace(temp_profile_file, profile_file)
+
+
+def load_tuned_batch_size(model: str, sequence_length: int) -> Optional[int]:
+    """This function returns the batch size of the tuning profile of a
+    model on the current machine if there is one for the sequence
+    length. A profile that can not be read is ignored, so that the model
+    is tuned again."""
+    profile_file = get_tuning_profile_file(model)
+    try:
+        with open(profile_file, "r") as profile_json:
+            profile = json.load(profile_json)
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(profile, dict)
+        or profile.get("version") != TUNING_PROFILE_VERSION
+        or profile.get("sequence_length") != sequence_length
+        or not isinstance(profile.get("batch_size"), int)
+    ):
+        return None
+    return profile["batch_size"]
@@ -1,26 +1,49 @@
-import csv
+from contextlib import ExitStack
 from dataclasses import dataclass, field
+from functools import partial
 import itertools
+import multiprocessing
 from pathlib import Path
-from typing import Any, Dict, List, Iterator, Callable, Union
+import sys
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+import warnings
 
-from cyvcf2 import VCF
 import numpy as np
-import kipoi
+import pandas as pd
 from kipoiseq.dataclasses import Interval, Variant
 from kipoiseq.extractors import VariantSeqExtractor
 from kipoiseq.transforms import ReorderedOneHot
 
+from kipoi_veff2 import model_cache
+from kipoi_veff2 import profiling
 from kipoi_veff2 import scores
+from kipoi_veff2 import tuning
+from kipoi_veff2.checkpoint import (
+    Checkpoint,
+    get_checkpoint_file,
+    load_checkpoint,
+    skip_done,
+)
+from kipoi_veff2.genome import GenomeIndex
+from kipoi_veff2.options import VARIANT_CENTERED_MODEL_GROUPS
+from kipoi_veff2.output import get_output
+from kipoi_veff2.pipeline import BackgroundWriter, imap_ordered, prefetch
+from kipoi_veff2.regions import read_records
+from kipoi_veff2.result_cache import ResultCache, get_keys, get_model_key
+from kipoi_veff2.transforms import BatchOneHot, StackedTransform
 
-MODEL_GROUPS = {
-    "Basset",
-    "DeepBind",
-    "DeepSEA",
-    "MPRA-DragoNN",
-    "pwm_HOCOMOCO",
-    "Basenji",
-}
+MODEL_GROUPS = VARIANT_CENTERED_MODEL_GROUPS
 
 ScoringFunction = Callable[[Any, Any], List]
 
@@ -37,7 +60,10 @@ class ModelConfig:
     a default value of 1000. This denotes number of sample that the
     model is capable of ingesting and make predictions with. Like others,
     it is also possible to override batch size through model specific
-    configurations in VARIANT_CENTERED_MODEL_GROUP_CONFIGS. Finally,
+    configurations in VARIANT_CENTERED_MODEL_GROUP_CONFIGS. A model with
+    a batch size of 1 (Basenji) infers with pairs of reference and
+    alternative sequence instead and its effects are scored pair by pair.
+    Such a model infers with up to pairs_per_batch pairs at once. Finally,
     scoring funcitons must be provided for scoring the varint effect.
     By default it is scores.diff. It is also possible to over ride this in
      VARIANT_CENTERED_MODEL_GROUP_CONFIGS or a list of scoring functions
@@ -48,6 +74,7 @@ class ModelConfig:
     required_sequence_length: int = None
     transform: Any = None
     batch_size: int = 1000
+    pairs_per_batch: int = 1
     default_scoring_function: Dict = field(
         default_factory=lambda: {"name": "diff", "func": scores.diff}
     )
@@ -55,9 +82,17 @@ class ModelConfig:
     # data type at initialization
 
     def __post_init__(self) -> None:
-        """This function sets the model description directly"""
-        self.model_description = kipoi.get_model_descr(self.model)
+        """This function sets the model description directly. It is
+        read from the description cache, see
+        model_cache.get_model_description"""
+        self.model_description = model_cache.get_model_description(self.model)
         self.dataloader = self.model_description.default_dataloader
+        # A transform provided directly is applied sequence by sequence
+        self.batch_transform = (
+            None
+            if self.transform is None
+            else StackedTransform(self.transform)
+        )
 
     def is_sequence_model(self) -> bool:
         """This function determines whether the default dataloader is
@@ -93,6 +128,37 @@ class ModelConfig:
         else:
             return self.transform
 
+    def get_batch_transform(self) -> Any:
+        """This function returns a transformation that converts a whole
+        batch of sequences into numerical representation at once. Unless
+        a transform is provided directly, it is a vectorized one hot
+        encoding with the same tensor layout as get_transform
+
+        Raises:
+            IOError: If the model's default dataloader is not
+            kipoiseq.dataloaders.SeqIntervalDl
+        """
+        if self.batch_transform is None:
+            # This validates the model the same way as get_transform
+            self.get_transform()
+            dataloader_args = self.dataloader.default_args
+            self.batch_transform = BatchOneHot(
+                alphabet="ACGT",
+                dtype=dataloader_args.get("dtype", None),
+                alphabet_axis=dataloader_args.get("alphabet_axis", 1),
+                dummy_axis=dataloader_args.get("dummy_axis", None),
+            )
+        return self.batch_transform
+
+    def get_variants_per_batch(self) -> int:
+        """This function returns the number of variants the model infers
+        with at once. It is the batch size or, for a model that infers with
+        pairs of reference and alternative sequence, the number of pairs
+        per batch"""
+        if self.batch_size == 1:
+            return self.pairs_per_batch
+        return self.batch_size
+
     def get_required_sequence_length(self) -> Any:
         """
         This function returns the sequence length
@@ -121,9 +187,8 @@ class ModelConfig:
         Raises:
             IOError: If the model description is invalid
         """
-        targets = self.model_description.schema.targets
-        column_labels = targets.column_labels
-        target_shape = targets.shape[-1]
+        column_labels = self.model_description.column_labels
+        target_shape = self.model_description.target_shape[-1]
         variant_column_labels = ["#CHROM", "POS", "ID", "REF", "ALT"]
         if column_labels:
             if len(column_labels) == target_shape:
@@ -158,6 +223,7 @@ VARIANT_CENTERED_MODEL_GROUP_CONFIGS = {
     "pwm_HOCOMOCO": {"required_sequence_length": 100},
     "Basenji": {
         "batch_size": 1,
+        "pairs_per_batch": 4,
         "default_scoring_function": {
             "name": "basenji_effect",
             "func": lambda ref_pred, alt_pred: (alt_pred - ref_pred).mean(
@@ -178,6 +244,167 @@ def batcher(iterable, batch_size) -> List:
         yield batch
 
 
+def is_snv(variant: Variant) -> bool:
+    """This function determines whether a variant is a single
+    nucleotide variant"""
+    return len(variant.ref) == 1 and len(variant.alt) == 1
+
+
+def get_snv_position(sequence_length: int) -> int:
+    """This function returns the position of a single nucleotide
+    variant within a variant centered sequence of length
+    sequence_length"""
+    return (sequence_length + 1) // 2 - 1
+
+
+def get_variant_extractor(fasta_file: str) -> tuple:
+    """This function returns a variant sequence extractor for the fasta
+    file along with the genome index of the fasta file if there is an up
+    to date one. Otherwise, the genome index is None."""
+    if GenomeIndex.is_available(fasta_file):
+        # Reference sequences are sliced directly from the memory mapped
+        # genome index built by kipoi_veff2_index
+        genome_index = GenomeIndex(fasta_file)
+        return (
+            VariantSeqExtractor(reference_sequence=genome_index),
+            genome_index,
+        )
+    return VariantSeqExtractor(fasta_file=fasta_file), None
+
+
+def read_variants(
+    vcf_file: str, regions: Optional[List[Interval]] = None
+) -> Iterator[Variant]:
+    """This function iterates over the variants of the input vcf file.
+    If regions are provided, only the variants within the regions are
+    read through the index of the vcf file."""
+    for cv in read_records(vcf_file, regions):
+        yield Variant.from_cyvcf(cv)
+
+
+def get_variants(
+    variants: Union[str, Path, pd.DataFrame, Iterable],
+    regions: Optional[List[Interval]] = None,
+) -> Iterator[Variant]:
+    """This function iterates over variants given either as the path of
+    a vcf file, a data frame or an iterable. The columns of a data frame
+    are matched to CHROM, POS, ID, REF and ALT regardless of case and a
+    leading #. The ID column is optional. The items of an iterable are
+    either kipoiseq variants or sequences of the fields chrom, pos, id,
+    ref and alt like the first five columns of the output. Positions are
+    1-based. Regions are only supported for vcf files.
+
+    Raises:
+        ValueError: If a data frame lacks a required column or regions
+        are provided for variants which are not read from a vcf file
+    """
+    if isinstance(variants, (str, Path)):
+        yield from read_variants(str(variants), regions)
+        return
+    if regions is not None:
+        raise ValueError("Regions are only supported for vcf files")
+    if isinstance(variants, pd.DataFrame):
+        columns = {
+            str(column).lstrip("#").upper(): column
+            for column in variants.columns
+        }
+        missing_columns = [
+            column
+            for column in ["CHROM", "POS", "REF", "ALT"]
+            if column not in columns
+        ]
+        if missing_columns:
+            raise ValueError(
+                f"Variants lack the column(s) {', '.join(missing_columns)}"
+            )
+        variant_ids = (
+            variants[columns["ID"]]
+            if "ID" in columns
+            else itertools.repeat(None)
+        )
+        for chrom, pos, variant_id, ref, alt in zip(
+            variants[columns["CHROM"]],
+            variants[columns["POS"]],
+            variant_ids,
+            variants[columns["REF"]],
+            variants[columns["ALT"]],
+        ):
+            yield Variant(str(chrom), int(pos), ref, alt, id=variant_id)
+        return
+    for variant in variants:
+        if isinstance(variant, Variant):
+            yield variant
+        else:
+            chrom, pos, variant_id, ref, alt = variant
+            yield Variant(str(chrom), int(pos), ref, alt, id=variant_id)
+
+
+def get_locality_order(variants: List[Variant]) -> List[int]:
+    """This function returns the indices of variants sorted by
+    contig and position. The sort is stable, so variants at the same
+    position keep their relative order."""
+    return sorted(
+        range(len(variants)),
+        key=lambda index: (variants[index].chrom, variants[index].pos),
+    )
+
+
+@profiling.profiled("extraction")
+def extract_sequences(
+    variant_extractor: VariantSeqExtractor,
+    genome_index: Optional[GenomeIndex],
+    variants: List[Variant],
+    sequence_length: int,
+) -> tuple:
+    """For each variant a reference sequence is extracted centered on
+    the said variant. An alternative sequence is also extracted where the
+    central base is mutated according the alternative allele of the
+    variant. A tuple containing the list of reference sequences and the
+    list of alternative sequences is returned."""
+    intervals = [
+        Interval(variant.chrom, variant.pos - 1, variant.pos).resize(
+            sequence_length
+        )
+        for variant in variants
+    ]
+    # Split multiallelic sites share the same reference sequence
+    # which is extracted only once per batch
+    unique_refs = {}
+    for interval in intervals:
+        unique_refs.setdefault((interval.chrom, interval.start), interval)
+    if genome_index is not None:
+        unique_ref_sequences = genome_index.fetch_windows(
+            [chrom for chrom, _ in unique_refs],
+            [start for _, start in unique_refs],
+            sequence_length,
+        )
+    else:
+        unique_ref_sequences = [
+            variant_extractor.extract(
+                interval, variants=[], anchor=sequence_length
+            )
+            for interval in unique_refs.values()
+        ]
+    unique_refs = dict(zip(unique_refs, unique_ref_sequences))
+    refs = [
+        unique_refs[(interval.chrom, interval.start)] for interval in intervals
+    ]
+    # The alternative sequence of a single nucleotide variant differs
+    # from the reference sequence only at the central base
+    snv_position = get_snv_position(sequence_length)
+    alts = [
+        refs[index][:snv_position]
+        + variant.alt
+        + refs[index][snv_position + 1 :]
+        if is_snv(variant)
+        else variant_extractor.extract(
+            interval, variants=[variant], anchor=interval.center()
+        )
+        for index, (variant, interval) in enumerate(zip(variants, intervals))
+    ]
+    return refs, alts
+
+
 def batch_dataloader(
     vcf_file: str, fasta_file: str, sequence_length: str, batch_size: int
 ) -> Iterator[tuple]:
@@ -188,28 +415,954 @@ def batch_dataloader(
     allele of the variant. Finally a tuple containing the list of reference
     sequences, list of alternative sequences and list of variants - all
     of length batch_size are returned."""
-    variant_extractor = VariantSeqExtractor(fasta_file=fasta_file)
-    for cvs in batcher(VCF(vcf_file), batch_size):
-        variants = [Variant.from_cyvcf(cv) for cv in cvs]
-        intervals = [
-            Interval(variant.chrom, variant.pos - 1, variant.pos).resize(
-                sequence_length
+    variant_extractor, genome_index = get_variant_extractor(fasta_file)
+    for variants in batcher(read_variants(vcf_file), batch_size):
+        refs, alts = extract_sequences(
+            variant_extractor, genome_index, variants, sequence_length
+        )
+        yield (refs, alts, variants)
+
+
+def crop_sequences(sequences: List[str], sequence_length: int) -> List[str]:
+    """This function crops sequences that were extracted with a wider
+    window than sequence_length. All windows share the same anchor, the
+    position right after the variant, so cropping a wider reference or
+    alternative sequence gives the exact same sequence as extracting it
+    directly with sequence_length."""
+    cropped_sequences = []
+    for sequence in sequences:
+        width = len(sequence)
+        if width == sequence_length:
+            cropped_sequences.append(sequence)
+            continue
+        offset = (width + 1) // 2 - (sequence_length + 1) // 2
+        cropped_sequences.append(sequence[offset : offset + sequence_length])
+    return cropped_sequences
+
+
+def get_unique_indices(keys: List) -> tuple:
+    """This function returns the indices of the first occurrence of every
+    unique key along with an array mapping every key to the position of
+    its unique key, such that keys[unique_indices[inverse[i]]] == keys[i]"""
+    positions = {}
+    unique_indices = []
+    inverse = []
+    for index, key in enumerate(keys):
+        if key not in positions:
+            positions[key] = len(unique_indices)
+            unique_indices.append(index)
+        inverse.append(positions[key])
+    return unique_indices, np.array(inverse, dtype=int)
+
+
+@profiling.profiled("encoding")
+def encode_ref_alt_batch(
+    transform: Any,
+    refs: List[str],
+    ref_inverse: np.ndarray,
+    alts: List[str],
+    snv_bases: List[Optional[str]],
+) -> tuple:
+    """This function converts reference and alternative sequences into
+    numerical representation. refs contains unique reference sequences
+    and ref_inverse maps every alternative sequence to its reference
+    sequence. For single nucleotide variants, whose alternative base is
+    given in snv_bases, the encoded reference sequence is copied and only
+    the central base is rewritten. Alternative sequences of other variants
+    are encoded from scratch."""
+    ref_batch = transform(refs)
+    if not isinstance(transform, BatchOneHot):
+        return ref_batch, transform(alts)
+    alt_batch = ref_batch[ref_inverse]
+    snv_rows = [index for index, base in enumerate(snv_bases) if base]
+    other_rows = [index for index, base in enumerate(snv_bases) if not base]
+    if snv_rows:
+        transform.set_bases(
+            alt_batch,
+            snv_rows,
+            get_snv_position(len(refs[0])),
+            [snv_bases[index] for index in snv_rows],
+        )
+    if other_rows:
+        alt_batch[other_rows] = transform(
+            [alts[index] for index in other_rows]
+        )
+    return ref_batch, alt_batch
+
+
+@profiling.profiled("scoring")
+def get_scores(
+    ref_predictions: Any,
+    alt_predictions: Any,
+    scoring_functions: List[Dict[str, ScoringFunction]],
+) -> np.ndarray:
+    """This function scores the reference and alternative predictions
+    with every scoring function and concatenates the scores column wise
+    in the order of scoring_functions. Built-in scoring functions are
+    evaluated together, see scores.compute_scores."""
+    return scores.compute_scores(
+        ref_predictions, alt_predictions, scoring_functions
+    )
+
+
+def call(func: Callable, *args: Any) -> None:
+    """This function calls func with args. It is the synchronous
+    counterpart of BackgroundWriter.submit"""
+    func(*args)
+
+
+def get_variant_columns(variants: List[Variant]) -> List[List]:
+    """This function returns the first five output columns of a list of
+    variants namely #CHROM, POS, ID, REF, ALT"""
+    return [
+        [variant.chrom for variant in variants],
+        [variant.pos for variant in variants],
+        [variant.id for variant in variants],
+        [variant.ref for variant in variants],
+        [variant.alt for variant in variants],
+    ]
+
+
+def predict_on_pairs(
+    kipoi_model: Any, ref_batch: np.ndarray, alt_batch: np.ndarray
+) -> tuple:
+    """This function infers with pairs of reference and alternative
+    sequence in a single batch made of the reference sequences followed by
+    the alternative sequences. The reference and alternative predictions
+    are returned separately.
+
+    Raises:
+        ValueError: If the model does not return a prediction per sequence
+    """
+    number_of_pairs = len(ref_batch)
+    with profiling.stage("prediction"):
+        predictions = kipoi_model.predict_on_batch(
+            np.concatenate((ref_batch, alt_batch), axis=0)
+        )
+    if len(predictions) != 2 * number_of_pairs:
+        raise ValueError(
+            f"Expected {2 * number_of_pairs} predictions, "
+            f"got {len(predictions)}"
+        )
+    return predictions[:number_of_pairs], predictions[number_of_pairs:]
+
+
+def get_batching_errors() -> Tuple[type, ...]:
+    """This function returns the exceptions a model may raise when it
+    infers with several pairs of sequences at once: running out of memory
+    (MemoryError or tensorflow's ResourceExhaustedError) or failing to
+    reshape a batch of several pairs (ValueError). tensorflow is only
+    considered if the model has already imported it."""
+    errors = (MemoryError, ValueError)
+    tensorflow = sys.modules.get("tensorflow")
+    if tensorflow is None:
+        return errors
+    return errors + (tensorflow.errors.ResourceExhaustedError,)
+
+
+def get_pair_scores(
+    model: Dict[str, Any],
+    refs: List[str],
+    alts: List[str],
+    ref_inverse: np.ndarray,
+    snv_bases: List[Optional[str]],
+) -> np.ndarray:
+    """This function returns the scored effects of a model that infers with
+    pairs of reference and alternative sequence (Basenji). Up to the
+    model's pairs per batch are inferred with at once and every pair is
+    scored separately. If the model fails to infer with several pairs at
+    once, because it runs out of memory or does not support a batch of
+    several pairs, it falls back to a single pair per batch for the rest
+    of the run. Any other error is raised."""
+    batch_scores = []
+    start = 0
+    while start < len(alts):
+        end = min(start + model["pairs_per_batch"], len(alts))
+        ref_batch, alt_batch = encode_ref_alt_batch(
+            model["transform"],
+            [refs[index] for index in ref_inverse[start:end]],
+            np.arange(end - start),
+            alts[start:end],
+            snv_bases[start:end],
+        )
+        try:
+            ref_predictions, alt_predictions = predict_on_pairs(
+                model["kipoi_model"], ref_batch, alt_batch
+            )
+        except get_batching_errors() as err:
+            if end - start == 1:
+                raise
+            warnings.warn(
+                f"{model['config'].model} failed to infer with "
+                f"{end - start} pairs at once ({err}). Falling back to a "
+                "single pair per batch."
             )
+            model["pairs_per_batch"] = 1
+            continue
+        for ref_prediction, alt_prediction in zip(
+            ref_predictions, alt_predictions
+        ):
+            # Scoring functions which keep the position axis, like diff,
+            # score every pair with a row per position. As with a single
+            # pair per batch, the first row is the scores of the variant,
+            # so that every pair gives exactly one row.
+            batch_scores.append(
+                get_scores(
+                    ref_prediction,
+                    alt_prediction,
+                    model["scoring_functions"],
+                )[:1]
+            )
+        start = end
+    return np.concatenate(batch_scores, axis=0)
+
+
+def get_model_scores(
+    model: Dict[str, Any],
+    refs: List[str],
+    alts: List[str],
+    ref_inverse: np.ndarray,
+    snv_bases: List[Optional[str]],
+) -> np.ndarray:
+    """This function returns the scored effects of a single model for a
+    batch of variants. refs contains only the unique reference sequences
+    of the batch and ref_inverse maps every alternative sequence to its
+    reference sequence. This way, reference predictions are computed once
+    and reused for every alternative allele at the same locus. The model
+    infers in chunks of its batch size. A model with batch size 1 (Basenji)
+    infers with pairs of reference and alternative sequence, see
+    get_pair_scores."""
+    model_config = model["config"]
+    kipoi_model = model["kipoi_model"]
+    if model_config.batch_size == 1:
+        return get_pair_scores(model, refs, alts, ref_inverse, snv_bases)
+    ref_predictions = []
+    alt_predictions = []
+    for start in range(0, len(alts), model_config.batch_size):
+        end = start + model_config.batch_size
+        chunk_ref_indices, chunk_ref_inverse = np.unique(
+            ref_inverse[start:end], return_inverse=True
+        )
+        ref_batch, alt_batch = encode_ref_alt_batch(
+            model["transform"],
+            [refs[index] for index in chunk_ref_indices],
+            chunk_ref_inverse,
+            alts[start:end],
+            snv_bases[start:end],
+        )
+        with profiling.stage("prediction"):
+            ref_predictions.append(
+                kipoi_model.predict_on_batch(ref_batch)[chunk_ref_inverse]
+            )
+            alt_predictions.append(kipoi_model.predict_on_batch(alt_batch))
+    return get_scores(
+        np.concatenate(ref_predictions, axis=0),
+        np.concatenate(alt_predictions, axis=0),
+        model["scoring_functions"],
+    )
+
+
+def get_cached_model_scores(
+    model: Dict[str, Any],
+    refs: List[str],
+    alts: List[str],
+    ref_inverse: np.ndarray,
+    snv_bases: List[Optional[str]],
+) -> np.ndarray:
+    """This function returns the scored effects of a single model like
+    get_model_scores. If the model has a result cache, the scores of the
+    variants found in the cache are taken from it and only the other
+    variants are inferred. Their scores are added to the cache."""
+    model_result_cache = model.get("result_cache")
+    if model_result_cache is None:
+        return get_model_scores(model, refs, alts, ref_inverse, snv_bases)
+    keys = get_keys(
+        model["result_cache_key"],
+        [refs[ref_index] for ref_index in ref_inverse],
+        alts,
+    )
+    with profiling.stage("result_cache"):
+        cached_rows = model_result_cache.get(keys)
+    missing_indices = [
+        index for index, key in enumerate(keys) if key not in cached_rows
+    ]
+    if not missing_indices:
+        return np.stack([cached_rows[key] for key in keys])
+    missing_ref_indices, missing_ref_inverse = get_unique_indices(
+        [ref_inverse[index] for index in missing_indices]
+    )
+    missing_scores = get_model_scores(
+        model,
+        [
+            refs[ref_inverse[missing_indices[index]]]
+            for index in missing_ref_indices
+        ],
+        [alts[index] for index in missing_indices],
+        missing_ref_inverse,
+        [snv_bases[index] for index in missing_indices],
+    )
+    with profiling.stage("result_cache"):
+        model_result_cache.put(
+            [keys[index] for index in missing_indices], missing_scores
+        )
+    if len(missing_indices) == len(keys):
+        return missing_scores
+    model_scores = np.empty(
+        (len(keys),) + missing_scores.shape[1:], dtype=missing_scores.dtype
+    )
+    model_scores[missing_indices] = missing_scores
+    for index, key in enumerate(keys):
+        if key in cached_rows:
+            model_scores[index] = cached_rows[key]
+    return model_scores
+
+
+def get_batches(
+    variants: Iterator[Variant],
+    batch_size: int,
+    sort_block_size: Optional[int] = None,
+) -> Iterator[tuple]:
+    """This function reads the variants in blocks and splits every block
+    into batches. Without a sort_block_size, every block is a single
+    batch. Otherwise, every block of sort_block_size variants is sorted by
+    contig and position before it is split into batches. A tuple
+    containing the block, the order of the block, the variants of the
+    batch and whether the batch is the last of its block is returned."""
+    for block in profiling.iterate(
+        "vcf_parse", batcher(variants, sort_block_size or batch_size)
+    ):
+        if sort_block_size is None:
+            order = list(range(len(block)))
+        else:
+            order = get_locality_order(block)
+        batch_orders = list(batcher(iter(order), batch_size))
+        for batch_index, batch_order in enumerate(batch_orders):
+            yield (
+                block,
+                order,
+                [block[index] for index in batch_order],
+                batch_index == len(batch_orders) - 1,
+            )
+
+
+def prepare_batches(
+    variants: Iterator[Variant],
+    variant_extractor: VariantSeqExtractor,
+    genome_index: Optional[GenomeIndex],
+    sequence_length: int,
+    batch_size: int,
+    sort_block_size: Optional[int] = None,
+) -> Iterator[tuple]:
+    """This function returns the batches of get_batches along with the
+    list of reference sequences and the list of alternative sequences of
+    every batch"""
+    for block, order, batch_variants, is_block_end in get_batches(
+        variants, batch_size, sort_block_size
+    ):
+        refs, alts = extract_sequences(
+            variant_extractor, genome_index, batch_variants, sequence_length
+        )
+        yield block, order, batch_variants, refs, alts, is_block_end
+
+
+def score_batch(
+    models: List[Dict[str, Any]],
+    refs: List[str],
+    alts: List[str],
+    variants: List[Variant],
+) -> List[np.ndarray]:
+    """This function returns the scored effects of every model for a
+    batch of variants along with their reference and alternative sequences
+    extracted with the widest sequence length required by any of the
+    models. Exact duplicate records are scored once and reference
+    predictions are computed once per locus."""
+    profiling.next_batch()
+    unique_variant_indices, variant_inverse = get_unique_indices(
+        [
+            (variant.chrom, variant.pos, variant.ref, variant.alt)
             for variant in variants
         ]
-        refs = [
-            variant_extractor.extract(
-                interval, variants=[], anchor=sequence_length
-            )
-            for interval in intervals
+    )
+    unique_ref_indices, ref_inverse = get_unique_indices(
+        [
+            (variants[index].chrom, variants[index].pos)
+            for index in unique_variant_indices
         ]
-        alts = [
-            variant_extractor.extract(
-                interval, variants=[variants[index]], anchor=interval.center()
-            )
-            for index, interval in enumerate(intervals)
+    )
+    unique_refs = [
+        refs[unique_variant_indices[index]] for index in unique_ref_indices
+    ]
+    unique_alts = [alts[index] for index in unique_variant_indices]
+    snv_bases = [
+        variants[index].alt if is_snv(variants[index]) else None
+        for index in unique_variant_indices
+    ]
+    return [
+        get_cached_model_scores(
+            model,
+            crop_sequences(unique_refs, model["sequence_length"]),
+            crop_sequences(unique_alts, model["sequence_length"]),
+            ref_inverse,
+            snv_bases,
+        )[variant_inverse]
+        for model in models
+    ]
+
+
+def get_headers(
+    models: List[Dict[str, Any]], combined: bool
+) -> List[List[str]]:
+    """This function returns the header of every output file. A combined
+    output file holds the variant columns followed by the score columns of
+    every model. Otherwise, there is one output file per model."""
+    if combined:
+        return [
+            models[0]["column_labels"]
+            + [
+                column_label
+                for model in models[1:]
+                for column_label in model["column_labels"][5:]
+            ]
         ]
-        yield (refs, alts, variants)
+    return [model["column_labels"] for model in models]
+
+
+@profiling.profiled("writing")
+def write_rows(
+    outputs: List[Any],
+    variants: List[Variant],
+    model_scores: List[np.ndarray],
+) -> None:
+    """This function writes the scored effects of every model for a list
+    of variants. With a single output, the scores of all models are
+    concatenated column wise. Otherwise, there is one output per model."""
+    variant_columns = get_variant_columns(variants)
+    if len(outputs) == 1:
+        outputs[0].write(variant_columns, model_scores)
+    else:
+        for output, output_scores in zip(outputs, model_scores):
+            output.write(variant_columns, [output_scores])
+
+
+def get_variant_key(variant: Variant) -> tuple:
+    """This function returns the fields identifying a variant"""
+    return (variant.chrom, variant.pos, variant.ref, variant.alt)
+
+
+def get_run_settings(
+    models: List[Dict[str, Any]],
+    vcf_file: str,
+    fasta_file: str,
+    output_files: List[Union[str, Path]],
+    sort_block_size: Optional[int],
+    sorted_output: bool,
+    regions: Optional[List[Interval]],
+    float_format: Optional[str],
+) -> Dict[str, Any]:
+    """This function returns the settings of a run which determine its
+    output. They are stored in checkpoints to make sure that a run is
+    resumed with the same settings."""
+    return {
+        "vcf_file": str(vcf_file),
+        "fasta_file": str(fasta_file),
+        "output_files": [str(output_file) for output_file in output_files],
+        "models": [model["config"].model for model in models],
+        "sequence_lengths": [model["sequence_length"] for model in models],
+        "scoring_functions": [
+            [
+                scoring_function["name"]
+                for scoring_function in model["scoring_functions"]
+            ]
+            for model in models
+        ],
+        "sort_block_size": sort_block_size,
+        "sorted_output": sorted_output,
+        "regions": None
+        if regions is None
+        else [[region.chrom, region.start, region.end] for region in regions],
+        "float_format": float_format,
+    }
+
+
+def get_scoring_function_key(
+    scoring_function: Dict[str, ScoringFunction]
+) -> str:
+    """This function returns the qualified name of a scoring function
+    which identifies it in the keys of a result cache"""
+    func = scoring_function["func"]
+    return ".".join(
+        [
+            getattr(func, "__module__", None) or "",
+            getattr(func, "__qualname__", None) or scoring_function["name"],
+        ]
+    )
+
+
+def get_models(
+    model_configs: List[ModelConfig],
+    scoring_functions: List[Dict[str, ScoringFunction]],
+    load_models: bool = True,
+    result_cache: Optional[ResultCache] = None,
+) -> List[Dict[str, Any]]:
+    """This function gathers everything needed to score variants with
+    every model configuration. The kipoi models are only instantiated if
+    load_models is True. If a result cache is provided, every model looks
+    up its scores in it, see get_cached_model_scores."""
+    models = []
+    for model_config in model_configs:
+        # If no scoring function is provided through cli, fall back
+        # on the default scoring function for the model
+        model_scoring_functions = scoring_functions or [
+            model_config.default_scoring_function
+        ]
+        models.append(
+            {
+                "config": model_config,
+                "kipoi_model": (
+                    model_cache.get_model(model_config.model)
+                    if load_models
+                    else None
+                ),
+                "sequence_length": (
+                    model_config.get_required_sequence_length()
+                ),
+                "transform": model_config.get_batch_transform(),
+                "pairs_per_batch": model_config.pairs_per_batch,
+                "scoring_functions": model_scoring_functions,
+                "column_labels": model_config.get_column_labels(
+                    scoring_functions=model_scoring_functions
+                ),
+                "result_cache": result_cache,
+                "result_cache_key": get_model_key(
+                    model_config.model,
+                    model_config.model_description.version,
+                    model_config.get_required_sequence_length(),
+                    [
+                        get_scoring_function_key(scoring_function)
+                        for scoring_function in model_scoring_functions
+                    ],
+                ),
+            }
+        )
+    return models
+
+
+def tune_models(
+    models: List[Dict[str, Any]], memory_limit: Optional[int] = None
+) -> None:
+    """This function tunes the batch size of every model on the current
+    machine under memory_limit bytes and saves it to the model's tuning
+    profile, see tuning.tune_batch_size. Models that infer with pairs of
+    reference and alternative sequence (Basenji) are not tuned. A model
+    that is not loaded yet is loaded for tuning."""
+    for model in models:
+        model_config = model["config"]
+        if model_config.batch_size == 1:
+            continue
+        profile = tuning.tune_batch_size(
+            model["kipoi_model"] or model_cache.get_model(model_config.model),
+            model["transform"],
+            model["sequence_length"],
+            memory_limit,
+        )
+        tuning.save_tuning_profile(model_config.model, profile)
+        model_config.batch_size = profile["batch_size"]
+
+
+def get_portable_variants(variants: List[Variant]) -> List[Variant]:
+    """This function returns copies of the variants without their cyvcf2
+    records which can not be sent to other processes. Scoring only
+    requires the position and the alleles."""
+    return [
+        Variant(variant.chrom, variant.pos, variant.ref, variant.alt)
+        for variant in variants
+    ]
+
+
+# State of a worker process of score_variants_multi_model
+_worker = {}
+
+
+def init_worker(
+    models: List[Dict[str, Any]], fasta_file: str, sequence_length: int
+) -> None:
+    """This function loads the models and opens the fasta file once in
+    every worker process"""
+    for model in models:
+        if model["kipoi_model"] is None:
+            model["kipoi_model"] = model_cache.get_model(model["config"].model)
+    _worker["models"] = models
+    _worker["sequence_length"] = sequence_length
+    (
+        _worker["variant_extractor"],
+        _worker["genome_index"],
+    ) = get_variant_extractor(fasta_file)
+
+
+def score_batch_in_worker(variants: List[Variant]) -> List[np.ndarray]:
+    """This function extracts the sequences of a batch of variants and
+    scores them in a worker process initialized by init_worker. Use it
+    with profiling.run_in_worker."""
+    refs, alts = extract_sequences(
+        _worker["variant_extractor"],
+        _worker["genome_index"],
+        variants,
+        _worker["sequence_length"],
+    )
+    return score_batch(_worker["models"], refs, alts, variants)
+
+
+def score_variants_multi_model(
+    model_configs: List[ModelConfig],
+    vcf_file: str,
+    fasta_file: str,
+    output_file: Union[str, Path, List[Union[str, Path]]],
+    scoring_functions: List[Dict[str, ScoringFunction]] = [],
+    sort_block_size: Optional[int] = None,
+    sorted_output: bool = False,
+    prefetch_batches: int = 0,
+    workers: int = 1,
+    regions: Optional[List[Interval]] = None,
+    checkpoint_interval: Optional[float] = None,
+    resume: bool = False,
+    output_format: str = "tsv",
+    float_format: Optional[str] = None,
+    compression_threads: int = 1,
+    auto_batch_size: bool = False,
+    memory_limit: Optional[int] = None,
+    result_cache: Optional[ResultCache] = None,
+) -> None:
+    """This function perfoms variant effect prediction for several sequence
+    based models while reading the vcf file only once. The steps are
+    as follows
+    1. A kipoi model object is instantiated for every model configuration.
+    2. The input vcf file is iterated in batches. Reference and alternative
+    sequences are extracted once with the widest sequence length
+    required by any of the models.
+    3. For every model, the sequences are cropped to the model's required
+    sequence length and the model performs inference with them in chunks
+    of the model's batch size.
+    4. Effects are scored with the desired scoring functions. If no scoring
+    function is provided, every model uses its default scoring function.
+    5. Finally, the scored effects are written either to a single tsv file
+    where the scores of all models are concatenated column wise, or to one
+    tsv file per model if a list of output files is provided.
+
+    If sort_block_size is provided, the vcf file is read in blocks of
+    sort_block_size variants which are sorted by contig and position before
+    extraction and inference. This keeps sequence extraction local for
+    unsorted or concatenated vcf files. The scored effects are written in
+    the original order of the vcf file unless sorted_output is True. Memory
+    usage is bounded by the block size.
+
+    If prefetch_batches is greater than 0, up to prefetch_batches batches
+    are read and extracted ahead in a background thread and finished
+    batches are written in another background thread, so that the models
+    do not wait for input and output. The output is the same.
+
+    If workers is greater than 1, batches are scored in as many worker
+    processes, each with its own copy of the models. The scored effects
+    are streamed back and written in the same order as with a single
+    process.
+
+    If regions are provided, only the variants within the regions are
+    scored. The vcf file must be bgzipped and indexed with tabix or CSI.
+
+    If checkpoint_interval is provided, the progress of the run is
+    recorded in a checkpoint next to the (first) output file at most every
+    checkpoint_interval seconds, once a block is fully written. The
+    checkpoint is removed when the run is complete. If resume is True, an
+    interrupted run with the same settings continues from its checkpoint.
+
+    The scored effects are written as tsv by default. With an output_format
+    of parquet or arrow, they are written as columnar files where every
+    block is a row group or record batch. See kipoi_veff2.output.
+    Scores in tsv files are written exactly unless a printf style
+    float_format such as %.6g is provided. Tsv files whose name ends with
+    .gz or .bgz are BGZF compressed with compression_threads threads and
+    indexed with tabix if their rows are sorted.
+
+    If auto_batch_size is True, the batch size of every model is tuned on
+    the current machine under memory_limit bytes before scoring and saved
+    to a tuning profile, see tune_models.
+
+    If a result_cache is provided, the scores of variants which are found
+    in the cache are not inferred again and the scores of all other
+    variants are added to the cache, see result_cache.ResultCache. The
+    output is the same.
+
+    Raises:
+        ValueError: If the number of output files does not match the
+        number of models, the checkpoint of a resumed run does not match
+        the run or checkpoints are requested for columnar output
+    """
+    if isinstance(output_file, (str, Path)):
+        output_files = None
+    else:
+        output_files = list(output_file)
+        if len(output_files) != len(model_configs):
+            raise ValueError(
+                "Number of output files must match the number of models"
+            )
+    if output_format != "tsv" and (checkpoint_interval is not None or resume):
+        raise ValueError("Checkpoints are only supported for tsv output")
+    models = get_models(
+        model_configs,
+        scoring_functions,
+        load_models=workers == 1,
+        result_cache=result_cache,
+    )
+    if auto_batch_size:
+        tune_models(models, memory_limit)
+    widest_sequence_length = max(model["sequence_length"] for model in models)
+    batch_size = max(
+        model["config"].get_variants_per_batch() for model in models
+    )
+
+    all_output_files = [output_file] if output_files is None else output_files
+    checkpoint_file = get_checkpoint_file(all_output_files[0])
+    settings = get_run_settings(
+        models,
+        vcf_file,
+        fasta_file,
+        all_output_files,
+        sort_block_size,
+        sorted_output,
+        regions,
+        float_format,
+    )
+    vcf_variants = read_variants(vcf_file, regions)
+    progress = None
+    if resume:
+        progress = load_checkpoint(checkpoint_file, settings, all_output_files)
+    variants_done = 0
+    if progress is not None:
+        variants_done, last_variant_done = progress
+        vcf_variants = skip_done(
+            vcf_variants, variants_done, last_variant_done, get_variant_key
+        )
+    checkpoint = (
+        None
+        if checkpoint_interval is None
+        else Checkpoint(checkpoint_file, settings, checkpoint_interval)
+    )
+
+    with ExitStack() as stack:
+        # A resumed run appends to the output files truncated to the
+        # checkpoint which already have their header
+        outputs = []
+        for output_file, header in zip(
+            all_output_files, get_headers(models, output_files is None)
+        ):
+            outputs.append(
+                get_output(
+                    output_format,
+                    output_file,
+                    header,
+                    append=progress is not None,
+                    float_format=float_format,
+                    compression_threads=compression_threads,
+                )
+            )
+            stack.enter_context(outputs[-1])
+
+        if workers > 1:
+            # Every worker process loads its own models and reads its
+            # own reference sequences. Only variants and scores are passed
+            # between the processes. Workers are forked, so the model
+            # configurations do not need to be picklable.
+            pool = stack.enter_context(
+                multiprocessing.get_context("fork").Pool(
+                    workers,
+                    initializer=init_worker,
+                    initargs=(models, fasta_file, widest_sequence_length),
+                )
+            )
+            tasks = (
+                (batch, (get_portable_variants(batch[2]),))
+                for batch in get_batches(
+                    vcf_variants,
+                    batch_size,
+                    sort_block_size,
+                )
+            )
+            scored_batches = (
+                batch + (batch_scores,)
+                for batch, batch_scores in profiling.collect(
+                    imap_ordered(
+                        pool,
+                        partial(
+                            profiling.run_in_worker, score_batch_in_worker
+                        ),
+                        tasks,
+                        2 * workers,
+                    )
+                )
+            )
+        else:
+            variant_extractor, genome_index = get_variant_extractor(fasta_file)
+            batches = prepare_batches(
+                vcf_variants,
+                variant_extractor,
+                genome_index,
+                widest_sequence_length,
+                batch_size,
+                sort_block_size,
+            )
+            if prefetch_batches:
+                # Reading the vcf file and extracting sequences of the next
+                # batches happen in a background thread while the models
+                # infer
+                batches = prefetch(batches, prefetch_batches)
+            scored_batches = (
+                (
+                    block,
+                    order,
+                    variants,
+                    is_block_end,
+                    score_batch(models, refs, alts, variants),
+                )
+                for block, order, variants, refs, alts, is_block_end in (
+                    batches
+                )
+            )
+        if prefetch_batches:
+            # Finished blocks are written in a background thread
+            write = stack.enter_context(
+                BackgroundWriter(prefetch_batches)
+            ).submit
+        else:
+            write = call
+
+        block_scores = [[] for _ in models]
+        for (
+            block,
+            order,
+            variants,
+            is_block_end,
+            batch_scores,
+        ) in scored_batches:
+            for model_block_scores, model_scores in zip(
+                block_scores, batch_scores
+            ):
+                model_block_scores.append(model_scores)
+            if not is_block_end:
+                continue
+            block_scores = [
+                np.concatenate(model_block_scores, axis=0)
+                for model_block_scores in block_scores
+            ]
+            if sorted_output:
+                write(
+                    write_rows,
+                    outputs,
+                    [block[index] for index in order],
+                    block_scores,
+                )
+            else:
+                # Restore the original order of the vcf file
+                original_order = np.argsort(order)
+                write(
+                    write_rows,
+                    outputs,
+                    block,
+                    [
+                        model_block_scores[original_order]
+                        for model_block_scores in block_scores
+                    ],
+                )
+            block_scores = [[] for _ in models]
+            variants_done += len(block)
+            if checkpoint is not None:
+                write(
+                    checkpoint.update,
+                    [output.handle for output in outputs],
+                    variants_done,
+                    get_variant_key(block[-1]),
+                )
+
+    if checkpoint is not None:
+        # The run is complete
+        checkpoint.remove()
+
+
+class ScoredBatch(NamedTuple):
+    """This class holds the scored effects of a batch of variants. The
+    variants are given as arrays of the five variant columns keyed by
+    chrom, pos, id, ref and alt. Row i of the float32 score matrix holds
+    the scores of variant i whose columns are named by column_labels."""
+
+    variants: Dict[str, np.ndarray]
+    scores: np.ndarray
+    column_labels: List[str]
+
+
+def iter_scores(
+    model_configs: List[ModelConfig],
+    variants: Union[str, Path, pd.DataFrame, Iterable],
+    fasta_file: str,
+    scoring_functions: List[Dict[str, ScoringFunction]] = [],
+    sort_block_size: Optional[int] = None,
+    prefetch_batches: int = 0,
+    regions: Optional[List[Interval]] = None,
+    result_cache: Optional[ResultCache] = None,
+) -> Iterator[ScoredBatch]:
+    """This function scores variants like score_variants_multi_model but
+    yields the scored effects of every batch as a ScoredBatch instead of
+    writing them, so that they can be used without reading an output
+    file. The variants are either the path of a vcf file, a data frame
+    or an iterable, see get_variants. The score matrix holds the scores
+    of all models concatenated column wise in the order of model_configs.
+
+    Without a sort_block_size, batches are yielded in the order of the
+    variants. Otherwise, every block of sort_block_size variants is sorted
+    by contig and position and its batches are yielded in sorted order.
+    See score_variants_multi_model for prefetch_batches, regions and
+    result_cache.
+    """
+    models = get_models(
+        model_configs, scoring_functions, result_cache=result_cache
+    )
+    widest_sequence_length = max(model["sequence_length"] for model in models)
+    batch_size = max(
+        model["config"].get_variants_per_batch() for model in models
+    )
+    column_labels = get_headers(models, True)[0][5:]
+    variant_extractor, genome_index = get_variant_extractor(fasta_file)
+    batches = prepare_batches(
+        get_variants(variants, regions),
+        variant_extractor,
+        genome_index,
+        widest_sequence_length,
+        batch_size,
+        sort_block_size,
+    )
+    if prefetch_batches:
+        batches = prefetch(batches, prefetch_batches)
+    for _, _, batch_variants, refs, alts, _ in batches:
+        batch_scores = score_batch(models, refs, alts, batch_variants)
+        chroms, positions, ids, ref_alleles, alt_alleles = get_variant_columns(
+            batch_variants
+        )
+        yield ScoredBatch(
+            variants={
+                "chrom": np.array(chroms, dtype=object),
+                "pos": np.array(positions, dtype=np.int64),
+                "id": np.array(ids, dtype=object),
+                "ref": np.array(ref_alleles, dtype=object),
+                "alt": np.array(alt_alleles, dtype=object),
+            },
+            scores=np.concatenate(
+                [
+                    np.asarray(model_scores, dtype=np.float32).reshape(
+                        len(batch_variants), -1
+                    )
+                    for model_scores in batch_scores
+                ],
+                axis=1,
+            ),
+            column_labels=column_labels,
+        )
 
 
 def score_variants(
@@ -218,6 +1371,19 @@ def score_variants(
     fasta_file: str,
     output_file: Union[str, Path],
     scoring_functions: List[Dict[str, ScoringFunction]] = [],
+    sort_block_size: Optional[int] = None,
+    sorted_output: bool = False,
+    prefetch_batches: int = 0,
+    workers: int = 1,
+    regions: Optional[List[Interval]] = None,
+    checkpoint_interval: Optional[float] = None,
+    resume: bool = False,
+    output_format: str = "tsv",
+    float_format: Optional[str] = None,
+    compression_threads: int = 1,
+    auto_batch_size: bool = False,
+    memory_limit: Optional[int] = None,
+    result_cache: Optional[ResultCache] = None,
 ) -> None:
     """This function perfoms variant effect prediction for sequence
     based models. The steps are as follows
@@ -232,77 +1398,28 @@ def score_variants(
     the reference and alternative predictions.
     5. Finally, the scored effects and variants used to generate
     the effects are written to a tsv file.
+    See score_variants_multi_model for sort_block_size, sorted_output,
+    prefetch_batches, workers, regions, checkpoint_interval, resume,
+    output_format, float_format, compression_threads, auto_batch_size,
+    memory_limit and result_cache.
     """
-    kipoi_model = kipoi.get_model(model_config.model)
-    sequence_length = model_config.get_required_sequence_length()
-    transform = model_config.get_transform()
-    if not scoring_functions:
-        # If no scoring function is provided through cli, fall back
-        # on the default scoring function for the model
-        scoring_functions = [model_config.default_scoring_function]
-    column_labels = model_config.get_column_labels(
-        scoring_functions=scoring_functions
+    score_variants_multi_model(
+        [model_config],
+        vcf_file,
+        fasta_file,
+        output_file,
+        scoring_functions,
+        sort_block_size=sort_block_size,
+        sorted_output=sorted_output,
+        prefetch_batches=prefetch_batches,
+        workers=workers,
+        regions=regions,
+        checkpoint_interval=checkpoint_interval,
+        resume=resume,
+        output_format=output_format,
+        float_format=float_format,
+        compression_threads=compression_threads,
+        auto_batch_size=auto_batch_size,
+        memory_limit=memory_limit,
+        result_cache=result_cache,
     )
-    with open(output_file, "w") as output_tsv:
-        tsv_writer = csv.writer(output_tsv, delimiter="\t")
-        tsv_writer.writerow(column_labels)
-
-        for refs, alts, variants in batch_dataloader(
-            vcf_file, fasta_file, sequence_length, model_config.batch_size
-        ):
-            if model_config.batch_size == 1:
-                ref_batch = transform(refs[0])[np.newaxis]
-                alt_batch = transform(alts[0])[np.newaxis]
-                ref_alt_batch = np.concatenate((ref_batch, alt_batch), axis=0)
-                ref_alt_prediction = kipoi_model.predict_on_batch(
-                    ref_alt_batch
-                )
-                ref_predictions, alt_predictions = (
-                    ref_alt_prediction[0],
-                    ref_alt_prediction[1],
-                )
-            else:
-                refs = np.stack([transform(ref) for ref in refs], axis=0)
-                ref_predictions = kipoi_model.predict_on_batch(refs)
-                alts = np.stack([transform(alt) for alt in alts], axis=0)
-                alt_predictions = kipoi_model.predict_on_batch(alts)
-
-            aggregated_scores = scoring_functions[0]["func"](
-                ref_predictions, alt_predictions
-            )
-            if aggregated_scores.ndim == 0:
-                aggregated_scores = aggregated_scores[np.newaxis]
-            if aggregated_scores.ndim == 1:
-                aggregated_scores = aggregated_scores[:, np.newaxis]
-            for scoring_function in scoring_functions[1:]:
-                scores = scoring_function["func"](
-                    ref_predictions, alt_predictions
-                )
-                if scores.ndim == 0:
-                    scores = scores[np.newaxis]
-                if scores.ndim == 1:
-                    scores = scores[:, np.newaxis]
-
-                aggregated_scores = np.concatenate(
-                    (
-                        aggregated_scores,
-                        scores,
-                    ),
-                    axis=1,
-                )
-
-            for index, variant in enumerate(variants):
-                tsv_writer.writerow(
-                    [
-                        variant.chrom,
-                        variant.pos,
-                        variant.id,
-                        variant.ref,
-                        variant.alt,
-                    ]
-                    + (
-                        [aggregated_scores[index]]
-                        if np.isscalar(aggregated_scores[index])
-                        else list(aggregated_scores[index])
-                    )
-                )
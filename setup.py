@@ -30,9 +30,14 @@ setup(
         "console_scripts": [
             "kipoi_veff2_predict=kipoi_veff2.cli:score_variants",
             "kipoi_veff2_merge=kipoi_veff2.merge:merge",
+            "kipoi_veff2_store=kipoi_veff2.store:store",
+            "kipoi_veff2_index=kipoi_veff2.genome:index",
+            "kipoi_veff2_daemon=kipoi_veff2.daemon:daemon",
+            "kipoi_veff2_benchmark=kipoi_veff2.benchmark:benchmark",
         ],
     },
     install_requires=requirements,
+    extras_require={"arrow": ["pyarrow"], "tabix": ["pysam"]},
     license="MIT license",
     include_package_data=True,
     keywords="kipoi_veff2",
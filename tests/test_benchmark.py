@@ -0,0 +1,88 @@
+import json
+import os
+
+from click.testing import CliRunner
+
+from kipoi_veff2 import benchmark
+from kipoi_veff2 import variant_centered
+
+
+def test_write_synthetic_inputs(tmp_path):
+    fasta_file, vcf_file = benchmark.write_synthetic_inputs(
+        tmp_path, 50, indel_fraction=0.5
+    )
+    variants = list(variant_centered.read_variants(vcf_file))
+    assert len(variants) == 50
+    assert [(variant.chrom, variant.pos) for variant in variants] == sorted(
+        (variant.chrom, variant.pos) for variant in variants
+    )
+    assert any(not variant_centered.is_snv(variant) for variant in variants)
+    variant_extractor, genome_index = variant_centered.get_variant_extractor(
+        fasta_file
+    )
+    refs, alts = variant_centered.extract_sequences(
+        variant_extractor, genome_index, variants, 1000
+    )
+    assert all(
+        len(ref) == 1000 and len(alt) == 1000 for ref, alt in zip(refs, alts)
+    )
+    snv_position = variant_centered.get_snv_position(1000)
+    assert all(
+        ref[snv_position] == variant.ref
+        for ref, variant in zip(refs, variants)
+        if variant_centered.is_snv(variant)
+    )
+
+
+def test_run_benchmark(tmp_path):
+    runner = CliRunner()
+    result = runner.invoke(
+        benchmark.benchmark,
+        ["run", str(tmp_path / "benchmark.json"), "--variants", "40"],
+    )
+    assert result.exit_code == 0, result.output
+    with open(tmp_path / "benchmark.json", "r") as benchmark_json:
+        results = json.load(benchmark_json)
+    assert results["settings"]["models"] == benchmark.DEFAULT_MODELS
+    assert list(results["stages"]) == benchmark.STAGES
+    for stage_results in results["stages"].values():
+        assert stage_results["seconds"] > 0
+        assert stage_results["calls"] > 0
+        assert stage_results["peak_memory"] > 0
+    result = runner.invoke(
+        benchmark.benchmark,
+        [
+            "compare",
+            str(tmp_path / "benchmark.json"),
+            str(tmp_path / "benchmark.json"),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "end_to_end" in result.output
+    assert all(
+        stage["speedup"] == 1
+        for stage in benchmark.compare_benchmarks(results, results)
+    )
+    results["stages"]["end_to_end"]["seconds"] = 0.0
+    comparison = {
+        stage["stage"]: stage
+        for stage in benchmark.compare_benchmarks(results, results)
+    }
+    assert comparison["end_to_end"]["speedup"] is None
+
+
+def log_stage(settings, stage, output_dir):
+    with open(settings["log_file"], "a") as log_handle:
+        log_handle.write(f"{stage}\t{os.getpid()}\n")
+    return {"stage": stage}
+
+
+def test_merge_stage_in_own_process(tmp_path, monkeypatch):
+    log_file = tmp_path / "stages.log"
+    monkeypatch.setattr(benchmark, "run_stage", log_stage)
+    assert benchmark.run_stage_in_child(
+        {"log_file": str(log_file)}, "merge"
+    ) == {"stage": "merge"}
+    stages = [line.split("\t") for line in log_file.read_text().splitlines()]
+    assert [stage for stage, _ in stages] == ["end_to_end", "merge"]
+    assert len({pid for _, pid in stages} | {str(os.getpid())}) == 3
@@ -0,0 +1,132 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from kipoi_veff2 import bgzf
+from kipoi_veff2 import output
+
+COLUMN_LABELS = ["#CHROM", "POS", "ID", "REF", "ALT", "model/1"]
+
+
+def get_text(number_of_lines):
+    return "".join(
+        f"chr22\t{position}\t\tA\tT\t{position / 7}\r\n"
+        for position in range(1, number_of_lines + 1)
+    )
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_bgzf_writer(tmp_path, threads):
+    output_file = tmp_path / "out.tsv.gz"
+    text = get_text(20000)
+    writer = bgzf.BgzfWriter(output_file, threads=threads)
+    writer.write(text[:100])
+    writer.write(text[100:])
+    writer.close()
+    assert gzip.open(output_file, "rt", newline="").read() == text
+    assert output_file.read_bytes().endswith(bgzf.BGZF_EOF)
+
+
+def test_bgzf_writer_truncate_and_append(tmp_path):
+    output_file = tmp_path / "out.tsv.gz"
+    text = get_text(20000)
+    writer = bgzf.BgzfWriter(output_file)
+    writer.write(text[:1000])
+    writer.flush()
+    size = os.fstat(writer.fileno()).st_size
+    writer.write(text[1000:5000])
+    writer.close()
+    os.truncate(output_file, size)
+    writer = bgzf.BgzfWriter(output_file, append=True)
+    writer.write(text[1000:])
+    writer.close()
+    assert gzip.open(output_file, "rt", newline="").read() == text
+
+
+def test_compressed_tsv_output_is_indexed(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    output_file = tmp_path / "out.tsv.gz"
+    tsv_output = output.get_output("tsv", output_file, COLUMN_LABELS)
+    for chrom in ["chr21", "chr22"]:
+        tsv_output.write(
+            [[chrom] * 3, [10, 20, 30], [None] * 3, ["A"] * 3, ["T"] * 3],
+            [np.array([[0.5], [1.5], [2.5]], dtype=np.float32)],
+        )
+    tsv_output.close()
+    tabix_file = pysam.TabixFile(str(output_file))
+    assert tabix_file.contigs == ["chr21", "chr22"]
+    assert list(tabix_file.fetch("chr22", 15, 20)) == [
+        "chr22\t20\t\tA\tT\t1.5"
+    ]
+
+
+def test_unsorted_compressed_tsv_output_is_not_indexed(tmp_path):
+    output_file = tmp_path / "out.tsv.gz"
+    tsv_output = output.get_output("tsv", output_file, COLUMN_LABELS)
+    tsv_output.write(
+        [["chr22"] * 2, [20, 10], [None] * 2, ["A"] * 2, ["T"] * 2],
+        [np.array([[0.5], [1.5]], dtype=np.float32)],
+    )
+    with pytest.warns(UserWarning):
+        tsv_output.close()
+    assert not (tmp_path / "out.tsv.gz.tbi").exists()
+    assert gzip.open(output_file, "rt").read().splitlines()[1:] == [
+        "chr22\t20\t\tA\tT\t0.5",
+        "chr22\t10\t\tA\tT\t1.5",
+    ]
+
+
+def write_block(tsv_output, chrom, positions):
+    tsv_output.write(
+        [
+            [chrom] * len(positions),
+            positions,
+            [None] * len(positions),
+            ["A"] * len(positions),
+            ["T"] * len(positions),
+        ],
+        [np.ones((len(positions), 1), dtype=np.float32)],
+    )
+
+
+def test_incomplete_compressed_tsv_output_is_not_indexed(tmp_path):
+    pytest.importorskip("pysam")
+    output_file = tmp_path / "out.tsv.gz"
+    with output.get_output("tsv", output_file, COLUMN_LABELS) as tsv_output:
+        write_block(tsv_output, "chr22", [10, 20])
+    assert (tmp_path / "out.tsv.gz.tbi").exists()
+    with pytest.raises(RuntimeError):
+        with output.get_output(
+            "tsv", output_file, COLUMN_LABELS
+        ) as tsv_output:
+            write_block(tsv_output, "chr22", [10, 20])
+            raise RuntimeError("interrupted")
+    # The index of the earlier run is removed as well
+    assert not (tmp_path / "out.tsv.gz.tbi").exists()
+
+
+@pytest.mark.parametrize(
+    "positions, is_sorted",
+    [([10, 20, 30], True), ([10, 30, 20], False), ([10, 20, 5], False)],
+)
+def test_appended_compressed_tsv_output_checks_existing_rows(
+    tmp_path, positions, is_sorted
+):
+    output_file = tmp_path / "out.tsv.gz"
+    tsv_output = output.get_output("tsv", output_file, COLUMN_LABELS)
+    write_block(tsv_output, "chr22", positions[:2])
+    # An interrupted run leaves the file without the BGZF end of file
+    tsv_output.handle.flush()
+    tsv_output.handle.handle.close()
+    tsv_output = output.get_output(
+        "tsv", output_file, COLUMN_LABELS, append=True
+    )
+    write_block(tsv_output, "chr22", positions[2:])
+    assert tsv_output.is_sorted == is_sorted
+    tsv_output.close(complete=False)
+    assert [
+        int(row.split("\t")[1])
+        for row in gzip.open(output_file, "rt").read().splitlines()[1:]
+    ] == positions
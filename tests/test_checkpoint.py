@@ -0,0 +1,90 @@
+import pytest
+
+from kipoi_veff2 import checkpoint
+
+SETTINGS = {"vcf_file": "test.vcf", "models": ["DeepSEA/predict"]}
+
+
+def write_checkpoint(output_file, settings=SETTINGS):
+    with open(output_file, "w") as output_handle:
+        output_handle.write("#CHROM\tPOS\n")
+        output_handle.write("chr22\t21541590\n")
+        run_checkpoint = checkpoint.Checkpoint(
+            checkpoint.get_checkpoint_file(output_file), settings, 0
+        )
+        run_checkpoint.update(
+            [output_handle], 1, ("chr22", 21541590, "A", "T")
+        )
+        output_handle.write("chr22\t215")
+    return run_checkpoint
+
+
+def test_load_checkpoint_truncates_output(tmp_path):
+    output_file = tmp_path / "out.tsv"
+    write_checkpoint(output_file)
+    progress = checkpoint.load_checkpoint(
+        checkpoint.get_checkpoint_file(output_file), SETTINGS, [output_file]
+    )
+    assert progress == (1, ("chr22", 21541590, "A", "T"))
+    assert output_file.read_text() == "#CHROM\tPOS\nchr22\t21541590\n"
+
+
+def test_load_checkpoint_with_different_settings(tmp_path):
+    output_file = tmp_path / "out.tsv"
+    write_checkpoint(output_file)
+    with pytest.raises(ValueError):
+        checkpoint.load_checkpoint(
+            checkpoint.get_checkpoint_file(output_file),
+            {"vcf_file": "other.vcf", "models": ["DeepSEA/predict"]},
+            [output_file],
+        )
+
+
+def test_load_checkpoint_with_shorter_output(tmp_path):
+    output_file = tmp_path / "out.tsv"
+    write_checkpoint(output_file)
+    output_file.write_text("#CHROM")
+    with pytest.raises(ValueError):
+        checkpoint.load_checkpoint(
+            checkpoint.get_checkpoint_file(output_file),
+            SETTINGS,
+            [output_file],
+        )
+
+
+def test_load_missing_checkpoint(tmp_path):
+    with pytest.warns(UserWarning):
+        assert (
+            checkpoint.load_checkpoint(
+                tmp_path / "out.tsv.checkpoint",
+                SETTINGS,
+                [tmp_path / "out.tsv"],
+            )
+            is None
+        )
+
+
+def test_remove_checkpoint(tmp_path):
+    output_file = tmp_path / "out.tsv"
+    write_checkpoint(output_file).remove()
+    assert not (tmp_path / "out.tsv.checkpoint").exists()
+
+
+def test_skip_done():
+    items = checkpoint.skip_done(
+        iter(range(10)), 4, (3,), lambda item: (item,)
+    )
+    assert list(items) == [4, 5, 6, 7, 8, 9]
+
+
+def test_skip_done_with_changed_input():
+    with pytest.raises(ValueError):
+        list(
+            checkpoint.skip_done(
+                iter(range(10)), 4, (2,), lambda item: (item,)
+            )
+        )
+    with pytest.raises(ValueError):
+        list(
+            checkpoint.skip_done(iter(range(3)), 4, (3,), lambda item: (item,))
+        )
@@ -0,0 +1,254 @@
+from pathlib import Path
+import threading
+import time
+from types import SimpleNamespace
+
+import kipoi
+import numpy as np
+import pytest
+
+from kipoi_veff2 import daemon
+from kipoi_veff2 import model_cache
+from kipoi_veff2 import server
+from kipoi_veff2 import variant_centered
+
+
+class LinearModel:
+    """A model whose predictions are a fixed linear map of the one hot
+    encoded sequences"""
+
+    def __init__(self):
+        self.weights = np.random.RandomState(0).normal(size=(50 * 4, 3))
+        self.batch_lengths = []
+
+    def predict_on_batch(self, batch):
+        self.batch_lengths.append(len(batch))
+        return (batch.reshape(len(batch), -1) @ self.weights).astype(
+            np.float32
+        )
+
+
+@pytest.fixture
+def kipoi_model(tmp_path, monkeypatch):
+    linear_model = LinearModel()
+    description = SimpleNamespace(
+        schema=SimpleNamespace(
+            targets=SimpleNamespace(column_labels=None, shape=(3,))
+        ),
+        default_dataloader=SimpleNamespace(
+            defined_as="kipoiseq.dataloaders.SeqIntervalDl",
+            default_args={"auto_resize_len": 50},
+        ),
+    )
+    monkeypatch.setattr(kipoi, "get_model_descr", lambda model: description)
+    monkeypatch.setattr(
+        kipoi, "get_model", lambda model, **kwargs: linear_model
+    )
+    monkeypatch.setattr(model_cache, "_models", {})
+    monkeypatch.setattr(model_cache, "_kipoi_descriptions", {})
+    monkeypatch.setattr(model_cache, "_descriptions", {})
+    monkeypatch.setenv(
+        model_cache.DESCRIPTION_DIR_VARIABLE, str(tmp_path / "descriptions")
+    )
+    return linear_model
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    sequence = "".join(np.random.RandomState(1).choice(list("ACGT"), 1000))
+    fasta_file = tmp_path / "genome.fa"
+    fasta_file.write_text(
+        ">chr1\n"
+        + "\n".join(
+            sequence[start : start + 60] for start in range(0, 1000, 60)
+        )
+        + "\n"
+    )
+    vcf_files = []
+    for index in range(3):
+        vcf_file = tmp_path / f"in{index}.vcf"
+        vcf_file.write_text(
+            "##fileformat=VCFv4.2\n"
+            + "##contig=<ID=chr1,length=1000>\n"
+            + "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+            + "".join(
+                f"chr1\t{pos}\tv{pos}\t{sequence[pos - 1]}\t"
+                + ("T" if sequence[pos - 1] != "T" else "G")
+                + "\t.\t.\t.\n"
+                for pos in range(100 + index * 200, 150 + index * 200, 7)
+            )
+        )
+        vcf_files.append(str(vcf_file))
+    return str(fasta_file), vcf_files
+
+
+def test_scoring_daemon_coalesces_jobs(kipoi_model, inputs, tmp_path):
+    fasta_file, vcf_files = inputs
+    model_config = variant_centered.get_model_config("Basset")
+    expected_files = []
+    for vcf_file in vcf_files:
+        expected_files.append(tmp_path / f"{Path(vcf_file).stem}.tsv")
+        variant_centered.score_variants(
+            model_config, vcf_file, fasta_file, expected_files[-1]
+        )
+    kipoi_model.batch_lengths.clear()
+
+    scoring_daemon = server.ScoringDaemon([model_config], fasta_file)
+    output_files = [tmp_path / f"out{index}.tsv" for index in range(3)]
+    jobs = [
+        threading.Thread(
+            target=server.run_job,
+            args=(
+                scoring_daemon,
+                {"vcf_file": vcf_file, "output_file": str(output_file)},
+            ),
+        )
+        for vcf_file, output_file in zip(vcf_files, output_files)
+    ]
+    for job in jobs:
+        job.start()
+    while len(scoring_daemon.pending) < len(jobs):
+        time.sleep(0.01)
+    scoring_daemon.start()
+    for job in jobs:
+        job.join()
+    scoring_daemon.close()
+    # The variants of all jobs are inferred in a single batch of
+    # reference and a single batch of alternative sequences
+    assert kipoi_model.batch_lengths == [24, 24]
+    for output_file, expected_file in zip(output_files, expected_files):
+        assert output_file.read_text() == expected_file.read_text()
+
+
+def test_scoring_daemon_socket(kipoi_model, inputs, tmp_path):
+    fasta_file, vcf_files = inputs
+    model_config = variant_centered.get_model_config("Basset")
+    expected_file = tmp_path / "expected.tsv"
+    variant_centered.score_variants(
+        model_config, vcf_files[0], fasta_file, expected_file
+    )
+    scoring_daemon = server.ScoringDaemon([model_config], fasta_file)
+    socket_file = tmp_path / "daemon.sock"
+    serving = threading.Thread(
+        target=server.serve, args=(socket_file, scoring_daemon)
+    )
+    serving.start()
+    try:
+        while not socket_file.exists():
+            time.sleep(0.01)
+        assert daemon.send_request(socket_file, {"command": "status"})[
+            "models"
+        ] == ["Basset"]
+        variants = [
+            row.split("\t")[:5]
+            for row in expected_file.read_text().splitlines()[1:]
+        ]
+        response = daemon.send_request(socket_file, {"variants": variants})
+        assert response["tsv"] == expected_file.read_bytes().decode()
+        with pytest.raises(RuntimeError, match="DeepSEA"):
+            daemon.send_request(
+                socket_file,
+                {"vcf_file": vcf_files[0], "models": ["DeepSEA/predict"]},
+            )
+    finally:
+        daemon.send_request(socket_file, {"command": "shutdown"})
+        serving.join()
+    assert not socket_file.exists()
+
+
+def test_scoring_daemon_separates_fasta_files(kipoi_model, inputs, tmp_path):
+    fasta_file, vcf_files = inputs
+    sequence = "".join(np.random.RandomState(2).choice(list("ACGT"), 1000))
+    other_fasta_file = tmp_path / "other.fa"
+    other_fasta_file.write_text(f">chr1\n{sequence}\n")
+    model_config = variant_centered.get_model_config("Basset")
+    scoring_daemon = server.ScoringDaemon([model_config], fasta_file)
+    variants = list(variant_centered.get_variants(vcf_files[0]))
+    results = {}
+
+    def score(fasta):
+        results[fasta] = scoring_daemon.score(variants, fasta)[0]
+
+    jobs = [
+        threading.Thread(target=score, args=(fasta,))
+        for fasta in [fasta_file, str(other_fasta_file)]
+    ]
+    for job in jobs:
+        job.start()
+    while len(scoring_daemon.pending) < len(jobs):
+        time.sleep(0.01)
+    scoring_daemon.start()
+    for job in jobs:
+        job.join()
+    # Pieces of jobs with different fasta files are never batched together
+    assert kipoi_model.batch_lengths == [8, 8, 8, 8]
+    for fasta in [fasta_file, str(other_fasta_file)]:
+        expected_scores = scoring_daemon.score(variants, fasta)[0]
+        assert np.array_equal(results[fasta], expected_scores)
+    scoring_daemon.close()
+    assert not np.array_equal(
+        results[fasta_file], results[str(other_fasta_file)]
+    )
+
+
+def test_scoring_daemon_queues_pieces_lazily(
+    kipoi_model, inputs, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(server, "MAX_QUEUED_PIECES", 2)
+    fasta_file, vcf_files = inputs
+    model_config = variant_centered.get_model_config("Basset", batch_size=2)
+    expected_file = tmp_path / "expected.tsv"
+    variant_centered.score_variants(
+        model_config, vcf_files[0], fasta_file, expected_file
+    )
+    scoring_daemon = server.ScoringDaemon([model_config], fasta_file)
+    output_file = tmp_path / "out.tsv"
+    job = threading.Thread(
+        target=server.run_job,
+        args=(
+            scoring_daemon,
+            {"vcf_file": vcf_files[0], "output_file": str(output_file)},
+        ),
+    )
+    job.start()
+    while len(scoring_daemon.pending) < 2:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    # Only two of the four pieces of the job are queued
+    assert len(scoring_daemon.pending) == 2
+    scoring_daemon.start()
+    job.join()
+    scoring_daemon.close()
+    assert output_file.read_text() == expected_file.read_text()
+
+
+def test_scoring_daemon_closes_least_recently_used_fasta_files(
+    kipoi_model, inputs, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(server, "MAX_OPEN_FASTA_FILES", 1)
+    fasta_file, vcf_files = inputs
+    sequence = "".join(np.random.RandomState(2).choice(list("ACGT"), 1000))
+    other_fasta_file = tmp_path / "other.fa"
+    other_fasta_file.write_text(f">chr1\n{sequence}\n")
+    model_config = variant_centered.get_model_config("Basset")
+    scoring_daemon = server.ScoringDaemon([model_config], fasta_file)
+    scoring_daemon.start()
+    variants = list(variant_centered.get_variants(vcf_files[0]))
+    expected_scores = scoring_daemon.score(variants)[0]
+
+    def is_closed(extractor):
+        fasta = extractor["variant_extractor"].ref_seq_extractor.fasta
+        return fasta.faidx.file.closed
+
+    with scoring_daemon.use_extractor(fasta_file) as extractor:
+        scoring_daemon.score(variants, str(other_fasta_file))
+        # The extractor in use is evicted but only closed once released
+        assert list(scoring_daemon.extractors) == [str(other_fasta_file)]
+        assert not is_closed(extractor)
+    assert is_closed(extractor)
+    other_extractor = scoring_daemon.extractors[str(other_fasta_file)]
+    assert np.array_equal(scoring_daemon.score(variants)[0], expected_scores)
+    assert is_closed(other_extractor)
+    assert list(scoring_daemon.extractors) == [fasta_file]
+    scoring_daemon.close()
+    assert not scoring_daemon.extractors
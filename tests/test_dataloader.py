@@ -64,6 +64,37 @@ def test_variant_cenetered_dataloader_bigger_batch_size():
         )
 
 
+def test_variant_centered_crop_sequences():
+    test_dir = Path(__file__).resolve().parent
+    vcf_file = str(test_dir / "data" / "general" / "test.vcf")
+    fasta_file = str(test_dir / "data" / "general" / "hg38_chr22.fa")
+
+    for sequence_length in [5, 6]:
+        wide_batches = variant_centered.batch_dataloader(
+            vcf_file=vcf_file,
+            fasta_file=fasta_file,
+            sequence_length=10,
+            batch_size=20,
+        )
+        batches = variant_centered.batch_dataloader(
+            vcf_file=vcf_file,
+            fasta_file=fasta_file,
+            sequence_length=sequence_length,
+            batch_size=20,
+        )
+        for (wide_refs, wide_alts, _), (refs, alts, _) in zip(
+            wide_batches, batches
+        ):
+            assert (
+                variant_centered.crop_sequences(wide_refs, sequence_length)
+                == refs
+            )
+            assert (
+                variant_centered.crop_sequences(wide_alts, sequence_length)
+                == alts
+            )
+
+
 def test_interval_based_dataloader_missing_parameter():
     test_model_config = interval_based.INTERVAL_BASED_MODEL_CONFIGS[
         "MMSplice/deltaLogitPSI"
@@ -0,0 +1,88 @@
+from click.testing import CliRunner
+from kipoiseq.dataclasses import Interval
+from kipoiseq.extractors import FastaStringExtractor
+import pytest
+
+from kipoi_veff2 import genome
+from kipoi_veff2 import variant_centered
+
+
+@pytest.fixture
+def fasta_file(tmp_path):
+    fasta_file = tmp_path / "test.fa"
+    with open(fasta_file, "w") as fasta:
+        fasta.write(">chr1\nACGTACGTNN\nacgtACGTAC\nGT\n")
+        fasta.write(">chr2\nTTTTGGGGCC\nCCAA\n")
+    return fasta_file
+
+
+@pytest.fixture
+def vcf_file(tmp_path):
+    vcf_file = tmp_path / "test.vcf"
+    with open(vcf_file, "w") as vcf:
+        vcf.write("##fileformat=VCFv4.2\n")
+        vcf.write("##contig=<ID=chr1,length=22>\n")
+        vcf.write("##contig=<ID=chr2,length=14>\n")
+        vcf.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        vcf.write("chr1\t11\t.\tA\tG\t.\t.\t.\n")
+        vcf.write("chr1\t11\t.\tA\tT\t.\t.\t.\n")
+        vcf.write("chr1\t15\t.\tA\tACC\t.\t.\t.\n")
+        vcf.write("chr2\t6\t.\tGGG\tG\t.\t.\t.\n")
+    return vcf_file
+
+
+def test_genome_index_fetch(fasta_file):
+    genome.build_genome_index(fasta_file)
+    assert genome.GenomeIndex.is_available(fasta_file)
+    genome_index = genome.GenomeIndex(fasta_file)
+    fasta_extractor = FastaStringExtractor(str(fasta_file))
+    for chrom, start, end in [
+        ("chr1", 0, 10),
+        ("chr1", 5, 20),
+        ("chr1", 18, 30),
+        ("chr2", 3, 14),
+    ]:
+        interval = Interval(chrom, start, end)
+        assert genome_index.extract(interval) == fasta_extractor.extract(
+            interval
+        )
+    assert genome_index.fetch_windows(
+        ["chr1", "chr2", "chr1"], [8, 2, 18], 6
+    ) == ["NNacgt", "TTGGGG", "ACGT"]
+    with pytest.raises(ValueError):
+        genome_index.fetch_windows(["chr1"], [-1], 6)
+
+
+def test_genome_index_out_of_date(fasta_file):
+    genome.build_genome_index(fasta_file)
+    with open(fasta_file, "a") as fasta:
+        fasta.write(">chr3\nACGT\n")
+    with pytest.warns(UserWarning):
+        assert not genome.GenomeIndex.is_available(fasta_file)
+
+
+def test_variant_centered_dataloader_with_genome_index(fasta_file, vcf_file):
+    batches = list(
+        variant_centered.batch_dataloader(
+            vcf_file=str(vcf_file),
+            fasta_file=str(fasta_file),
+            sequence_length=8,
+            batch_size=3,
+        )
+    )
+    genome.build_genome_index(fasta_file)
+    batches_with_genome_index = list(
+        variant_centered.batch_dataloader(
+            vcf_file=str(vcf_file),
+            fasta_file=str(fasta_file),
+            sequence_length=8,
+            batch_size=3,
+        )
+    )
+    assert batches_with_genome_index == batches
+
+
+def test_genome_index_cli(fasta_file):
+    result = CliRunner().invoke(genome.index, [str(fasta_file)])
+    assert result.exit_code == 0
+    assert genome.GenomeIndex.is_available(fasta_file)
@@ -1,4 +1,5 @@
 import csv
+import os
 from pathlib import Path
 
 from kipoi_veff2 import interval_based
@@ -89,3 +90,133 @@ def test_interval_based_scoring(
         row = next(tsv_reader)
         assert row[2] == variant_exon_id
         assert len(row) == number_of_headers
+
+
+def test_interval_based_write_locality_sorted_vcf(tmp_path):
+    test_dir = Path(__file__).resolve().parent / "data" / "general"
+    sorted_vcf_file = tmp_path / "sorted.vcf"
+    interval_based.write_locality_sorted_vcf(
+        test_dir / "test.vcf", sorted_vcf_file, 4
+    )
+    with open(test_dir / "test.vcf", "r") as vcf:
+        records = [
+            line.rstrip("\n") for line in vcf if not line.startswith("#")
+        ]
+    with open(sorted_vcf_file, "r") as sorted_vcf:
+        sorted_records = [
+            line.rstrip("\n")
+            for line in sorted_vcf
+            if not line.startswith("#")
+        ]
+    assert sorted(sorted_records) == sorted(records)
+    for start in range(0, len(sorted_records), 4):
+        block = [
+            (record.split("\t")[0], int(record.split("\t")[1]))
+            for record in sorted_records[start : start + 4]
+        ]
+        assert block == sorted(block)
+
+
+def test_interval_based_restore_vcf_order():
+    test_dir = Path(__file__).resolve().parent / "data" / "general"
+    records = list(interval_based.VCF(str(test_dir / "test.vcf")))
+    # A duplicate record apart from the original
+    records = records[:1] + records[1:][::-1] + records[:1]
+
+    def get_record_rows(record):
+        return [
+            [record.CHROM, record.POS, f"exon_{exon}", record.REF, alt, exon]
+            for alt in record.ALT
+            for exon in range(2)
+        ]
+
+    rows = [
+        row
+        for record in sorted(
+            records, key=lambda record: (record.CHROM, record.POS)
+        )
+        for row in get_record_rows(record)
+    ]
+    unknown_row = ["chrZ", 1, "exon_0", "A", "C", 0]
+    restored_rows = interval_based.restore_vcf_order(
+        rows + [unknown_row], records
+    )
+    assert restored_rows == [
+        row for record in records for row in get_record_rows(record)
+    ] + [unknown_row]
+
+
+def test_interval_based_annotation_caching_dataloader():
+    class Dataloader:
+        calls = []
+
+        def __init__(self, gtf, vcf_file, overhang=(100, 100)):
+            self.vcf_file = vcf_file
+            self.pr_exons = self._read_exons(gtf, overhang)
+
+        def _read_exons(self, gtf, overhang=(100, 100)):
+            self.calls.append(gtf)
+            return {"gtf": gtf, "overhang": overhang}
+
+    dataloader_class = interval_based.get_annotation_caching_dataloader_class(
+        Dataloader
+    )
+    assert (
+        interval_based.get_annotation_caching_dataloader_class(Dataloader)
+        is dataloader_class
+    )
+    dataloaders = [
+        dataloader_class("a.gtf", f"chunk_{index}.vcf.gz")
+        for index in range(3)
+    ] + [dataloader_class("b.gtf", "chunk_3.vcf.gz")]
+    assert Dataloader.calls == ["a.gtf", "b.gtf"]
+    assert dataloaders[0].pr_exons is dataloaders[2].pr_exons
+    assert [dataloader.vcf_file for dataloader in dataloaders] == [
+        f"chunk_{index}.vcf.gz" for index in range(4)
+    ]
+    assert interval_based.get_annotation_caching_dataloader_class(dict) is dict
+
+
+def test_interval_based_write_vcf_chunks(tmp_path):
+    vcf_file = (
+        Path(__file__).resolve().parent / "data" / "general" / "test.vcf"
+    )
+    records = list(interval_based.VCF(str(vcf_file)))
+    chunks = list(
+        interval_based.write_vcf_chunks(vcf_file, iter(records), tmp_path, 3)
+    )
+    assert [chunk[1] for chunk in chunks] == [
+        len(records[start : start + 3]) for start in range(0, len(records), 3)
+    ]
+    with open(chunks[0][0], "rb") as chunk_handle:
+        assert chunk_handle.read(4) == b"\x1f\x8b\x08\x04"
+    assert [
+        str(record)
+        for chunk in chunks
+        for record in interval_based.VCF(chunk[0])
+    ] == [str(record) for record in records]
+
+
+def test_interval_based_score_chunks_in_process(tmp_path, monkeypatch):
+    vcf_file = (
+        Path(__file__).resolve().parent / "data" / "general" / "test.vcf"
+    )
+    records = list(interval_based.VCF(str(vcf_file)))
+    chunks = interval_based.write_vcf_chunks(
+        vcf_file, iter(records), tmp_path, 3
+    )
+    monkeypatch.setattr(
+        interval_based,
+        "score_chunk",
+        lambda model_config, fasta_file, gtf_file, chunk_file, sort: [
+            [record.CHROM, record.POS, os.getpid(), sort]
+            for record in interval_based.VCF(chunk_file)
+        ],
+    )
+    scored_chunks = list(
+        interval_based.score_chunks(None, "f", "g", chunks, sort=True)
+    )
+    assert [row for _, rows in scored_chunks for row in rows] == [
+        [record.CHROM, record.POS, os.getpid(), True] for record in records
+    ]
+    assert list(tmp_path.iterdir()) == []
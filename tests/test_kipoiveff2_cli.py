@@ -1,5 +1,8 @@
 from click.testing import CliRunner
 from pathlib import Path
+import subprocess
+import sys
+
 import pytest
 
 from kipoi_veff2 import cli
@@ -70,6 +73,92 @@ def test_cli_correct_use_multiple_scoring_function(runner, tmp_path):
     assert result.exit_code == 0
 
 
+def test_cli_correct_use_multiple_models(runner, tmp_path):
+    test_dir = Path(__file__).resolve().parent
+    output_file = tmp_path / "out.tsv"
+    result = runner.invoke(
+        cli.score_variants,
+        [
+            str(test_dir / "data" / "general" / "test.vcf"),
+            str(test_dir / "data" / "general" / "hg38_chr22.fa"),
+            str(output_file),
+            "-m",
+            "DeepSEA/predict",
+            "-m",
+            "pwm_HOCOMOCO/human/AHR",
+            "-s",
+            "diff",
+        ],
+    )
+    assert result.exit_code == 0
+    with open(output_file, "r") as output_file_handle:
+        header = output_file_handle.readline().rstrip("\n").split("\t")
+    assert len(header) == 925
+    assert header[-1] == "pwm_HOCOMOCO/human/AHR/1/diff"
+
+
+def test_cli_correct_use_multiple_models_output_per_model(runner, tmp_path):
+    test_dir = Path(__file__).resolve().parent
+    result = runner.invoke(
+        cli.score_variants,
+        [
+            str(test_dir / "data" / "general" / "test.vcf"),
+            str(test_dir / "data" / "general" / "hg38_chr22.fa"),
+            str(tmp_path / "out.tsv"),
+            "-m",
+            "DeepSEA/predict",
+            "-m",
+            "pwm_HOCOMOCO/human/AHR",
+            "--output-per-model",
+        ],
+    )
+    assert result.exit_code == 0
+    assert (tmp_path / "out.DeepSEA_predict.tsv").exists()
+    assert (tmp_path / "out.pwm_HOCOMOCO_human_AHR.tsv").exists()
+
+
+def test_cli_correct_use_workers(runner, tmp_path):
+    test_dir = Path(__file__).resolve().parent
+    output_files = []
+    for workers in ["1", "2"]:
+        output_file = tmp_path / f"out.{workers}.tsv"
+        result = runner.invoke(
+            cli.score_variants,
+            [
+                str(test_dir / "data" / "general" / "test.vcf"),
+                str(test_dir / "data" / "general" / "hg38_chr22.fa"),
+                str(output_file),
+                "-m",
+                "DeepSEA/predict",
+                "--workers",
+                workers,
+            ],
+        )
+        assert result.exit_code == 0
+        output_files.append(output_file)
+    assert output_files[0].read_text() == output_files[1].read_text()
+
+
+def test_cli_multiple_models_with_interval_based_model(runner, tmp_path):
+    test_dir = Path(__file__).resolve().parent
+    result = runner.invoke(
+        cli.score_variants,
+        [
+            str(test_dir / "data" / "general" / "test.vcf"),
+            str(test_dir / "data" / "general" / "hg38_chr22.fa"),
+            str(tmp_path / "out.tsv"),
+            "-m",
+            "DeepSEA/predict",
+            "-m",
+            "MMSplice/mtsplice",
+        ],
+    )
+    assert result.exit_code == 2
+    assert "Only variant centered models can be scored together" in (
+        result.output
+    )
+
+
 def test_cli_correct_use_different_flag(runner, tmp_path):
     test_dir = Path(__file__).resolve().parent
     result = runner.invoke(
@@ -244,3 +333,101 @@ def test_cli_no_seq_length(runner, tmp_path):
         ],
     )
     assert result.exit_code == 0
+
+
+# Importing kipoi_veff2.cli must take less than this many seconds
+IMPORT_TIME_BUDGET = 0.25
+HEAVY_MODULES = ["numpy", "pandas", "kipoi", "kipoiseq", "cyvcf2", "pyfaidx"]
+
+
+def run_python(code, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+
+def test_cli_import_time():
+    # The cumulative import time of a module is in microseconds
+    import_times = [
+        int(line.split("|")[1])
+        for line in run_python(
+            "import kipoi_veff2.cli", "-X", "importtime"
+        ).stderr.splitlines()
+        if line.endswith("| kipoi_veff2.cli")
+    ]
+    assert import_times[0] / 1e6 < IMPORT_TIME_BUDGET
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--help"],
+        ["missing.vcf", "missing.fa", "out.tsv", "-m", "Basset"],
+        ["{vcf}", "{fasta}", "out.tsv", "-m", "Unknown"],
+        ["{vcf}", "{fasta}", "out.tsv", "-m", "Basset", "-s", "diff", "-x"],
+        ["{vcf}", "{fasta}", "out.tsv", "-m", "Basset", "--region", "22"],
+        [
+            "{vcf}",
+            "{fasta}",
+            "out.tsv",
+            "-m",
+            "Basset",
+            "--float-format",
+            "%s\t",
+        ],
+    ],
+)
+def test_cli_validation_needs_no_heavy_imports(args):
+    test_dir = Path(__file__).resolve().parent / "data" / "general"
+    args = [
+        arg.format(vcf=test_dir / "test.vcf", fasta=test_dir / "hg38_chr22.fa")
+        for arg in args
+    ]
+    imported_modules = run_python(
+        f"""
+import sys
+from click.testing import CliRunner
+from kipoi_veff2 import cli
+CliRunner().invoke(cli.score_variants, {args!r})
+print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+    ).stdout.strip()
+    assert imported_modules == ""
+
+
+@pytest.mark.parametrize(
+    "option",
+    [
+        ["--prefetch-batches", "2"],
+        ["--pairs-per-batch", "2"],
+        ["--auto-batch-size"],
+        ["--memory-limit", "1024"],
+        ["--result-cache", "cache.sqlite"],
+        ["--result-cache-size", "1024"],
+    ],
+)
+def test_cli_variant_centered_options_with_interval_based_model(
+    runner, tmp_path, option
+):
+    # The options are rejected before the input files are read
+    (tmp_path / "in.vcf").touch()
+    (tmp_path / "in.fa").touch()
+    result = runner.invoke(
+        cli.score_variants,
+        [
+            str(tmp_path / "in.vcf"),
+            str(tmp_path / "in.fa"),
+            str(tmp_path / "out.tsv"),
+            "-m",
+            "MMSplice/mtsplice",
+            *option,
+        ],
+    )
+    assert result.exit_code == 2
+    assert f"{option[0]} can only be used with variant centered models" in (
+        " ".join(result.output.split())
+    )
@@ -91,3 +91,95 @@ def test_cli_single_input(runner, tmp_path):
         df_expected.columns.values.tolist()
         == df_generated.columns.values.tolist()
     )  # TODO: Should I add sorted here?
+
+
+def write_tsv(tsv_file, model, rows):
+    tsv_file.write_text(
+        f"#CHROM\tPOS\tID\tREF\tALT\t{model}/1\t{model}/2\r\n"
+        + "".join("\t".join(row) + "\r\n" for row in rows)
+    )
+    return str(tsv_file)
+
+
+VARIANTS = [
+    ["chr22", "21541590", "", "A", "T"],
+    ["chr22", "30630220", "rs1", "T", "G"],
+    ["chr1", "500", "", "TAG", "G"],
+]
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{}, {"block_size": 2, "max_open_files": 2, "workers": 2}]
+)
+def test_merge_tsvs_in_step(tmp_path, kwargs):
+    input_files = [
+        write_tsv(
+            tmp_path / f"out.{model}.tsv",
+            model,
+            [
+                variant + [f"{index}.5", f"-{index}.25"]
+                for index, variant in enumerate(VARIANTS)
+            ],
+        )
+        for model in ["a", "b", "c", "d", "e"]
+    ]
+    merged_file = tmp_path / "merged.tsv"
+    merge.merge_tsvs(input_files, merged_file, **kwargs)
+    assert merged_file.read_text() == (
+        "#CHROM\tPOS\tID\tREF\tALT"
+        + "".join(f"\t{model}/1\t{model}/2" for model in "abcde")
+        + "\n"
+        + "".join(
+            "\t".join(variant + [f"{index}.5", f"-{index}.25"] * 5) + "\n"
+            for index, variant in enumerate(VARIANTS)
+        )
+    )
+
+
+def test_merge_tsvs_in_different_order(tmp_path):
+    input_files = [
+        write_tsv(
+            tmp_path / "out.a.tsv",
+            "a",
+            [VARIANTS[0] + ["1", "2"], VARIANTS[2] + ["3", "4"]],
+        ),
+        write_tsv(
+            tmp_path / "out.b.tsv",
+            "b",
+            [
+                VARIANTS[1] + ["5", "6"],
+                VARIANTS[0] + ["7", "8"],
+                VARIANTS[0] + ["9", "10"],
+            ],
+        ),
+    ]
+    merged_file = tmp_path / "merged.tsv"
+    with pytest.warns(UserWarning):
+        merge.merge_tsvs(input_files, merged_file)
+    assert merged_file.read_text().splitlines() == [
+        "#CHROM\tPOS\tID\tREF\tALT\ta/1\ta/2\tb/1\tb/2",
+        "chr1\t500\t\tTAG\tG\t3\t4\t\t",
+        "chr22\t21541590\t\tA\tT\t1\t2\t7\t8",
+        "chr22\t21541590\t\tA\tT\t\t\t9\t10",
+        "chr22\t30630220\trs1\tT\tG\t\t\t5\t6",
+    ]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "merged.tsv",
+        "out.a.tsv",
+        "out.b.tsv",
+    ]
+
+
+def test_sort_tsv(tmp_path):
+    rows = [
+        ["chr2", str(position), "", "A", "T", str(index), "0"]
+        for index, position in enumerate([30, 4, 200, 4, 1])
+    ]
+    input_file = write_tsv(tmp_path / "out.tsv", "a", rows)
+    sorted_file = merge.sort_tsv(
+        input_file, tmp_path / "sorted.tsv", buffer_size=20
+    )
+    assert [
+        row.split("\t")[1:6:4]
+        for row in Path(sorted_file).read_text().splitlines()[1:]
+    ] == [["1", "4"], ["4", "1"], ["4", "3"], ["30", "0"], ["200", "2"]]
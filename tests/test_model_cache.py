@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+from types import SimpleNamespace
+
+import kipoi
+import pytest
+
+from kipoi_veff2 import model_cache
+
+
+def get_kipoi_description(model):
+    return SimpleNamespace(
+        schema=SimpleNamespace(
+            targets=SimpleNamespace(column_labels=("a", "b"), shape=(2,))
+        ),
+        default_dataloader=SimpleNamespace(
+            defined_as="kipoiseq.dataloaders.SeqIntervalDl",
+            default_args={"auto_resize_len": 100, "alphabet_axis": 1},
+        ),
+    )
+
+
+@pytest.fixture
+def loads(tmp_path, monkeypatch):
+    loads = {"descriptions": 0, "models": 0}
+
+    def get_model_descr(model):
+        loads["descriptions"] += 1
+        return get_kipoi_description(model)
+
+    def get_model(model, **kwargs):
+        loads["models"] += 1
+        return SimpleNamespace(
+            name=model, kwargs=kwargs, description=get_model_descr(model)
+        )
+
+    monkeypatch.setattr(kipoi, "get_model_descr", get_model_descr)
+    monkeypatch.setattr(kipoi, "get_model", get_model)
+    monkeypatch.setattr(model_cache, "_models", {})
+    monkeypatch.setattr(model_cache, "_kipoi_descriptions", {})
+    monkeypatch.setattr(model_cache, "_descriptions", {})
+    monkeypatch.setenv(model_cache.DESCRIPTION_DIR_VARIABLE, str(tmp_path))
+    return loads
+
+
+def test_get_model(loads):
+    model = model_cache.get_model("Basset")
+    assert model_cache.get_model("Basset") is model
+    assert model_cache.get_model("Basset", with_dataloader=True) is not model
+    assert loads["models"] == 2
+    assert model_cache.get_kipoi_model_description("Basset") is (
+        model.description
+    )
+    assert loads["descriptions"] == 2
+
+
+def get_model_in_child(queue):
+    model_cache.get_model("Basset")
+    queue.put(model_cache._models[("Basset", ())][0] == os.getpid())
+
+
+def test_get_model_forked(loads):
+    model_cache.get_model("Basset")
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=get_model_in_child, args=(queue,))
+    process.start()
+    # The child process loads its own model
+    assert queue.get(timeout=10)
+    process.join()
+    assert model_cache._models[("Basset", ())][0] == os.getpid()
+
+
+def test_get_model_description(loads, tmp_path, monkeypatch):
+    description = model_cache.get_model_description("DeepSEA/predict")
+    assert description.column_labels == ["a", "b"]
+    assert description.target_shape == [2]
+    assert description.default_dataloader.default_args == {
+        "auto_resize_len": 100,
+        "alphabet_axis": 1,
+    }
+    assert model_cache.get_model_description("DeepSEA/predict") is description
+    assert (tmp_path / "DeepSEA_predict.json").exists()
+    # A new process reads the description from disk
+    monkeypatch.setattr(model_cache, "_kipoi_descriptions", {})
+    monkeypatch.setattr(model_cache, "_descriptions", {})
+    assert model_cache.get_model_description("DeepSEA/predict") == description
+    assert loads["descriptions"] == 1
+    # A description cached by another version of kipoi is ignored
+    monkeypatch.setattr(model_cache, "_descriptions", {})
+    monkeypatch.setattr(kipoi, "__version__", "0.0.0")
+    assert model_cache.get_model_description("DeepSEA/predict") == description
+    assert loads["descriptions"] == 2
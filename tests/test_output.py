@@ -0,0 +1,138 @@
+import csv
+
+import numpy as np
+import pytest
+
+from kipoi_veff2 import output
+
+COLUMN_LABELS = ["#CHROM", "POS", "ID", "REF", "ALT", "model/1", "model/2"]
+VARIANT_COLUMNS = [
+    ["chr22", "chr22"],
+    [21541590, 30630220],
+    [None, "rs1"],
+    ["A", "TAG"],
+    ["T", "G"],
+]
+SCORES = np.array([[0.5, -1.25], [0.125, 2.0]], dtype=np.float32)
+
+
+def test_tsv_output(tmp_path):
+    output_file = tmp_path / "out.tsv"
+    tsv_output = output.get_output("tsv", output_file, COLUMN_LABELS)
+    tsv_output.write(VARIANT_COLUMNS, [SCORES[:, :1], SCORES[:, 1:]])
+    tsv_output.close()
+    assert output_file.read_text() == (
+        "#CHROM\tPOS\tID\tREF\tALT\tmodel/1\tmodel/2\n"
+        "chr22\t21541590\t\tA\tT\t0.5\t-1.25\n"
+        "chr22\t30630220\trs1\tTAG\tG\t0.125\t2.0\n"
+    )
+
+
+def test_tsv_output_append(tmp_path):
+    output_file = tmp_path / "out.tsv"
+    output_file.write_text("header\n")
+    tsv_output = output.get_output(
+        "tsv", output_file, COLUMN_LABELS, append=True
+    )
+    tsv_output.write(VARIANT_COLUMNS, [SCORES])
+    tsv_output.close()
+    assert output_file.read_text().splitlines()[:2] == [
+        "header",
+        "chr22\t21541590\t\tA\tT\t0.5\t-1.25",
+    ]
+
+
+def test_tsv_output_matches_csv_writer(tmp_path):
+    variant_columns = [
+        ["chr22", "chr22", "chr22"],
+        [1, 2, 3],
+        [None, 'rs"1"', "a\tb"],
+        ["A", "C", "G"],
+        ["T", "G", "A"],
+    ]
+    score_blocks = [
+        np.array(
+            [[0.1, np.nan], [-0.0, 1e20], [np.inf, 1e-45]], dtype=np.float32
+        ),
+        np.array([[0.1], [1 / 3], [-1e-5]], dtype=np.float64),
+    ]
+    expected_file = tmp_path / "expected.tsv"
+    with open(expected_file, "w") as expected_handle:
+        tsv_writer = csv.writer(expected_handle, delimiter="\t")
+        tsv_writer.writerow(COLUMN_LABELS)
+        for index, variant_row in enumerate(zip(*variant_columns)):
+            tsv_writer.writerow(
+                list(variant_row)
+                + [
+                    score
+                    for score_block in score_blocks
+                    for score in score_block[index]
+                ]
+            )
+    output_file = tmp_path / "out.tsv"
+    tsv_output = output.get_output("tsv", output_file, COLUMN_LABELS)
+    tsv_output.write(variant_columns, score_blocks)
+    tsv_output.close()
+    assert output_file.read_bytes() == expected_file.read_bytes()
+
+
+def test_tsv_output_with_float_format(tmp_path):
+    output_file = tmp_path / "out.tsv"
+    tsv_output = output.get_output(
+        "tsv", output_file, COLUMN_LABELS, float_format="%.2e"
+    )
+    tsv_output.write(VARIANT_COLUMNS, [SCORES[:, :1], SCORES[:, 1:]])
+    tsv_output.close()
+    assert output_file.read_text().splitlines()[1:] == [
+        "chr22\t21541590\t\tA\tT\t5.00e-01\t-1.25e+00",
+        "chr22\t30630220\trs1\tTAG\tG\t1.25e-01\t2.00e+00",
+    ]
+
+
+@pytest.mark.parametrize("float_format", ["%d %d", "%.2f\t", "6g"])
+def test_invalid_float_format(tmp_path, float_format):
+    with pytest.raises(ValueError):
+        output.get_output(
+            "tsv",
+            tmp_path / "out.tsv",
+            COLUMN_LABELS,
+            float_format=float_format,
+        )
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_columnar_output(tmp_path, output_format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    output_file = tmp_path / f"out.{output_format}"
+    columnar_output = output.get_output(
+        output_format, output_file, COLUMN_LABELS
+    )
+    columnar_output.write(VARIANT_COLUMNS, [SCORES])
+    columnar_output.write(VARIANT_COLUMNS, [SCORES])
+    columnar_output.close()
+    if output_format == "parquet":
+        parquet_file = pyarrow.parquet.ParquetFile(str(output_file))
+        assert parquet_file.num_row_groups == 2
+        table = parquet_file.read()
+    else:
+        table = pyarrow.ipc.open_file(str(output_file)).read_all()
+    assert table.column_names == COLUMN_LABELS
+    assert table.schema.field("POS").type == pa.int64()
+    assert table.schema.field("model/1").type == pa.float32()
+    assert table.column("ID").to_pylist() == [None, "rs1", None, "rs1"]
+    assert table.column("model/2").to_pylist() == [-1.25, 2.0, -1.25, 2.0]
+
+
+def test_invalid_output_format(tmp_path):
+    with pytest.raises(ValueError):
+        output.get_output("csv", tmp_path / "out.csv", COLUMN_LABELS)
+
+
+def test_append_columnar_output(tmp_path):
+    with pytest.raises(ValueError):
+        output.get_output(
+            "parquet", tmp_path / "out.parquet", COLUMN_LABELS, append=True
+        )
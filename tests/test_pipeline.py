@@ -0,0 +1,71 @@
+import multiprocessing
+
+import pytest
+
+from kipoi_veff2.pipeline import BackgroundWriter, imap_ordered, prefetch
+
+
+def test_prefetch_keeps_order():
+    assert list(prefetch(iter(range(100)), 3)) == list(range(100))
+
+
+def test_prefetch_raises_error():
+    def produce():
+        yield 1
+        raise ValueError("Failed to read the vcf file")
+
+    items = prefetch(produce(), 2)
+    assert next(items) == 1
+    with pytest.raises(ValueError) as error_msg:
+        next(items)
+    assert str(error_msg.value) == "Failed to read the vcf file"
+
+
+def test_prefetch_consumer_stops_early():
+    items = prefetch(iter(range(100)), 2)
+    assert next(items) == 0
+    items.close()
+
+
+def test_background_writer_keeps_order():
+    written = []
+    with BackgroundWriter(2) as writer:
+        for index in range(100):
+            writer.submit(written.append, index)
+    assert written == list(range(100))
+
+
+def test_background_writer_raises_error():
+    def write(index):
+        raise ValueError(f"Failed to write {index}")
+
+    with pytest.raises(ValueError) as error_msg:
+        with BackgroundWriter(2) as writer:
+            writer.submit(write, 0)
+    assert str(error_msg.value) == "Failed to write 0"
+
+
+def test_imap_ordered_keeps_order():
+    with multiprocessing.get_context("fork").Pool(3) as pool:
+        results = list(
+            imap_ordered(
+                pool,
+                pow,
+                ((index, (index, 2)) for index in range(50)),
+                4,
+            )
+        )
+    assert results == [(index, index**2) for index in range(50)]
+
+
+def test_imap_ordered_raises_error():
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        with pytest.raises(ZeroDivisionError):
+            list(
+                imap_ordered(
+                    pool,
+                    divmod,
+                    ((index, (1, 1 - index)) for index in range(3)),
+                    2,
+                )
+            )
@@ -0,0 +1,81 @@
+import json
+import multiprocessing
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from kipoi_veff2 import merge
+from kipoi_veff2 import profiling
+
+
+def test_profiler():
+    profiler = profiling.Profiler()
+    for _ in range(3):
+        profiler.next_batch()
+        for _ in range(2):
+            with profiler.stage("prediction"):
+                sum(range(10000))
+    with profiler.stage("writing"):
+        pass
+    profile = profiler.to_dict()
+    assert profile["batches"] == 3
+    assert profile["stages"]["prediction"]["calls"] == 6
+    assert profile["stages"]["prediction"]["batches"] == 3
+    assert profile["stages"]["prediction"]["seconds"] > 0
+    assert profile["stages"]["writing"]["batches"] == 1
+    table = profiling.format_table(profile)
+    assert table.splitlines()[1].startswith("prediction")
+    assert table.splitlines()[-1].startswith("total")
+
+
+def test_profiling_disabled():
+    assert profiling.get_profiler() is None
+    assert profiling.stage("prediction") is profiling.NULL_STAGE
+    items = [1, 2, 3]
+    assert list(profiling.iterate("vcf_parse", items)) == items
+    assert profiling.run_in_worker(sum, items) == (6, None)
+
+
+def double_in_worker(number):
+    with profiling.stage("doubling"):
+        return 2 * number
+
+
+def test_profiling_workers():
+    profiler = profiling.enable()
+    try:
+        assert list(profiling.iterate("vcf_parse", range(4))) == list(range(4))
+        with multiprocessing.get_context("fork").Pool(2) as pool:
+            results = profiling.starmap(
+                pool, double_in_worker, [(number,) for number in range(5)]
+            )
+    finally:
+        profiling.disable()
+    assert results == [0, 2, 4, 6, 8]
+    assert profiler.stages["vcf_parse"].calls == 5
+    assert profiler.stages["vcf_parse"].batches == 4
+    # The stages of the worker processes are merged into the profile
+    assert profiler.stages["doubling"].calls == 5
+
+
+def test_cli_merge_profile(tmp_path):
+    test_dir = Path(__file__).resolve().parent / "data" / "general"
+    merged_file_path = tmp_path / "merged.tsv"
+    result = CliRunner().invoke(
+        merge.merge,
+        [
+            str(test_dir / "out.Basset.tsv"),
+            str(test_dir / "out.DeepSEA.predict.tsv"),
+            str(merged_file_path),
+            "--profile",
+        ],
+    )
+    assert result.exit_code == 0
+    assert profiling.get_profiler() is None
+    with open(
+        profiling.get_profile_file(merged_file_path), "r"
+    ) as profile_json:
+        profile = json.load(profile_json)
+    assert profile["batches"] > 0
+    assert {"read", "write"} <= set(profile["stages"])
+    assert "total" in result.stderr
@@ -0,0 +1,94 @@
+from pathlib import Path
+import pytest
+
+from kipoiseq.dataclasses import Interval
+from kipoi_veff2 import regions
+
+
+def test_parse_region():
+    assert regions.parse_region("chr22:30,630,220-30630701") == Interval(
+        "chr22", 30630219, 30630701
+    )
+
+
+@pytest.mark.parametrize("region", ["chr22", "chr22:10-5", "chr22:0-5"])
+def test_parse_invalid_region(region):
+    with pytest.raises(ValueError):
+        regions.parse_region(region)
+
+
+@pytest.mark.parametrize("shard", ["0/4", "5/4", "1-4", "a/4"])
+def test_parse_invalid_shard(shard):
+    with pytest.raises(ValueError):
+        regions.parse_shard(shard)
+
+
+def test_shard_regions_cover_genome():
+    contig_lengths = {"chr1": 30, "chr2": 7, "chr3": 13}
+    covered = []
+    for shard in range(1, 5):
+        for region in regions.get_shard_regions(contig_lengths, shard, 4):
+            covered += [
+                (region.chrom, position)
+                for position in range(region.start, region.end)
+            ]
+    assert covered == [
+        (chrom, position)
+        for chrom, length in contig_lengths.items()
+        for position in range(length)
+    ]
+
+
+def test_read_records_within_regions():
+    vcf_file = str(
+        Path(__file__).resolve().parent / "data" / "general" / "test.vcf.gz"
+    )
+    records = regions.read_records(
+        vcf_file,
+        [
+            regions.parse_region("chr22:30630220-30630701"),
+            regions.parse_region("chr22:21541590-21541590"),
+        ],
+    )
+    assert [(record.POS, record.REF) for record in records] == [
+        (30630220, "T"),
+        (30630220, "TAG"),
+        (30630220, "T"),
+        (30630220, "."),
+        (30630701, "A"),
+        (21541590, "A"),
+    ]
+
+
+def test_read_records_without_index():
+    vcf_file = str(
+        Path(__file__).resolve().parent / "data" / "general" / "test.vcf"
+    )
+    with pytest.raises(ValueError):
+        list(
+            regions.read_records(
+                vcf_file, [regions.parse_region("chr22:1-100")]
+            )
+        )
+
+
+def test_shards_cover_contigs_missing_from_fasta(tmp_path):
+    vcf_file = str(
+        Path(__file__).resolve().parent / "data" / "general" / "test.vcf.gz"
+    )
+    fasta_file = tmp_path / "genome.fa"
+    fasta_file.write_text(">chr1\nACGTACGTAC\n")
+    with pytest.warns(UserWarning, match="chr22"):
+        contig_lengths = regions.get_shard_contig_lengths(fasta_file, vcf_file)
+    assert list(contig_lengths) == ["chr1", "chr22"]
+    sharded_records = [
+        (record.CHROM, record.POS, record.REF, record.ALT)
+        for shard in range(1, 5)
+        for record in regions.read_records(
+            vcf_file, regions.get_shard_regions(contig_lengths, shard, 4)
+        )
+    ]
+    assert sharded_records == [
+        (record.CHROM, record.POS, record.REF, record.ALT)
+        for record in regions.read_records(vcf_file)
+    ]
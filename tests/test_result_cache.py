@@ -0,0 +1,134 @@
+import multiprocessing
+from types import SimpleNamespace
+
+import numpy as np
+
+from kipoi_veff2 import result_cache
+from kipoi_veff2 import scores
+from kipoi_veff2 import variant_centered
+
+
+def get_scores(number_of_rows, seed=0):
+    return (
+        np.random.RandomState(seed)
+        .normal(size=(number_of_rows, 8))
+        .astype(np.float32)
+    )
+
+
+def test_result_cache(tmp_path):
+    cache = result_cache.ResultCache(tmp_path / "cache.sqlite")
+    model_key = result_cache.get_model_key("Basset", "0.1", 600, ["diff"])
+    keys = result_cache.get_keys(model_key, ["AAC", "AAC"], ["AGC", "ATC"])
+    assert keys[0] != keys[1]
+    assert keys[0] != result_cache.get_keys(
+        result_cache.get_model_key("Basset", "0.2", 600, ["diff"]),
+        ["AAC"],
+        ["AGC"],
+    )
+    assert cache.get(keys) == {}
+    cached_scores = get_scores(2)
+    cache.put(keys, cached_scores)
+    cached_rows = cache.get(keys[::-1])
+    assert cached_rows[keys[0]].dtype == np.float32
+    assert np.array_equal(cached_rows[keys[0]], cached_scores[0])
+    assert np.array_equal(cached_rows[keys[1]], cached_scores[1])
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_result_cache_eviction(tmp_path):
+    cache = result_cache.ResultCache(tmp_path / "cache.sqlite", 2**16)
+    model_key = result_cache.get_model_key("Basset", None, 600, ["diff"])
+    first_keys = result_cache.get_keys(model_key, ["A"] * 10, list("ACGTN"))
+    cache.put(first_keys, get_scores(len(first_keys)))
+    for batch in range(100):
+        keys = result_cache.get_keys(
+            model_key, [str(batch)] * 100, [str(alt) for alt in range(100)]
+        )
+        cache.put(keys, get_scores(100, batch))
+        # The first scores are used all the time
+        assert len(cache.get(first_keys)) == len(set(first_keys))
+    assert cache.get_size(cache.connect()) <= 2**16
+    assert len(cache.get(keys)) == 100
+
+
+def put_in_child(cache, batch):
+    model_key = result_cache.get_model_key("Basset", None, 600, ["diff"])
+    for chunk in range(10):
+        keys = result_cache.get_keys(
+            model_key,
+            [f"{batch}/{chunk}"] * 10,
+            [str(alt) for alt in range(10)],
+        )
+        cache.put(keys, get_scores(10, batch))
+
+
+def test_result_cache_shared_by_processes(tmp_path):
+    cache = result_cache.ResultCache(tmp_path / "cache.sqlite")
+    # The connection of the parent is not used by the children
+    cache.get([b"key"])
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=put_in_child, args=(cache, batch))
+        for batch in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    (count,) = (
+        cache.connect().execute("SELECT COUNT(*) FROM scores").fetchone()
+    )
+    assert count == 4 * 10 * 10
+
+
+class CountingModel:
+    """A model whose predictions are the sums of the one hot encoded
+    sequences per position and which records its batches"""
+
+    def __init__(self):
+        self.batch_lengths = []
+
+    def predict_on_batch(self, batch):
+        self.batch_lengths.append(len(batch))
+        return batch.sum(axis=2) * np.arange(batch.shape[1])
+
+
+def test_variant_centered_get_cached_model_scores(tmp_path):
+    kipoi_model = CountingModel()
+    model = {
+        "config": SimpleNamespace(model="stub", batch_size=100),
+        "kipoi_model": kipoi_model,
+        "transform": variant_centered.BatchOneHot(),
+        "scoring_functions": [{"name": "diff", "func": scores.diff}],
+        "result_cache": result_cache.ResultCache(tmp_path / "cache.sqlite"),
+        "result_cache_key": result_cache.get_model_key(
+            "stub", None, 5, ["diff"]
+        ),
+    }
+    refs = ["ACGTA", "TTGCA"]
+    alts = ["ACTTA", "ACCTA", "TTACA"]
+    ref_inverse = np.array([0, 0, 1])
+    snv_bases = ["T", "C", "A"]
+    expected_scores = variant_centered.get_model_scores(
+        model, refs, alts, ref_inverse, snv_bases
+    )
+    kipoi_model.batch_lengths.clear()
+    # Only the first alternative sequence is inferred
+    model_scores = variant_centered.get_cached_model_scores(
+        model, refs, alts[:1], ref_inverse[:1], snv_bases[:1]
+    )
+    assert np.array_equal(model_scores, expected_scores[:1])
+    assert kipoi_model.batch_lengths == [1, 1]
+    # Only the missing alternative sequences are inferred
+    model_scores = variant_centered.get_cached_model_scores(
+        model, refs, alts, ref_inverse, snv_bases
+    )
+    assert np.array_equal(model_scores, expected_scores)
+    assert kipoi_model.batch_lengths == [1, 1, 2, 2]
+    model_scores = variant_centered.get_cached_model_scores(
+        model, refs, alts, ref_inverse, snv_bases
+    )
+    assert np.array_equal(model_scores, expected_scores)
+    assert kipoi_model.batch_lengths == [1, 1, 2, 2]
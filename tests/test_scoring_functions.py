@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 from scipy.special import logit
 
 from kipoi_veff2 import scores
@@ -90,3 +91,97 @@ def test_deepseaeffect_single():
             * np.abs(alt_pred - ref_pred)
         )
     )
+
+
+def get_individual_scores(ref_pred, alt_pred, funcs):
+    return np.concatenate(
+        [scores.as_score_matrix(func(ref_pred, alt_pred)) for func in funcs],
+        axis=1,
+    ).astype(np.float32)
+
+
+def test_compute_scores():
+    rng = np.random.default_rng(0)
+    ref_pred = rng.uniform(size=(10, 3)).astype(np.float32)
+    alt_pred = rng.uniform(size=(10, 3)).astype(np.float32)
+    funcs = [
+        scores.logit,
+        scores.diff,
+        scores.deepsea_effect,
+        scores.ref,
+        scores.alt,
+        scores.logit_ref,
+        scores.logit_alt,
+        lambda ref_pred, alt_pred: (alt_pred > ref_pred).sum(axis=1),
+    ]
+    fused_scores = scores.compute_scores(
+        ref_pred, alt_pred, [{"func": func} for func in funcs]
+    )
+    individual_scores = get_individual_scores(ref_pred, alt_pred, funcs)
+    assert fused_scores.dtype == np.float32
+    assert fused_scores.tobytes() == individual_scores.tobytes()
+
+
+class UnhashableScoringFunction:
+    __hash__ = None
+
+    def __eq__(self, other):
+        raise TypeError("Scoring functions are not comparable")
+
+    def __call__(self, ref_pred, alt_pred):
+        return alt_pred.max(axis=1)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_compute_scores_deepsea(dtype):
+    # Scores of float64 predictions are computed in float64 and only
+    # rounded to float32 once
+    rng = np.random.default_rng(1)
+    ref_pred = rng.uniform(size=(64, 919)).astype(dtype)
+    alt_pred = rng.uniform(size=(64, 919)).astype(dtype)
+    funcs = [
+        scores.diff,
+        UnhashableScoringFunction(),
+        scores.logit,
+        scores.deepsea_effect,
+    ]
+    fused_scores = scores.compute_scores(
+        ref_pred, alt_pred, [{"func": func} for func in funcs]
+    )
+    individual_scores = get_individual_scores(ref_pred, alt_pred, funcs)
+    assert fused_scores.dtype == np.float32
+    assert fused_scores.tobytes() == individual_scores.tobytes()
+
+
+@pytest.mark.parametrize(
+    "ref_pred, alt_pred",
+    [
+        (np.array(0.8), np.array(0.4)),
+        (np.array([0.1, 0.2, 0.3]), np.array([0.2, 0.25, 0.5])),
+        (
+            np.array([[0.1, 0.2, 0.3]], dtype=np.float32),
+            np.array([[0.2, 0.25, 0.5]], dtype=np.float32),
+        ),
+    ],
+)
+def test_compute_scores_single(ref_pred, alt_pred):
+    funcs = [scores.diff, scores.deepsea_effect]
+    fused_scores = scores.compute_scores(
+        ref_pred, alt_pred, [{"func": func} for func in funcs]
+    )
+    assert (
+        fused_scores.tobytes()
+        == get_individual_scores(ref_pred, alt_pred, funcs).tobytes()
+    )
+
+
+def test_compute_scores_warns_once():
+    ref_pred = np.array([[0.1, 2.0]])
+    alt_pred = np.array([[0.2, 0.5]])
+    with pytest.warns(UserWarning) as record:
+        scores.compute_scores(
+            ref_pred,
+            alt_pred,
+            [{"func": scores.logit}, {"func": scores.deepsea_effect}],
+        )
+    assert len([item for item in record if item.category is UserWarning]) == 1
@@ -0,0 +1,115 @@
+from pathlib import Path
+
+from click.testing import CliRunner
+import pytest
+
+from kipoi_veff2 import merge
+from kipoi_veff2 import store
+
+VARIANTS = [
+    ["chr22", "21541590", "", "A", "T"],
+    ["chr22", "30630220", "rs1", "T", "G"],
+    ["chr1", "500", "", "TAG", "G"],
+]
+
+
+def write_tsv(tsv_file, model, variants=VARIANTS):
+    tsv_file.write_text(
+        f"#CHROM\tPOS\tID\tREF\tALT\t{model}/1\t{model}/2\r\n"
+        + "".join(
+            "\t".join(variant + [f"{index}.5", f"-{index}.25"]) + "\r\n"
+            for index, variant in enumerate(variants)
+        )
+    )
+    return str(tsv_file)
+
+
+@pytest.fixture
+def input_files(tmp_path):
+    return [
+        write_tsv(tmp_path / f"out.{model}.tsv", model)
+        for model in ["a", "b", "c", "d", "e"]
+    ]
+
+
+def test_append_compact_and_export(tmp_path, input_files):
+    store_dir = tmp_path / "store"
+    for input_file in input_files[:3]:
+        store.append_to_store(store_dir, input_file, block_size=2)
+    store.compact_store(store_dir, max_open_files=2)
+    for input_file in input_files[3:]:
+        store.append_to_store(store_dir, input_file)
+    assert sorted(path.name for path in (store_dir / "scores").iterdir()) == [
+        "compacted.0.tsv",
+        store.get_score_file_name(["d/1", "d/2"]),
+        store.get_score_file_name(["e/1", "e/2"]),
+    ]
+    exported_file = tmp_path / "exported.tsv"
+    store.export_store(store_dir, exported_file)
+    merged_file = tmp_path / "merged.tsv"
+    merge.merge_tsvs(input_files, merged_file)
+    assert exported_file.read_text() == merged_file.read_text()
+
+
+def test_append_different_variants(tmp_path, input_files):
+    store_dir = tmp_path / "store"
+    store.append_to_store(store_dir, input_files[0])
+    for variants in [VARIANTS[::-1], VARIANTS[:2], VARIANTS + VARIANTS[:1]]:
+        with pytest.raises(ValueError):
+            store.append_to_store(
+                store_dir, write_tsv(tmp_path / "out.f.tsv", "f", variants)
+            )
+    score_file_name = store.get_score_file_name(["a/1", "a/2"])
+    assert store.read_manifest(store_dir)["score_files"] == [score_file_name]
+    assert sorted(path.name for path in (store_dir / "scores").iterdir()) == [
+        score_file_name
+    ]
+
+
+def test_append_twice(tmp_path, input_files):
+    store_dir = tmp_path / "store"
+    store.append_to_store(store_dir, input_files[0])
+    with pytest.raises(ValueError):
+        store.append_to_store(store_dir, input_files[0])
+
+
+def test_append_same_first_score_column(tmp_path, input_files):
+    store_dir = tmp_path / "store"
+    store.append_to_store(store_dir, input_files[0])
+    other_file = tmp_path / "out.other.tsv"
+    other_file.write_text(
+        Path(input_files[0]).read_text().replace("a/2", "f/2", 1)
+    )
+    store.append_to_store(store_dir, other_file)
+    assert len(set(store.read_manifest(store_dir)["score_files"])) == 2
+    exported_file = tmp_path / "exported.tsv"
+    store.export_store(store_dir, exported_file)
+    assert exported_file.read_text().splitlines()[0].split("\t")[5:] == [
+        "a/1",
+        "a/2",
+        "a/1",
+        "f/2",
+    ]
+
+
+def test_cli_store(tmp_path, input_files):
+    runner = CliRunner()
+    store_dir = tmp_path / "store"
+    result = runner.invoke(
+        store.store, ["append", str(store_dir)] + input_files
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(store.store, ["compact", str(store_dir)])
+    assert result.exit_code == 0
+    exported_file = tmp_path / "exported.tsv"
+    result = runner.invoke(
+        store.store, ["export", str(store_dir), str(exported_file)]
+    )
+    assert result.exit_code == 0
+    assert Path(exported_file).read_text().splitlines()[1] == "\t".join(
+        VARIANTS[0] + ["0.5", "-0.25"] * 5
+    )
+    result = runner.invoke(
+        store.store, ["append", str(store_dir), input_files[0]]
+    )
+    assert result.exit_code == 1
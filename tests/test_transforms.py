@@ -0,0 +1,81 @@
+import numpy as np
+from kipoiseq.transforms import ReorderedOneHot
+import pytest
+
+from kipoi_veff2 import transforms
+
+
+@pytest.mark.parametrize(
+    "dtype, alphabet_axis, dummy_axis",
+    [
+        (None, 1, None),
+        ("np.float32", 0, None),
+        ("np.float32", 0, 1),
+        (None, 1, 0),
+        (None, 2, 0),
+        (None, 0, 2),
+        (None, 1, 2),
+    ],
+)
+def test_batch_one_hot_matches_reordered_one_hot(
+    dtype, alphabet_axis, dummy_axis
+):
+    sequences = ["TGGTGATTTT", "CTGTGCTCAA", "CACCNAGGCC", "acgtnAcGtN"]
+    transform = ReorderedOneHot(
+        alphabet="ACGT",
+        dtype=dtype,
+        alphabet_axis=alphabet_axis,
+        dummy_axis=dummy_axis,
+    )
+    batch_transform = transforms.BatchOneHot(
+        alphabet="ACGT",
+        dtype=dtype,
+        alphabet_axis=alphabet_axis,
+        dummy_axis=dummy_axis,
+    )
+    expected = np.stack([transform(sequence) for sequence in sequences])
+    batch = batch_transform(sequences)
+    assert batch.shape == expected.shape
+    assert batch.dtype == expected.dtype
+    assert np.array_equal(batch, expected)
+
+
+def test_batch_one_hot_lower_case_and_neutral():
+    batch_transform = transforms.BatchOneHot(alphabet="ACGT")
+    batch = batch_transform(["acgtn", "ACGTN"])
+    # Lower case bases of soft masked genomes are encoded as zeros
+    assert np.all(batch[0] == 0)
+    assert np.array_equal(batch[1][:4], np.eye(4))
+    assert np.all(batch[1][4] == 0.25)
+
+
+def test_batch_one_hot_unequal_length():
+    batch_transform = transforms.BatchOneHot(alphabet="ACGT")
+    with pytest.raises(ValueError) as error_msg:
+        batch_transform(["ACGT", "ACG"])
+    assert (
+        str(error_msg.value)
+        == "All sequences in a batch must be of equal length"
+    )
+
+
+def test_stacked_transform():
+    transform = ReorderedOneHot(alphabet="ACGT")
+    batch = transforms.StackedTransform(transform)(["ACGT", "TTTT"])
+    assert batch.shape == (2, 4, 4)
+    assert np.array_equal(batch[1], transform("TTTT"))
+
+
+@pytest.mark.parametrize(
+    "alphabet_axis, dummy_axis",
+    [(1, None), (0, None), (0, 1), (1, 0), (2, 0)],
+)
+def test_batch_one_hot_set_bases(alphabet_axis, dummy_axis):
+    batch_transform = transforms.BatchOneHot(
+        alphabet="ACGT", alphabet_axis=alphabet_axis, dummy_axis=dummy_axis
+    )
+    batch = batch_transform(["TGGTGATTTT", "CTGTGCTCAA", "CACCAAGGCC"])
+    batch_transform.set_bases(batch, [0, 2], 4, ["T", "G"])
+    assert np.array_equal(
+        batch, batch_transform(["TGGTTATTTT", "CTGTGCTCAA", "CACCGAGGCC"])
+    )
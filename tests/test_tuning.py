@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from kipoi_veff2 import tuning
+from kipoi_veff2.transforms import BatchOneHot
+
+
+class MemoryModel:
+    """A model whose memory grows with the largest batch it inferred with"""
+
+    def __init__(self):
+        self.largest_batch = 0
+
+    def predict_on_batch(self, batch):
+        self.largest_batch = max(self.largest_batch, len(batch))
+        return batch.mean(axis=(1, 2))
+
+
+@pytest.fixture
+def model(monkeypatch):
+    memory_model = MemoryModel()
+    monkeypatch.setattr(
+        tuning,
+        "get_peak_memory",
+        lambda: 1000 + 10 * memory_model.largest_batch,
+    )
+    return memory_model
+
+
+def test_tune_batch_size(model):
+    profile = tuning.tune_batch_size(
+        model,
+        BatchOneHot(),
+        20,
+        memory_limit=10000,
+        batch_sizes=[16, 32, 64, 128, 256, 512, 1024],
+        min_probe_time=0.01,
+    )
+    assert profile["sequence_length"] == 20
+    assert [
+        measurement["batch_size"] for measurement in profile["measurements"]
+    ] == [16, 32, 64, 128, 256, 512][: len(profile["measurements"])]
+    # 1024 sequences would need 11240 bytes of memory
+    assert model.largest_batch <= 512
+    assert profile["batch_size"] in [16, 32, 64, 128, 256, 512]
+
+
+def test_tune_batch_size_memory_limit_too_low(model):
+    with pytest.warns(UserWarning):
+        profile = tuning.tune_batch_size(
+            model,
+            BatchOneHot(),
+            20,
+            memory_limit=100,
+            batch_sizes=[16, 32],
+            min_probe_time=0.01,
+        )
+    assert profile["batch_size"] == 16
+    assert profile["measurements"] == []
+
+
+def test_tuning_profile(tmp_path, monkeypatch):
+    monkeypatch.setenv(tuning.TUNING_DIR_VARIABLE, str(tmp_path))
+    assert tuning.load_tuned_batch_size("DeepSEA/predict", 1000) is None
+    tuning.save_tuning_profile(
+        "DeepSEA/predict",
+        {
+            "version": tuning.TUNING_PROFILE_VERSION,
+            "sequence_length": 1000,
+            "batch_size": 256,
+        },
+    )
+    assert tuning.get_tuning_profile_file("DeepSEA/predict").parent.parent == (
+        tmp_path
+    )
+    assert tuning.load_tuned_batch_size("DeepSEA/predict", 1000) == 256
+    assert tuning.load_tuned_batch_size("DeepSEA/predict", 500) is None
+    assert list(tmp_path.rglob("*.tmp")) == []
+
+
+@pytest.mark.parametrize("text", ["", '{"version": 1, "sequence', "[1, 2]"])
+def test_tuning_profile_corrupt(tmp_path, monkeypatch, text):
+    monkeypatch.setenv(tuning.TUNING_DIR_VARIABLE, str(tmp_path))
+    profile_file = tuning.get_tuning_profile_file("DeepSEA/predict")
+    profile_file.parent.mkdir(parents=True)
+    profile_file.write_text(text)
+    assert tuning.load_tuned_batch_size("DeepSEA/predict", 1000) is None
+
+
+def test_get_random_sequences():
+    sequences = tuning.get_random_sequences(3, 7)
+    assert len(sequences) == 3
+    assert all(len(sequence) == 7 for sequence in sequences)
+    assert set("".join(sequences)) <= set("ACGT")
+    assert np.all(BatchOneHot()(sequences).sum(axis=2) == 1)
@@ -1,6 +1,10 @@
 import csv
 from pathlib import Path
+from types import SimpleNamespace
 
+from kipoiseq.dataclasses import Variant
+import numpy as np
+import pandas as pd
 from kipoi_veff2 import variant_centered
 from kipoi_veff2 import scores
 
@@ -18,6 +22,8 @@ def test_variant_centered_modelconfig_batchsize():
     )
     assert test_model_config.model == "Basenji"
     assert test_model_config.batch_size == 1
+    assert test_model_config.pairs_per_batch == 4
+    assert test_model_config.get_variants_per_batch() == 4
 
 
 def test_variant_centered_modelconfig():
@@ -214,3 +220,252 @@ def test_variant_centered_scoring_multiple_scoring_functions(
         row = next(tsv_reader)
         assert row[2] == ""
         assert len(row) == number_of_headers
+
+
+def test_variant_centered_get_unique_indices():
+    keys = [
+        ("chr22", 30630220, "A", "G"),
+        ("chr22", 30630220, "A", "C"),
+        ("chr22", 30630220, "A", "G"),
+        ("chr22", 21541590, "A", "T"),
+    ]
+    unique_indices, inverse = variant_centered.get_unique_indices(keys)
+    assert unique_indices == [0, 1, 3]
+    assert inverse.tolist() == [0, 1, 0, 2]
+    assert [keys[unique_indices[index]] for index in inverse] == keys
+
+
+def test_variant_centered_get_locality_order():
+    variants = [
+        Variant(chrom="chr2", pos=10, ref="A", alt="T"),
+        Variant(chrom="chr1", pos=30, ref="A", alt="T"),
+        Variant(chrom="chr1", pos=20, ref="A", alt="G"),
+        Variant(chrom="chr2", pos=5, ref="A", alt="T"),
+        Variant(chrom="chr1", pos=20, ref="A", alt="C"),
+    ]
+    assert variant_centered.get_locality_order(variants) == [2, 4, 1, 3, 0]
+
+
+def test_variant_centered_scoring_resume(tmp_path, monkeypatch):
+    test_dir = Path(__file__).resolve().parent
+    vcf_file = str(test_dir / "data" / "general" / "test.vcf")
+    fasta_file = str(test_dir / "data" / "general" / "hg38_chr22.fa")
+    model_config = variant_centered.get_model_config(
+        "DeepSEA/predict", batch_size=2
+    )
+    expected_output_file = tmp_path / "expected.tsv"
+    variant_centered.score_variants(
+        model_config, vcf_file, fasta_file, expected_output_file
+    )
+
+    write_rows = variant_centered.write_rows
+    written_batches = []
+
+    def preempted_write_rows(outputs, variants, model_scores):
+        if len(written_batches) == 2:
+            outputs[0].handle.write("chr22\ttorn")
+            raise RuntimeError("Preempted")
+        written_batches.append(variants)
+        write_rows(outputs, variants, model_scores)
+
+    output_file = tmp_path / "out.tsv"
+    monkeypatch.setattr(variant_centered, "write_rows", preempted_write_rows)
+    with pytest.raises(RuntimeError):
+        variant_centered.score_variants(
+            model_config,
+            vcf_file,
+            fasta_file,
+            output_file,
+            checkpoint_interval=0,
+        )
+    monkeypatch.setattr(variant_centered, "write_rows", write_rows)
+    checkpoint_file = tmp_path / "out.tsv.checkpoint"
+    assert checkpoint_file.exists()
+    variant_centered.score_variants(
+        model_config,
+        vcf_file,
+        fasta_file,
+        output_file,
+        checkpoint_interval=0,
+        resume=True,
+    )
+    assert not checkpoint_file.exists()
+    assert output_file.read_text() == expected_output_file.read_text()
+
+
+class PairModel:
+    """A model that returns every one hot encoded sequence as prediction
+    and optionally only infers with a single pair of sequences at once"""
+
+    def __init__(self, pairs_only=False, error=ValueError):
+        self.pairs_only = pairs_only
+        self.error = error
+        self.batch_lengths = []
+
+    def predict_on_batch(self, batch):
+        if self.pairs_only and len(batch) != 2:
+            raise self.error("Only a pair of sequences is supported")
+        self.batch_lengths.append(len(batch))
+        return batch
+
+
+@pytest.mark.parametrize("pairs_only", [False, True])
+def test_variant_centered_get_pair_scores(pairs_only):
+    refs = ["ACGTA", "TTGCA"]
+    alts = ["ACTTA", "ACCTA", "TTACA"]
+    kipoi_model = PairModel(pairs_only)
+    model = {
+        "config": SimpleNamespace(model="Basenji"),
+        "kipoi_model": kipoi_model,
+        "transform": variant_centered.BatchOneHot(),
+        "scoring_functions": [
+            variant_centered.VARIANT_CENTERED_MODEL_GROUP_CONFIGS["Basenji"][
+                "default_scoring_function"
+            ]
+        ],
+        "pairs_per_batch": 2,
+    }
+    ref_inverse = np.array([0, 0, 1])
+    expected_scores = np.concatenate(
+        [
+            model["scoring_functions"][0]["func"](
+                model["transform"]([refs[ref_index]])[0],
+                model["transform"]([alt])[0],
+            )
+            for ref_index, alt in zip(ref_inverse, alts)
+        ]
+    )
+    if pairs_only:
+        with pytest.warns(UserWarning):
+            pair_scores = variant_centered.get_pair_scores(
+                model, refs, alts, ref_inverse, [None] * 3
+            )
+        assert kipoi_model.batch_lengths == [2, 2, 2]
+        assert model["pairs_per_batch"] == 1
+    else:
+        pair_scores = variant_centered.get_pair_scores(
+            model, refs, alts, ref_inverse, [None] * 3
+        )
+        assert kipoi_model.batch_lengths == [4, 2]
+    assert pair_scores.shape == (3, 4)
+    assert np.all(pair_scores == expected_scores.astype(np.float32))
+
+
+def test_variant_centered_iter_scores(tmp_path):
+    test_dir = Path(__file__).resolve().parent
+    vcf_file = str(test_dir / "data" / "general" / "test.vcf")
+    fasta_file = str(test_dir / "data" / "general" / "hg38_chr22.fa")
+    model_configs = [
+        variant_centered.get_model_config("DeepSEA/predict", batch_size=3),
+        variant_centered.get_model_config("pwm_HOCOMOCO/human/AHR"),
+    ]
+    output_file = tmp_path / "out.tsv"
+    variant_centered.score_variants_multi_model(
+        model_configs, vcf_file, fasta_file, output_file
+    )
+    expected = pd.read_csv(output_file, sep="\t")
+    scored_batches = list(
+        variant_centered.iter_scores(model_configs, vcf_file, fasta_file)
+    )
+    assert all(len(batch.scores) <= 3 for batch in scored_batches)
+    assert all(batch.scores.dtype == np.float32 for batch in scored_batches)
+    assert scored_batches[0].column_labels == list(expected.columns[5:])
+    assert list(
+        np.concatenate([batch.variants["pos"] for batch in scored_batches])
+    ) == list(expected["POS"])
+    scores = np.concatenate([batch.scores for batch in scored_batches])
+    assert np.allclose(scores, expected.iloc[:, 5:].to_numpy(np.float32))
+    # Variants in memory are scored the same way
+    variants = expected.iloc[:, :5]
+    for in_memory_variants in [variants, variants.itertuples(index=False)]:
+        assert np.array_equal(
+            np.concatenate(
+                [
+                    batch.scores
+                    for batch in variant_centered.iter_scores(
+                        model_configs, in_memory_variants, fasta_file
+                    )
+                ]
+            ),
+            scores,
+        )
+
+
+def test_variant_centered_get_variants():
+    variants = pd.DataFrame(
+        {
+            "chrom": ["chr1", "chr2"],
+            "pos": [20, 5],
+            "ref": ["A", "C"],
+            "alt": ["G", "CT"],
+        }
+    )
+    expected_variants = [
+        Variant(chrom="chr1", pos=20, ref="A", alt="G"),
+        Variant(chrom="chr2", pos=5, ref="C", alt="CT"),
+    ]
+    assert list(variant_centered.get_variants(variants)) == expected_variants
+    assert (
+        list(
+            variant_centered.get_variants(
+                [("chr1", "20", None, "A", "G"), expected_variants[1]]
+            )
+        )
+        == expected_variants
+    )
+    with pytest.raises(ValueError):
+        list(variant_centered.get_variants(variants.drop(columns="alt")))
+
+
+def test_variant_centered_score_batch_pair_rows():
+    # diff keeps the position axis of Basenji predictions. Every variant
+    # gets the first row of its scores like with a single pair per batch.
+    variants = [
+        Variant("chr1", 3, "G", "T"),
+        Variant("chr1", 3, "G", "C"),
+        Variant("chr2", 3, "G", "A"),
+        Variant("chr1", 3, "G", "T"),
+        Variant("chr3", 3, "C", "G"),
+    ]
+    refs = ["ACGTA", "ACGTA", "TTGCA", "ACGTA", "GGCAT"]
+    alts = ["ACTTA", "ACCTA", "TTACA", "ACTTA", "GGGAT"]
+    transform = variant_centered.BatchOneHot()
+    model = {
+        "config": SimpleNamespace(model="Basenji", batch_size=1),
+        "kipoi_model": PairModel(),
+        "sequence_length": 5,
+        "transform": transform,
+        "scoring_functions": [{"name": "diff", "func": scores.diff}],
+        "pairs_per_batch": 4,
+    }
+    expected_scores = np.stack(
+        [
+            scores.diff(transform([ref])[0], transform([alt])[0])[0]
+            for ref, alt in zip(refs, alts)
+        ]
+    )
+    (batch_scores,) = variant_centered.score_batch(
+        [model], refs, alts, variants
+    )
+    assert batch_scores.shape == (5, 4)
+    assert np.array_equal(batch_scores, expected_scores)
+
+
+def test_variant_centered_get_pair_scores_other_errors():
+    kipoi_model = PairModel(pairs_only=True, error=RuntimeError)
+    model = {
+        "config": SimpleNamespace(model="Basenji"),
+        "kipoi_model": kipoi_model,
+        "transform": variant_centered.BatchOneHot(),
+        "scoring_functions": [
+            variant_centered.VARIANT_CENTERED_MODEL_GROUP_CONFIGS["Basenji"][
+                "default_scoring_function"
+            ]
+        ],
+        "pairs_per_batch": 2,
+    }
+    with pytest.raises(RuntimeError):
+        variant_centered.get_pair_scores(
+            model, ["ACGTA"], ["ACTTA", "ACCTA"], np.array([0, 0]), [None] * 2
+        )
+    assert model["pairs_per_batch"] == 2